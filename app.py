@@ -1,45 +1,69 @@
 import os
 import sys
 
-import joblib
-
-from ingest import rebuild_vectorizer, create_database_and_table
+from ingest import update_index, create_database_and_table
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 if ROOT_DIR not in sys.path:
     sys.path.insert(0, ROOT_DIR)
 
 import streamlit as st
-from sklearn.metrics.pairwise import cosine_similarity
 
 from src.highlighter import (
     split_into_sentences,
     vectorize_sentences,
     calculate_sentence_similarity_matrix,
-    identify_matching_sentences,
-    generate_html_report
+    best_sentence_matches,
+    generate_html_report,
+    generate_passage_report
 )
+from src.alignment import align_passages
 
-from src.utils import read_uploaded_file, get_all_documents_from_db, get_document_by_filename, \
-    delete_document_by_filename
+from src.utils import read_uploaded_file, read_uploaded_files, list_documents_in_db, get_document_by_filename, \
+    delete_document_by_filename, insert_documents_into_db, get_corpus_version
 from src.vectorizer import vectorize_corpus
 from src.similarity import calculate_similarity
+from src.corpus_index import compact_in_background
+from src.engine import read_engine_version, saved_index_exists, shared_engine
+from src.minhash import get_minhash_config
+from src.checks import SEARCH_EXHAUSTIVE, SEARCH_LSH, SEARCH_LSA, check_state, corpus_check
+from src.jobs import JobQueue, QueueFull, QUEUED, RUNNING, DONE, FAILED
+from src.profiling import profiling
+from src.storage import content_hash
 
+# How often a page waiting for a corpus check looks at its job.
+JOB_POLL_SECONDS = 1.5
 
-VECTORIZER_PATH = os.path.join("models", "tfidf_vectorizer.joblib")
-def load_vectorizer(path):
-    try:
-        vectorizer=joblib.load(path)
-        return vectorizer
-    except FileNotFoundError:
-        st.error(
-            f"Error: Vectorizer model not found at '{path}'. "
-            "Please run the `ingest.py` script to create the model."
-        )
-        return None
-    except Exception as e:
-        st.error(f"An unexpected error occurred while loading the model: {e}")
-        return None
+
+def current_engine():
+    """Return the engine for the current corpus, updating the index first if the corpus has changed."""
+    if saved_index_exists() and read_engine_version() != get_corpus_version():
+        refresh_index()
+    engine = shared_engine()
+    if engine is None:
+        raise ValueError("Corpus index not found. Please run the `ingest.py` script to create the model.")
+    return engine
+
+
+def run_corpus_job(params, suspect_text):
+    # Runs on a job worker thread, so it must not call Streamlit.
+    with profiling() as profile:
+        result = corpus_check(current_engine(), suspect_text, params["filename"], params["search_mode"])
+    result["timing"] = profile.rows()
+    result["counters"] = dict(profile.counters)
+    return result
+
+
+@st.cache_resource(show_spinner=False)
+def job_queue():
+    # One queue per server process; every session submits to it.
+    return JobQueue(run_corpus_job)
+
+
+def refresh_index():
+    index = update_index()
+    if index is not None and index.needs_compaction():
+        compact_in_background()
 
 
 def load_css():
@@ -60,14 +84,14 @@ def corpus_management():
 
     st.subheader("📚 Corpus Management")
 
-    corpus_docs = get_all_documents_from_db()
+    corpus_docs = list_documents_in_db()
 
     if not corpus_docs:
         st.warning("Corpus is currently empty. Please add reference documents.")
     else:
         st.success(f"Corpus contains {len(corpus_docs)} documents.")
         with st.expander("View corpus documents"):
-            for filename, _ in corpus_docs:
+            for _, filename, _ in corpus_docs:
                 with st.expander(f"📄 {filename}"):
                     if st.button(f"👁 View content", key=f"view_{filename}"):
                         doc = get_document_by_filename(filename)
@@ -89,7 +113,7 @@ def corpus_management():
                         with col1:
                             if st.button("✅ Yes, delete", key=f"yes_{filename}"):
                                 delete_document_by_filename(filename)
-                                rebuild_vectorizer()
+                                refresh_index()
                                 st.success(f"Deleted {filename}")
                                 st.session_state.pop(f"confirm_{filename}")
                                 st.rerun()
@@ -111,17 +135,28 @@ def corpus_management():
         if not corpus_uploads:
             st.warning("Please upload at least one document.")
         else:
-            from src.utils import insert_document_into_db
-
-            for file in corpus_uploads:
-                text = read_uploaded_file(file)
-                insert_document_into_db(file.name, text)
+            with st.spinner("Extracting text..."):
+                texts = read_uploaded_files(corpus_uploads)
+            readable = [(file.name, text) for file, text in zip(corpus_uploads, texts) if text is not None]
+            results = insert_documents_into_db(readable)
+            notices = []
+            for (name, _), (stored_name, duplicate_of) in zip(readable, results):
+                if duplicate_of is not None:
+                    notices.append(f"Skipped {name}: same content as {duplicate_of}.")
+                elif stored_name != name:
+                    notices.append(f"{name} is already taken by another document; stored as {stored_name}.")
             with st.spinner("Updating model..."):
-                rebuild_vectorizer()
+                refresh_index()
             st.success("Documents added to corpus successfully.")
+            # Shown after the rerun, which refreshes the document list.
+            st.session_state["corpus_notices"] = notices
             st.rerun()
 
+    for notice in st.session_state.pop("corpus_notices", []):
+        st.info(notice)
+
     st.divider()
+    return corpus_docs
 def main():
     st.title("📄 Plagiarism Checker")
     st.markdown("""
@@ -145,6 +180,7 @@ def main():
 
     uploaded_file1 = None
     uploaded_file2 = None
+    search_mode = SEARCH_EXHAUSTIVE
     st.divider()
     if mode == "Compare two files":
         st.subheader("Mode: Compare Two Files")
@@ -164,8 +200,7 @@ def main():
             )
 
     elif mode == "Compare against corpus":
-        corpus_management()
-        corpus_docs = get_all_documents_from_db()
+        corpus_docs = corpus_management()
         if not corpus_docs:
             st.error("Corpus is empty. Please add documents before comparing.")
             st.stop()
@@ -178,113 +213,210 @@ def main():
             type=['txt', 'pdf', 'docx'],
             key="corpus_check_file"
         )
+        search_modes = [SEARCH_EXHAUSTIVE]
+        if get_minhash_config() is not None:
+            search_modes.append(SEARCH_LSH)
+        engine = shared_engine()
+        if engine is not None and engine.has_lsa:
+            search_modes.append(SEARCH_LSA)
+        if len(search_modes) > 1:
+            search_mode = st.radio(
+                "Search mode:",
+                search_modes,
+                horizontal=True,
+                help="MinHash LSH only scores documents that share a signature band with the "
+                     "suspect document. It is much faster on large corpora but can miss weak matches. "
+                     "LSA embeddings compare documents by topic rather than exact words, so lightly "
+                     "paraphrased text still matches; scores run higher than with TF-IDF."
+            )
 
     st.divider()
     if st.button("Check for Plagiarism"):
-        if mode == "Compare two files":
-            if not uploaded_file1 or not uploaded_file2:
-                st.warning("Please upload both files.")
-                return
+        with profiling() as profile:
+            check_plagiarism(mode, uploaded_file1, uploaded_file2, search_mode)
+        if profile.spans and mode == "Compare two files":
+            show_timing(profile.rows(), profile.counters)
+
+    if mode == "Compare against corpus":
+        # The job id is kept in the URL too, so a reconnecting browser picks its check up again.
+        job_id = st.session_state.get("corpus_job") or st.query_params.get("job")
+        if job_id is not None and str(job_id).isdigit():
+            show_corpus_job(int(job_id))
+
+
+def show_timing(rows, counters):
+    with st.expander("⏱️ Timing"):
+        st.dataframe(rows, hide_index=True)
+        st.caption(", ".join(f"{name}: {total}" for name, total in counters.items()))
+
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def poll_corpus_job(job_id):
+    job = job_queue().get(job_id)
+    if job is None or job["status"] not in (QUEUED, RUNNING):
+        st.rerun(scope="app")
+    if job["status"] == QUEUED:
+        st.info(f"Checking {job['params']['filename']}: queued behind {job['ahead']} other check(s)...")
+    else:
+        st.info(f"Checking {job['params']['filename']} against the corpus...")
+
+
+def show_corpus_job(job_id):
+    job = job_queue().get(job_id)
+    if job is None:
+        st.session_state.pop("corpus_job", None)
+        st.query_params.pop("job", None)
+        return
+    if job["status"] in (QUEUED, RUNNING):
+        poll_corpus_job(job_id)
+    elif job["status"] == FAILED:
+        st.error(job["error"])
+    elif job["status"] == DONE:
+        render_corpus_result(job["result"], job_queue().text(job_id))
+
+
+def render_corpus_result(result, suspect_text):
+    st.success(f"Checked {result['filename']} against a corpus of {result['corpus_size']} documents.")
+    if result["candidates"] is not None:
+        st.caption(f"LSH returned {result['candidates']} candidate(s) out of {result['corpus_size']} documents.")
+    st.subheader("Top 5 Most Similar Documents from Corpus")
+    if not result["top_matches"]:
+        st.info("No documents in the corpus to compare against.")
+    else:
+        for filename, score in result["top_matches"]:
+            percentage_score = score * 100
+            st.markdown(f"**- {filename}:** `{percentage_score:.2f}%` similar")
+            st.progress(min(max(score, 0.0), 1.0))
+
+        st.markdown("---")
+        st.info(
+            "This report shows the documents from the corpus with the highest textual similarity to your uploaded document.")
+
+    if result.get("aligned"):
+        st.subheader("Matched Passages")
+        st.caption("Highlighted passages appear, possibly reworded, in one of the top matches. "
+                   "Click a highlight to jump to its source passage.")
+        st.markdown(generate_passage_report(suspect_text, result["aligned"]), unsafe_allow_html=True)
+
+    if result["sentences"] is not None:
+        st.subheader("Detailed Plagiarism Report")
+        st.caption("Highlighted sentences match a sentence in the corpus. "
+                   "Hover over a highlight to see its source.")
+        matches = {int(i): match for i, match in result["sentence_matches"].items()}
+        sources = {
+            i: f"{filename} ({score * 100:.0f}%): {source_sentence}"
+            for i, (filename, score, source_sentence) in matches.items()
+        }
+        html_report = generate_html_report(result["sentences"], matches.keys(), sources)
+        st.markdown(html_report, unsafe_allow_html=True)
+
+    if result["copied"] is not None:
+        st.subheader("Copied Passages")
+        if not result["copied"]:
+            st.info("No passages were found copied verbatim from the corpus.")
+        for match in result["copied"]:
+            st.markdown(
+                f"**- {match['filename']}:** {len(match['passages'])} passage(s) covering "
+                f"`{match['coverage'] * 100:.2f}%` of your document"
+            )
+            with st.expander(f"Show passages from {match['filename']}"):
+                for passage in match["passages"]:
+                    st.text(passage)
 
-            with st.spinner("Analyzing documents... This may take a moment."):
-                try:
-                    source_text = read_uploaded_file(uploaded_file1)
-                    suspect_text = read_uploaded_file(uploaded_file2)
+    if result.get("timing"):
+        show_timing(result["timing"], result.get("counters", {}))
 
-                    vectors = vectorize_corpus([source_text, suspect_text])
-                    similarity = calculate_similarity(
-                        vectors[0:1],
-                        vectors[1:2]
-                    )
-                    tab_summary, tab_report = st.tabs(["📊 Summary", "📄 Detailed Report"])
-                    with tab_summary:
-                        st.success("Analysis complete!")
-                        st.progress(min(max(similarity / 100, 0.0), 1.0))
-                        st.metric(label="Document Similarity", value=f"{similarity:.2f}%")
-                        st.divider()
-                    with tab_report:
-                        st.caption("Highlighted sentences indicate potential plagiarism.")
-                        st.subheader("Detailed Plagiarism Report")
-
-                        # 2. Split into sentences
-                        source_sentences = split_into_sentences(source_text)
-                        suspect_sentences = split_into_sentences(suspect_text)
-
-                        # 3. Vectorize sentences
-                        source_vectors, suspect_vectors = vectorize_sentences(source_sentences, suspect_sentences)
-
-                        # 4. Calculate sentence similarity matrix
-                        sim_matrix = calculate_sentence_similarity_matrix(source_vectors, suspect_vectors)
-
-                        # 5. Identify matching sentences based on a threshold
-                        plagiarized_indices = identify_matching_sentences(sim_matrix, threshold=0.8)
-
-                        # 6. Generate the HTML report
-                        html_report = generate_html_report(suspect_sentences, plagiarized_indices)
-
-                        # 7. Render the final HTML report
-                        # We use unsafe_allow_html=True because we have constructed our own HTML.
-                        # This is safe because we used html.escape() in our generator function.
-                        st.markdown(html_report, unsafe_allow_html=True)
-                except Exception as e:
-                    st.error(f"An error occurred during detailed analysis: {e}")
-        elif mode == "Compare against corpus":
-            vectorizer = load_vectorizer(VECTORIZER_PATH)
-            if vectorizer is None:
-                st.stop()
-            if uploaded_file1:
-                with st.spinner("Loading corpus from database and analyzing..."):
-                    try:
-                        suspect_text=read_uploaded_file(uploaded_file1)
-                        corpus_docs=get_all_documents_from_db()
-                        suspect_filename = uploaded_file1.name
-                        corpus_filenames = {doc[0] for doc in corpus_docs}
-
-                        if suspect_filename in corpus_filenames:
-                            st.error(
-                                "This document already exists in the corpus. "
-                                "A document cannot be compared against itself."
-                            )
-                            st.stop()
-                        if not corpus_docs:
-                            st.error(
-                        "Could not retrieve documents from the corpus database. Is the database empty? Please run ingest.py.")
-                        else:
-                            st.success(f"Successfully loaded {len(corpus_docs)} documents from the corpus.")
-                            corpus_texts = [doc[1] for doc in corpus_docs]
-                            master_corpus = [suspect_text] + corpus_texts
-                            vectors = vectorize_corpus(master_corpus)
-                            st.success("Vectorization complete! Now calculating similarities...")
-                            suspect_vector = vectors[0:1]
-                            corpus_vectors = vectors[1:]
-                            similarity_scores_matrix = cosine_similarity(suspect_vector, corpus_vectors)
-                            scores = similarity_scores_matrix.flatten()
-                            corpus_filenames = [doc[0] for doc in corpus_docs]
-                            results = list(zip(corpus_filenames, scores))
-                            sorted_results = sorted(results, key=lambda item: item[1], reverse=True)
-                            st.subheader("Top 5 Most Similar Documents from Corpus")
-                            if not sorted_results:
-                                st.info("No documents in the corpus to compare against.")
-                            else:
-                                top_5_results = sorted_results[:5]
-
-                                for filename, score in top_5_results:
-                                    percentage_score = score * 100
-                                    st.markdown(f"**- {filename}:** `{percentage_score:.2f}%` similar")
-                                    st.progress(score)
-
-                                st.markdown("---")
-                                st.info(
-                                    "This report shows the documents from the corpus with the highest textual similarity to your uploaded document.")
-                    except Exception as e:
-                        st.error(f"An error occurred during processing: {e}")
-            else:
-                st.warning("Please upload a file to check against the corpus.")
 
-        else:
-            st.warning("Please upload both documents before checking for plagiarism.")
+def check_plagiarism(mode, uploaded_file1, uploaded_file2, search_mode):
+    if mode == "Compare two files":
+        if not uploaded_file1 or not uploaded_file2:
+            st.warning("Please upload both files.")
+            return
+
+        with st.spinner("Analyzing documents... This may take a moment."):
+            try:
+                source_text = read_uploaded_file(uploaded_file1)
+                suspect_text = read_uploaded_file(uploaded_file2)
+
+                # Interactive checks preprocess in this process: spawning a pool per request, whose
+                # workers re-import NLTK and scikit-learn, costs more than it saves at these sizes.
+                vectors = vectorize_corpus([source_text, suspect_text], workers=1)
+                similarity = calculate_similarity(
+                    vectors[0:1],
+                    vectors[1:2]
+                )
+                tab_summary, tab_report = st.tabs(["📊 Summary", "📄 Detailed Report"])
+                with tab_summary:
+                    st.success("Analysis complete!")
+                    st.progress(min(max(similarity / 100, 0.0), 1.0))
+                    st.metric(label="Document Similarity", value=f"{similarity:.2f}%")
+                    st.divider()
+                with tab_report:
+                    st.caption("Highlighted sentences indicate potential plagiarism.")
+                    st.subheader("Detailed Plagiarism Report")
+
+                    # 2. Split into sentences
+                    source_sentences = split_into_sentences(source_text)
+                    suspect_sentences = split_into_sentences(suspect_text)
+
+                    # 3. Vectorize sentences
+                    source_vectors, suspect_vectors = vectorize_sentences(source_sentences, suspect_sentences,
+                                                                           workers=1)
+
+                    # 4. Calculate the sparse sentence similarity matrix, keeping only
+                    #    each suspect sentence's best match above the threshold
+                    sim_matrix = calculate_sentence_similarity_matrix(
+                        source_vectors, suspect_vectors, threshold=0.8, top_k=1
+                    )
 
+                    # 5. Identify matching sentences and what they matched
+                    matches = best_sentence_matches(sim_matrix, threshold=0.8)
+                    sources = {
+                        i: f"Source sentence {j + 1} ({score * 100:.0f}%): {source_sentences[j]}"
+                        for i, (j, score) in matches.items()
+                    }
+
+                    # 6. Generate the HTML report
+                    html_report = generate_html_report(suspect_sentences, matches.keys(), sources)
+
+                    # 7. Render the final HTML report
+                    # We use unsafe_allow_html=True because we have constructed our own HTML.
+                    # This is safe because we used html.escape() in our generator function.
+                    st.markdown(html_report, unsafe_allow_html=True)
+
+                    # 8. Align the documents to show exactly which passages were copied
+                    aligned = align_passages(suspect_text, [(uploaded_file1.name, source_text)])
+                    if aligned:
+                        st.subheader("Matched Passages")
+                        st.markdown(generate_passage_report(suspect_text, aligned), unsafe_allow_html=True)
+            except Exception as e:
+                st.error(f"An error occurred during detailed analysis: {e}")
+    elif mode == "Compare against corpus":
+        if not uploaded_file1:
+            st.warning("Please upload a file to check against the corpus.")
+            return
+        try:
+            suspect_text = read_uploaded_file(uploaded_file1)
+            if suspect_text is None:
+                st.error("Could not read the uploaded file.")
+                return
+            # Resubmitting the same check for the same corpus and indexes returns the existing job.
+            job_key = (f"corpus:{get_corpus_version()}:{check_state()}:{search_mode}:{uploaded_file1.name}:"
+                       f"{content_hash(suspect_text)}")
+            job_id = job_queue().submit(
+                job_key, suspect_text, {"filename": uploaded_file1.name, "search_mode": search_mode}
+            )
+        except QueueFull as e:
+            st.warning(str(e))
+            return
+        except Exception as e:
+            st.error(f"An error occurred while submitting the check: {e}")
+            return
+        st.session_state["corpus_job"] = job_id
+        st.query_params["job"] = str(job_id)
 
+    else:
+        st.warning("Please upload both documents before checking for plagiarism.")
 
 
 
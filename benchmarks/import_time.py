@@ -0,0 +1,67 @@
+"""Check the startup cost of the CLI and app entry points against a time budget.
+
+Run from the repository root:
+
+    python -m benchmarks.import_time
+
+Each entry point is started in a fresh interpreter several times and the
+median wall time is compared with its budget; the script exits non-zero
+when any entry point is over budget. Use `python -X importtime` on the
+same command to see which imports are responsible.
+"""
+import argparse
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Median wall-clock budgets in seconds, interpreter start-up included.
+BUDGETS = {
+    "cli --help": ([os.path.join(ROOT_DIR, "main_cli.py"), "--help"], 0.5),
+    "import main_cli": (["-c", "import main_cli"], 0.5),
+    "import app": (["-c", "import app"], 4.0),
+}
+
+
+def measure(args, repeat):
+    """Return the median wall time of `python *args`, or None if it fails."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, *args], cwd=ROOT_DIR,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode != 0:
+            return None
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure entry-point start-up time against a budget.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per entry point (default: %(default)s).")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="Multiply every budget by this factor, e.g. on slow CI machines.")
+    args = parser.parse_args()
+
+    over_budget = []
+    for name, (command, budget) in BUDGETS.items():
+        budget *= args.scale
+        seconds = measure(command, args.repeat)
+        if seconds is None:
+            over_budget.append(name)
+            print(f"{name:<18} FAILED (run `python {shlex.join(command)}` to see the error)")
+            continue
+        status = "ok" if seconds <= budget else "OVER BUDGET"
+        if seconds > budget:
+            over_budget.append(name)
+        print(f"{name:<18} {seconds:>7.3f}s  (budget {budget:.2f}s)  {status}")
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
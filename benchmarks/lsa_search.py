@@ -0,0 +1,123 @@
+"""Compare LSA embedding search with plain TF-IDF search on a synthetic corpus.
+
+Run from the repository root:
+
+    python -m benchmarks.lsa_search --documents 2000 --dimensions 64,128,256
+    python -m benchmarks.lsa_search --paraphrase-rate 0.5 -o lsa.json
+
+Each suspect document copies some sentences from one corpus document;
+--paraphrase-rate then rewords the suspects by replacing that share of
+their words. For TF-IDF and each LSA dimension, reports the fit time, query
+latency (p50/p95, preprocessing excluded) and recall: the share of
+suspects whose source is the best match, and is among the --top-k best.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.synthetic import TextGenerator, generate_corpus
+from src.corpus_index import build_corpus_index
+from src.lsa import fit_lsa_index
+from src.parallel import preprocess_documents
+
+
+def paraphrase(text, rate, rng, vocabulary):
+    """Replace each word of `text` with a random vocabulary word with probability `rate`."""
+    return " ".join(rng.choice(vocabulary) if rng.random() < rate else word for word in text.split())
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def run_queries(name, query, suspect_tokens, sources, top_k, fit_seconds):
+    latencies, hits_1, hits_k = [], 0, 0
+    for tokens, source in zip(suspect_tokens, sources):
+        start = time.perf_counter()
+        matches = query(tokens, top_k)
+        latencies.append(time.perf_counter() - start)
+        names = [filename for filename, _ in matches]
+        hits_1 += bool(names) and names[0] == f"doc_{source}.txt"
+        hits_k += f"doc_{source}.txt" in names
+    result = {
+        "mode": name,
+        "fit_seconds": round(fit_seconds, 4),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "recall_at_1": round(hits_1 / len(sources), 4),
+        f"recall_at_{top_k}": round(hits_k / len(sources), 4),
+    }
+    print(f"{name:<10} fit {result['fit_seconds']:>8.3f}s p50 {result['p50_ms']:>8.3f}ms "
+          f"p95 {result['p95_ms']:>8.3f}ms recall@1 {result['recall_at_1']:.3f} "
+          f"recall@{top_k} {result[f'recall_at_{top_k}']:.3f}", file=sys.stderr)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare LSA embedding search with TF-IDF search.")
+    parser.add_argument("--documents", type=int, default=2000, help="Corpus size (default: %(default)s).")
+    parser.add_argument("--sentences", type=int, default=20, help="Sentences per document (default: %(default)s).")
+    parser.add_argument("--queries", type=int, default=100, help="Suspect documents (default: %(default)s).")
+    parser.add_argument("--plagiarism-rate", type=float, default=0.3,
+                        help="Share of suspect sentences copied from the source (default: %(default)s).")
+    parser.add_argument("--paraphrase-rate", type=float, default=0.3,
+                        help="Share of suspect words replaced, rewording the copies (default: %(default)s).")
+    parser.add_argument("--dimensions", default="64,128,256",
+                        help="Comma-separated LSA dimensions to try (default: %(default)s).")
+    parser.add_argument("--top-k", type=int, default=5, help="Matches per query (default: %(default)s).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Preprocessing processes (default: one per CPU).")
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    corpus, suspects, sources = generate_corpus(
+        args.documents, args.sentences, args.queries, args.plagiarism_rate, args.seed
+    )
+    rng = random.Random(args.seed)
+    vocabulary = TextGenerator(random.Random(args.seed)).vocabulary
+    suspects = [paraphrase(text, args.paraphrase_rate, rng, vocabulary) for text in suspects]
+    token_lists = preprocess_documents(corpus, args.workers)
+    suspect_tokens = preprocess_documents(suspects, args.workers)
+    doc_ids = list(range(args.documents))
+    filenames = [f"doc_{i}.txt" for i in doc_ids]
+
+    results = []
+    with tempfile.TemporaryDirectory() as scratch:
+        start = time.perf_counter()
+        index = build_corpus_index(doc_ids, filenames, token_lists, 0, os.path.join(scratch, "index"))
+        index.weighted_matrix()
+        fit_seconds = time.perf_counter() - start
+        results.append(run_queries("tfidf", index.query_tokens, suspect_tokens, sources, args.top_k, fit_seconds))
+
+        for dimensions in (int(d) for d in args.dimensions.split(",")):
+            start = time.perf_counter()
+            lsa_index = fit_lsa_index(index, dimensions, os.path.join(scratch, f"lsa_{dimensions}"), args.seed)
+            fit_seconds = time.perf_counter() - start
+            if lsa_index is None:
+                print(f"Too few documents for {dimensions} LSA dimensions.", file=sys.stderr)
+                continue
+            result = run_queries(f"lsa_{lsa_index.dimensions}", lsa_index.query_tokens, suspect_tokens, sources,
+                                 args.top_k, fit_seconds)
+            result["dimensions"] = lsa_index.dimensions
+            results.append(result)
+
+    report = {"args": vars(args), "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Compare the "fast" preprocessing mode with the NLTK pipeline on a sample corpus.
+
+Run from the repository root:
+
+    python -m benchmarks.preprocessing_modes --documents 500
+    python -m benchmarks.preprocessing_modes --db corpus.db --sample 1000
+
+Reports each mode's throughput in a single process and how closely the
+fast tokens agree with the NLTK tokens: the share of documents with
+identical token lists, and token-level agreement (the multiset overlap
+of the two token lists over the longer one), with the most frequent
+differences. Synthetic text has no real inflections, so prefer --db or
+--corpus-dir to judge the lemma table.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from benchmarks.synthetic import generate_corpus
+from src.preprocessing import PREPROCESSING_MODES, get_lemma_table, preprocess_text
+from src.storage import fetch_all_documents
+from src.utils import extract_texts
+
+
+def load_sample(args):
+    if args.db:
+        texts = [text for _, text in fetch_all_documents(args.db)]
+    elif args.corpus_dir:
+        paths = sorted(os.path.join(args.corpus_dir, name) for name in os.listdir(args.corpus_dir))
+        files = []
+        for path in paths:
+            if os.path.isfile(path):
+                with open(path, "rb") as f:
+                    files.append((path, f.read()))
+        texts = [text for text in extract_texts(files).values() if text]
+    else:
+        texts, _, _ = generate_corpus(args.documents, args.sentences, 0, 0, args.seed)
+    if args.sample and len(texts) > args.sample:
+        texts = random.Random(args.seed).sample(texts, args.sample)
+    return texts
+
+
+def run_mode(texts, mode):
+    start = time.perf_counter()
+    token_lists = [preprocess_text(text, mode) for text in texts]
+    seconds = time.perf_counter() - start
+    tokens = sum(len(tokens) for tokens in token_lists)
+    return token_lists, {
+        "mode": mode,
+        "seconds": round(seconds, 4),
+        "documents_per_s": round(len(texts) / seconds, 1) if seconds else None,
+        "tokens_per_s": round(tokens / seconds, 1) if seconds else None,
+        "tokens": tokens,
+    }
+
+
+def agreement(reference, candidate, top):
+    identical = 0
+    overlap = total = 0
+    missing, extra = Counter(), Counter()
+    for expected, actual in zip(reference, candidate):
+        identical += expected == actual
+        expected, actual = Counter(expected), Counter(actual)
+        overlap += sum((expected & actual).values())
+        total += max(sum(expected.values()), sum(actual.values()))
+        missing.update(expected - actual)
+        extra.update(actual - expected)
+    return {
+        "identical_documents": round(identical / len(reference), 4) if reference else None,
+        "token_agreement": round(overlap / total, 4) if total else None,
+        "only_nltk": missing.most_common(top),
+        "only_fast": extra.most_common(top),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the fast and NLTK preprocessing modes.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--db", help="Sample documents from this corpus database.")
+    source.add_argument("--corpus-dir", help="Sample documents from the .txt/.docx/.pdf files in this directory.")
+    parser.add_argument("--documents", type=int, default=500,
+                        help="Synthetic documents when no --db or --corpus-dir is given (default: %(default)s).")
+    parser.add_argument("--sentences", type=int, default=20, help="Sentences per synthetic document.")
+    parser.add_argument("--sample", type=int, default=None, help="Use at most this many documents.")
+    parser.add_argument("--top", type=int, default=15, help="Differences to list (default: %(default)s).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    texts = load_sample(args)
+    if not texts:
+        print("No documents to preprocess.", file=sys.stderr)
+        sys.exit(1)
+
+    # Load NLTK's data and the lemma table up front so neither run pays for it.
+    start = time.perf_counter()
+    table = get_lemma_table()
+    table_seconds = time.perf_counter() - start
+    preprocess_text(texts[0], "nltk")
+
+    token_lists, throughput = {}, []
+    for mode in PREPROCESSING_MODES:
+        token_lists[mode], result = run_mode(texts, mode)
+        throughput.append(result)
+        print(f"{mode:<5} {result['seconds']:>9.3f}s {result['documents_per_s'] or 0:>10.1f} docs/s "
+              f"{result['tokens_per_s'] or 0:>12.1f} tokens/s", file=sys.stderr)
+    speedup = throughput[0]["seconds"] / throughput[1]["seconds"] if throughput[1]["seconds"] else None
+    result = agreement(token_lists["nltk"], token_lists["fast"], args.top)
+    print(f"fast speed-up: {speedup:.1f}x, identical documents: {result['identical_documents']:.1%}, "
+          f"token agreement: {result['token_agreement']:.2%}", file=sys.stderr)
+    print(f"lemma table: {len(table)} entries, loaded in {table_seconds:.2f}s", file=sys.stderr)
+
+    report = {
+        "documents": len(texts),
+        "lemma_table_entries": len(table),
+        "lemma_table_load_seconds": round(table_seconds, 3),
+        "throughput": throughput,
+        "speedup": round(speedup, 2) if speedup else None,
+        "agreement": result,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+"""Time the ingest, query, highlighting and extraction pipelines on synthetic corpora.
+
+Run from the repository root:
+
+    python -m benchmarks.run --scales 100,1000 --output bench.json --baseline baseline.json
+
+Each stage reports throughput, p50/p95 latency and the process's peak RSS
+so far. Results are written as JSON; with --baseline, stage times are
+compared against an earlier run.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import ingest
+from benchmarks.synthetic import generate_corpus, make_docx_bytes, make_pdf_bytes
+from src.alignment import align_passages
+from src.corpus_index import build_corpus_index, load_corpus_index, SENTENCE_INDEX_DIR, DEFAULT_HASH_FEATURES
+from src.highlighter import (
+    split_into_sentences, vectorize_sentences, calculate_sentence_similarity_matrix, best_sentence_matches,
+    find_corpus_sentence_matches, generate_html_report
+)
+from src.lsa import DEFAULT_LSA_DIMENSIONS, fit_lsa_index
+from src.parallel import preprocess_documents, resolve_workers
+from src.preprocessing import preprocess_text
+from src.utils import extract_text_from_bytes, insert_documents_into_db
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+DEFAULT_SCALES = (100, 1000)
+# Stages more than this much slower than the baseline are reported as regressions.
+DEFAULT_TOLERANCE = 0.10
+
+
+def peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, round(q * (len(ordered) - 1)))]
+
+
+def record(results, scale, stage, latencies, items):
+    """Add a stage result; `latencies` holds one wall time per call, `items` counts what was processed."""
+    total = sum(latencies)
+    result = {
+        "scale": scale,
+        "stage": stage,
+        "calls": len(latencies),
+        "items": items,
+        "seconds": round(total, 6),
+        "throughput": round(items / total, 2) if total else None,
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    results.append(result)
+    print(f"{scale:>7} {stage:<22} {result['seconds']:>10.3f}s {result['throughput'] or 0:>12.1f}/s "
+          f"p50 {result['p50_ms']:>9.2f}ms p95 {result['p95_ms']:>9.2f}ms rss {result['peak_rss_mb']}MB",
+          file=sys.stderr)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    value = fn(*args)
+    return value, time.perf_counter() - start
+
+
+def time_each(fn, items):
+    latencies = []
+    for item in items:
+        latencies.append(timed(fn, item)[1])
+    return latencies
+
+
+def bench_scale(scale, args, results):
+    corpus, suspects, sources = generate_corpus(
+        scale, args.sentences, args.queries, args.plagiarism_rate, args.seed
+    )
+    workers = args.workers
+
+    latencies = time_each(preprocess_text, corpus[:args.queries])
+    record(results, scale, "preprocess_document", latencies, len(latencies))
+    token_lists, seconds = timed(preprocess_documents, corpus, workers)
+    record(results, scale, "preprocess_corpus", [seconds], len(corpus))
+
+    doc_ids = list(range(1, scale + 1))
+    filenames = [f"doc_{i}.txt" for i in doc_ids]
+    latencies = []
+    for _ in range(args.repeat):
+        index, seconds = timed(build_corpus_index, doc_ids, filenames, token_lists, 0, "fit_index")
+        latencies.append(seconds)
+    record(results, scale, "fit", latencies, scale * args.repeat)
+
+    suspect_tokens = preprocess_documents(suspects, 1)
+    latencies = time_each(lambda tokens: index.vectorize([tokens]), suspect_tokens)
+    record(results, scale, "transform", latencies, len(latencies))
+    latencies = time_each(lambda text: index.query(text, top_k=5), suspects)
+    record(results, scale, "corpus_query", latencies, len(latencies))
+
+    def build_hashed():
+        return build_corpus_index(doc_ids, filenames, token_lists, 0, "hashed_index",
+                                  hash_features=DEFAULT_HASH_FEATURES)
+
+    latencies = []
+    for _ in range(args.repeat):
+        hashed_index, seconds = timed(build_hashed)
+        latencies.append(seconds)
+    record(results, scale, "fit_hashed", latencies, scale * args.repeat)
+    latencies = time_each(lambda text: hashed_index.query(text, top_k=5), suspects)
+    record(results, scale, "corpus_query_hashed", latencies, len(latencies))
+
+    lsa_index, seconds = timed(fit_lsa_index, index, DEFAULT_LSA_DIMENSIONS, "lsa_index")
+    record(results, scale, "fit_lsa", [seconds], scale)
+    if lsa_index is not None:
+        latencies = time_each(lambda text: lsa_index.query(text, top_k=5), suspects)
+        record(results, scale, "corpus_query_lsa", latencies, len(latencies))
+
+    # The ingest path end to end: a database full rebuild, then an incremental update.
+    ingest.DATABASE_FILE = os.path.abspath(f"corpus_{scale}.db")
+    with contextlib.redirect_stdout(io.StringIO()):
+        ingest.create_database_and_table()
+        insert_documents_into_db(zip(filenames, corpus), ingest.DATABASE_FILE)
+        _, seconds = timed(ingest.rebuild_vectorizer, workers)
+    record(results, scale, "ingest_rebuild", [seconds], scale)
+    added = max(1, scale // 100)
+    extra, _, _ = generate_corpus(added, args.sentences, 0, 0, args.seed + scale)
+    with contextlib.redirect_stdout(io.StringIO()):
+        insert_documents_into_db(((f"extra_{i}.txt", t) for i, t in enumerate(extra)), ingest.DATABASE_FILE)
+        _, seconds = timed(ingest.update_index, workers)
+    record(results, scale, "ingest_update", [seconds], added)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows = [(doc_id, filename, text) for doc_id, filename, text in zip(doc_ids, filenames, corpus)]
+        _, seconds = timed(ingest.build_sentence_index, rows, 0, workers)
+    record(results, scale, "sentence_index_build", [seconds], scale)
+    sentence_index = load_corpus_index(SENTENCE_INDEX_DIR)
+    latencies = time_each(
+        lambda text: find_corpus_sentence_matches(sentence_index, split_into_sentences(text)), suspects
+    )
+    record(results, scale, "sentence_match_corpus", latencies, len(latencies))
+
+    def highlight_pair(pair):
+        source_text, suspect_text = pair
+        source_sentences = split_into_sentences(source_text)
+        suspect_sentences = split_into_sentences(suspect_text)
+        with contextlib.redirect_stdout(io.StringIO()):
+            source_vectors, suspect_vectors = vectorize_sentences(source_sentences, suspect_sentences)
+        matrix = calculate_sentence_similarity_matrix(source_vectors, suspect_vectors, threshold=0.8, top_k=1)
+        return generate_html_report(suspect_sentences, best_sentence_matches(matrix))
+
+    pairs = [(corpus[source], suspect) for source, suspect in zip(sources, suspects)]
+    latencies = time_each(highlight_pair, pairs)
+    record(results, scale, "sentence_match_pair", latencies, len(latencies))
+    latencies = time_each(lambda pair: align_passages(pair[1], [("source.txt", pair[0])]), pairs)
+    record(results, scale, "align_pair", latencies, len(latencies))
+
+
+def bench_extraction(args, results):
+    corpus, _, _ = generate_corpus(args.extraction_files, args.sentences * 5, 0, 0, args.seed)
+    for extension, make in ((".docx", make_docx_bytes), (".pdf", make_pdf_bytes)):
+        files = [make(text) for text in corpus]
+        # Extract the bytes directly so the extraction cache doesn't hide the cost.
+        latencies = time_each(lambda data: extract_text_from_bytes(data, extension), files)
+        record(results, len(files), f"extract{extension.replace('.', '_')}", latencies, len(latencies))
+
+
+def compare(results, baseline, tolerance):
+    """Print each stage's change in time per item against `baseline` and return the regressed stages."""
+    previous = {(r["scale"], r["stage"]): r for r in baseline["results"]}
+    regressions = []
+    print(f"\nCompared with baseline from {baseline['meta'].get('timestamp')}:", file=sys.stderr)
+    for result in results:
+        before = previous.get((result["scale"], result["stage"]))
+        if before is None or not before["seconds"] or not result["items"]:
+            continue
+        before_ms = before["seconds"] / before["items"] * 1000
+        after_ms = result["seconds"] / result["items"] * 1000
+        change = after_ms / before_ms - 1
+        flag = ""
+        if change > tolerance:
+            flag = "  REGRESSION"
+            regressions.append(result)
+        print(f"{result['scale']:>7} {result['stage']:<22} {before_ms:>10.3f}ms -> {after_ms:>10.3f}ms per item "
+              f"({change:+.1%}){flag}", file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the plagiarism checker on synthetic corpora.")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)),
+                        help="Comma-separated corpus sizes in documents (default: %(default)s).")
+    parser.add_argument("--sentences", type=int, default=20, help="Sentences per document (default: %(default)s).")
+    parser.add_argument("--plagiarism-rate", type=float, default=0.3,
+                        help="Share of suspect sentences copied from the corpus (default: %(default)s).")
+    parser.add_argument("--queries", type=int, default=50, help="Suspect documents per scale (default: %(default)s).")
+    parser.add_argument("--repeat", type=int, default=3, help="Repetitions of the index fit (default: %(default)s).")
+    parser.add_argument("--extraction-files", type=int, default=20,
+                        help="DOCX and PDF files to extract (default: %(default)s; 0 skips extraction).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Preprocessing processes (default: one per CPU).")
+    parser.add_argument("-o", "--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Relative slowdown reported as a regression (default: %(default)s).")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    results = []
+    started = time.strftime("%Y-%m-%dT%H:%M:%S")
+    cwd = os.getcwd()
+    # The index and database paths are relative, so work in a scratch directory.
+    with tempfile.TemporaryDirectory() as scratch:
+        os.chdir(scratch)
+        try:
+            for scale in (int(s) for s in args.scales.split(",")):
+                # A fresh directory per scale, so no index from a smaller run is updated instead of rebuilt.
+                os.chdir(scratch)
+                os.makedirs(f"scale_{scale}")
+                os.chdir(f"scale_{scale}")
+                bench_scale(scale, args, results)
+            if args.extraction_files:
+                bench_extraction(args, results)
+        finally:
+            os.chdir(cwd)
+
+    report = {
+        "meta": {
+            "timestamp": started,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "workers": resolve_workers(args.workers),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+    if baseline is not None and compare(results, baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Deterministic synthetic corpora for the benchmarks; nothing is downloaded."""
+import io
+import itertools
+import random
+from typing import List, Tuple
+
+import docx
+
+_ONSETS = ["b", "c", "d", "f", "g", "h", "l", "m", "n", "p", "r", "s", "t", "v", "br", "ch", "st", "tr"]
+_VOWELS = ["a", "e", "i", "o", "u", "ai", "ea", "ou"]
+_CODAS = ["", "", "n", "r", "s", "t", "l", "nd", "st"]
+
+
+def generate_vocabulary(size: int, rng: random.Random) -> List[str]:
+    words = set()
+    while len(words) < size:
+        syllables = rng.randint(1, 3)
+        words.add("".join(rng.choice(_ONSETS) + rng.choice(_VOWELS) + rng.choice(_CODAS)
+                          for _ in range(syllables)))
+    # Sort before shuffling: set order varies between runs with string hash randomisation.
+    words = sorted(words)
+    rng.shuffle(words)
+    return words
+
+
+class TextGenerator:
+    """Draws sentences from a vocabulary with Zipfian word frequencies, like natural text."""
+
+    def __init__(self, rng: random.Random, vocabulary_size: int = 5000):
+        self.rng = rng
+        self.vocabulary = generate_vocabulary(vocabulary_size, rng)
+        self.cum_weights = list(itertools.accumulate(1 / rank for rank in range(1, vocabulary_size + 1)))
+
+    def sentence(self, min_words: int = 8, max_words: int = 22) -> str:
+        n = self.rng.randint(min_words, max_words)
+        words = self.rng.choices(self.vocabulary, cum_weights=self.cum_weights, k=n)
+        return words[0].capitalize() + " " + " ".join(words[1:]) + "."
+
+    def document(self, sentences: int) -> List[str]:
+        return [self.sentence() for _ in range(sentences)]
+
+
+def generate_corpus(documents: int, sentences_per_document: int = 20, suspects: int = 50,
+                    plagiarism_rate: float = 0.3, seed: int = 0) -> Tuple[List[str], List[str], List[int]]:
+    """Return (corpus texts, suspect texts, source index of each suspect).
+
+    Each suspect draws on one corpus document: every sentence is copied
+    from it with probability `plagiarism_rate` and freshly generated
+    otherwise.
+    """
+    rng = random.Random(seed)
+    generator = TextGenerator(rng)
+    corpus_sentences = [generator.document(sentences_per_document) for _ in range(documents)]
+
+    suspect_texts, sources = [], []
+    for _ in range(suspects):
+        source = rng.randrange(documents)
+        sentences = [
+            rng.choice(corpus_sentences[source]) if rng.random() < plagiarism_rate else generator.sentence()
+            for _ in range(sentences_per_document)
+        ]
+        suspect_texts.append(" ".join(sentences))
+        sources.append(source)
+    return [" ".join(s) for s in corpus_sentences], suspect_texts, sources
+
+
+def make_docx_bytes(text: str) -> bytes:
+    document = docx.Document()
+    for paragraph in _wrap(text, 600):
+        document.add_paragraph(paragraph)
+    buffer = io.BytesIO()
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+def make_pdf_bytes(text: str, lines_per_page: int = 50) -> bytes:
+    """Write `text` as a minimal PDF with one Helvetica text stream per page."""
+    lines = _wrap(text, 90)
+    pages = [lines[i:i + lines_per_page] for i in range(0, len(lines), lines_per_page)] or [[]]
+    # Objects: 1 catalog, 2 page tree, 3 font, then a page and its content stream per page.
+    objects = {1: b"<< /Type /Catalog /Pages 2 0 R >>",
+               3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    kids = []
+    for n, page_lines in enumerate(pages):
+        page_id, content_id = 4 + 2 * n, 5 + 2 * n
+        kids.append(f"{page_id} 0 R")
+        shown = " ".join(f"({_pdf_escape(line)}) '" for line in page_lines)
+        body = f"BT /F1 10 Tf 12 TL 50 800 Td {shown} ET"
+        stream = body.encode("latin-1")
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream)
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+                            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>").encode()
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = {}
+    for obj_id in sorted(objects):
+        offsets[obj_id] = out.tell()
+        out.write(b"%d 0 obj\n%s\nendobj\n" % (obj_id, objects[obj_id]))
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for obj_id in sorted(objects):
+        out.write(b"%010d 00000 n \n" % offsets[obj_id])
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def _wrap(text: str, width: int) -> List[str]:
+    lines, current = [], ""
+    for word in text.split():
+        if current and len(current) + 1 + len(word) > width:
+            lines.append(current)
+            current = word
+        else:
+            current = f"{current} {word}" if current else word
+    if current:
+        lines.append(current)
+    return lines
+
+
+def _pdf_escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
@@ -9,7 +9,7 @@ def download_nltk_data():
     Downloads the NLTK data packages required for the plagiarism checker project.
     Includes a workaround for SSL certificate verification issues on some systems.
     """
-    packages = ['punkt', 'stopwords', 'wordnet']
+    packages = ['punkt', 'punkt_tab', 'stopwords', 'wordnet']
     
     print("Starting download of NLTK data packages...")
     
@@ -30,7 +30,7 @@ def download_nltk_data():
             # We construct the resource path based on common NLTK structures.
             # Note: The exact path might vary slightly depending on the package type.
             # This is a general approach to check for common package types.
-            if package_id == 'punkt':
+            if package_id in ('punkt', 'punkt_tab'):
                 nltk.data.find(f'tokenizers/{package_id}')
             elif package_id == 'stopwords':
                 nltk.data.find(f'corpora/{package_id}')
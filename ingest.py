@@ -1,12 +1,29 @@
+import argparse
 import os
+from collections import Counter
 
 import sys
 import sqlite3
-import joblib
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-
-from src.preprocessing import preprocess_text
+from src.corpus_index import build_corpus_index, load_corpus_index, remove_corpus_index, INDEX_LOCK, \
+    SENTENCE_INDEX_DIR, read_index_meta, CorpusIndex, INDEX_DIR, DEFAULT_HASH_FEATURES, \
+    compact_in_background
+from src.highlighter import split_into_sentence_spans
+from src.lsa import DEFAULT_LSA_DIMENSIONS, SENTENCE_LSA_DIR, fit_lsa_index, load_lsa_index, read_lsa_meta, \
+    remove_lsa_index
+from src.parallel import preprocess_documents
+from src.preprocessing import DEFAULT_PREPROCESSING, PREPROCESSING_MODES
+from src.sharding import SHARDS_DIR, DEFAULT_SHARD_SIZE, read_layout, save_layout, remove_layout, shard_dir, \
+    shard_range
+from src.fingerprint import fingerprints_enabled, reset_fingerprint_index, \
+    index_documents as index_fingerprints
+from src.minhash import get_minhash_config, reset_minhash_index, index_documents, DEFAULT_BANDS, DEFAULT_ROWS
+from src.storage import decode_text, migrate_documents
+from src.utils import SUPPORTED_EXTENSIONS, extract_texts, insert_documents_into_db
+from src.token_cache import (
+    create_token_cache_sql, tokenize_documents, prune_token_cache, prune_token_cache_to_corpus, token_cache_key,
+    token_cache_stats
+)
 
 ROOT_DIR = os.path.dirname(__file__)
 sys.path.append(ROOT_DIR)
@@ -16,15 +33,49 @@ sys.path.append(ROOT_DIR)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 DATABASE_FILE = os.path.join(BASE_DIR, "corpus.db")
-MODELS_DIR = "models"
-VECTORIZER_PATH = os.path.join(MODELS_DIR, "tfidf_vectorizer.joblib")
 create_table_sql = '''
 CREATE TABLE IF NOT EXISTS documents (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     filename TEXT NOT NULL UNIQUE,
-    text_content TEXT NOT NULL,
-    upload_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    text_content BLOB NOT NULL,
+    upload_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    content_hash TEXT
+);
+'''
+
+# One row per file seen by a bulk import, so an interrupted import resumes where it stopped.
+create_import_progress_sql = '''
+CREATE TABLE IF NOT EXISTS import_progress (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    status TEXT NOT NULL,
+    filename TEXT,
+    detail TEXT,
+    imported_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+'''
+
+# Every change to `documents` bumps the corpus version, whoever makes it, so a
+# saved index can tell whether it still matches the database.
+create_version_sql = '''
+CREATE TABLE IF NOT EXISTS corpus_meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
 );
+INSERT OR IGNORE INTO corpus_meta (key, value) VALUES ('version', 0);
+CREATE TRIGGER IF NOT EXISTS documents_insert_version AFTER INSERT ON documents
+BEGIN
+    UPDATE corpus_meta SET value = value + 1 WHERE key = 'version';
+END;
+CREATE TRIGGER IF NOT EXISTS documents_delete_version AFTER DELETE ON documents
+BEGIN
+    UPDATE corpus_meta SET value = value + 1 WHERE key = 'version';
+END;
+CREATE TRIGGER IF NOT EXISTS documents_update_version AFTER UPDATE ON documents
+BEGIN
+    UPDATE corpus_meta SET value = value + 1 WHERE key = 'version';
+END;
 '''
 
 
@@ -34,53 +85,774 @@ def create_database_and_table():
     try:
         conn=sqlite3.connect(DATABASE_FILE)
         cursor=conn.cursor()
+        # WAL is persistent, and lets the app keep reading while an ingest writes.
+        cursor.execute("PRAGMA journal_mode=WAL")
         cursor.execute(create_table_sql)
+        cursor.executescript(create_version_sql)
+        cursor.execute(create_token_cache_sql)
+        cursor.execute(create_import_progress_sql)
         conn.commit()
-        print(f"Database '{DATABASE_FILE}' is ready and 'documents' table exists.")
         conn.close()
+        migrate_documents(DATABASE_FILE)
+        print(f"Database '{DATABASE_FILE}' is ready and 'documents' table exists.")
 
     except sqlite3.Error as e:
         print(f"Database error: {e}")
         sys.exit(1)
 
-def rebuild_vectorizer():
+# A bulk import batch ends at whichever of these limits is reached first.
+IMPORT_BATCH_FILES = 256
+IMPORT_BATCH_BYTES = 64 * 1024 * 1024
+
+# Documents read, tokenized and hashed at a time when streaming the corpus into a hashed index.
+STREAM_BATCH_SIZE = 1000
+
+
+def index_settings():
+    """Metadata of the corpus index, or the layout of the sharded index; {} when there is neither."""
+    return read_index_meta() or read_layout() or {}
+
+
+def rebuild_vectorizer(workers=None, preprocessing=None, hash_features=None, shard_size=None):
+    """Rebuild the corpus index from scratch from every document in the database.
+
+    `preprocessing`, `hash_features` and `shard_size` default to the
+    settings of the existing index; `hash_features=0` switches a hashed
+    index back to a vocabulary and `shard_size=0` a sharded index back to
+    a single one.
+    """
+    meta = index_settings()
+    preprocessing = preprocessing or meta.get("preprocessing") or DEFAULT_PREPROCESSING
+    if hash_features is None:
+        hash_features = meta.get("hash_features")
+    if shard_size is None:
+        shard_size = meta.get("shard_size")
+    if shard_size:
+        return build_shards(shard_size, workers, preprocessing, hash_features or DEFAULT_HASH_FEATURES)
+    remove_shards()
+    if hash_features:
+        return stream_hashed_index(workers, preprocessing, hash_features)
     try:
-        os.makedirs(MODELS_DIR, exist_ok=True)
         conn=sqlite3.connect(DATABASE_FILE)
         cursor = conn.cursor()
-        cursor.execute("SELECT text_content FROM documents")
-        rows = cursor.fetchall()
+        # Read the version and the rows in one transaction so they agree.
+        cursor.execute("BEGIN")
+        cursor.execute("SELECT value FROM corpus_meta WHERE key = 'version'")
+        version = cursor.fetchone()[0]
+        cursor.execute("SELECT id, filename, text_content FROM documents ORDER BY id")
+        rows = [(doc_id, filename, decode_text(text)) for doc_id, filename, text in cursor.fetchall()]
         conn.close()
 
-        if not rows:
+        with INDEX_LOCK:
+            if load_corpus_index(SENTENCE_INDEX_DIR) is not None:
+                build_sentence_index(rows, version, workers, preprocessing)
+            if not rows:
+                print("Corpus is empty. No vectorizer to build.")
+                remove_corpus_index()
+                return None
+
+            doc_ids = [r[0] for r in rows]
+            filenames = [r[1] for r in rows]
+            texts = [r[2] for r in rows]
+            token_lists = tokenize_documents(texts, DATABASE_FILE, workers, preprocessing)
+            prune_token_cache({token_cache_key(t, preprocessing) for t in texts}, DATABASE_FILE)
+            index = build_corpus_index(doc_ids, filenames, token_lists, version, preprocessing=preprocessing)
+            print(f"Corpus index built with {len(texts)} document(s) ({preprocessing} preprocessing).")
+            config = get_minhash_config(DATABASE_FILE)
+            if config is not None:
+                reset_minhash_index(config["bands"], config["rows"], DATABASE_FILE)
+                index_documents(doc_ids, token_lists, DATABASE_FILE)
+                print(f"MinHash signatures computed for {len(doc_ids)} document(s).")
+            if fingerprints_enabled(DATABASE_FILE):
+                reset_fingerprint_index(DATABASE_FILE)
+                index_fingerprints(doc_ids, texts, DATABASE_FILE)
+                print(f"Fingerprints computed for {len(doc_ids)} document(s).")
+            print(f"Token cache: {token_cache_stats()}")
+            return index
+
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        raise
+
+
+def stream_hashed_index(workers=None, preprocessing=DEFAULT_PREPROCESSING, hash_features=DEFAULT_HASH_FEATURES,
+                        batch_size=STREAM_BATCH_SIZE):
+    """Rebuild the corpus index as a hashed index, streaming the database in batches.
+
+    Hashed rows need no vocabulary fitted on the whole corpus, so each
+    batch is tokenized and counted on its own and only one batch of text
+    is held in memory. The sentence, MinHash and fingerprint indexes that
+    are enabled are rebuilt from the same batches.
+    """
+    with INDEX_LOCK:
+        sentence_index = None
+        if load_corpus_index(SENTENCE_INDEX_DIR) is not None:
+            remove_corpus_index(SENTENCE_INDEX_DIR)
+            sentence_index = CorpusIndex(SENTENCE_INDEX_DIR, preprocessing, hash_features)
+        remove_corpus_index()
+        index = CorpusIndex(INDEX_DIR, preprocessing, hash_features)
+        minhash_config = get_minhash_config(DATABASE_FILE)
+        if minhash_config is not None:
+            reset_minhash_index(minhash_config["bands"], minhash_config["rows"], DATABASE_FILE)
+        fingerprints = fingerprints_enabled(DATABASE_FILE)
+        if fingerprints:
+            reset_fingerprint_index(DATABASE_FILE)
+
+        cache_keys = set()
+        try:
+            conn=sqlite3.connect(DATABASE_FILE)
+            cursor = conn.cursor()
+            # One read transaction, so every batch comes from the snapshot the version belongs to.
+            cursor.execute("BEGIN")
+            cursor.execute("SELECT value FROM corpus_meta WHERE key = 'version'")
+            version = cursor.fetchone()[0]
+            cursor.execute("SELECT id, filename, text_content FROM documents ORDER BY id")
+            while batch := cursor.fetchmany(batch_size):
+                rows = [(doc_id, filename, decode_text(text)) for doc_id, filename, text in batch]
+                doc_ids = [r[0] for r in rows]
+                texts = [r[2] for r in rows]
+                token_lists = tokenize_documents(texts, DATABASE_FILE, workers, preprocessing)
+                cache_keys.update(token_cache_key(t, preprocessing) for t in texts)
+                index.append(doc_ids, [r[1] for r in rows], token_lists)
+                if sentence_index is not None:
+                    sentence_index.append(*sentence_rows(rows, workers, preprocessing))
+                if minhash_config is not None:
+                    index_documents(doc_ids, token_lists, DATABASE_FILE)
+                if fingerprints:
+                    index_fingerprints(doc_ids, texts, DATABASE_FILE)
+                print(f"Indexed {len(index)} document(s)...")
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            raise
+
+        prune_token_cache(cache_keys, DATABASE_FILE)
+        if len(index) == 0:
             print("Corpus is empty. No vectorizer to build.")
-            if os.path.exists(VECTORIZER_PATH):
-                os.remove(VECTORIZER_PATH)
-                print("Removed old vectorizer file.")
+            remove_corpus_index()
+            remove_corpus_index(SENTENCE_INDEX_DIR)
             return None
+        # Compacting merges the batch segments and publishes the index.
+        for part in (sentence_index, index):
+            if part is not None:
+                part.version = version
+                part.compact()
+        print(f"Hashed corpus index built with {len(index)} document(s) in {hash_features} columns "
+              f"({preprocessing} preprocessing).")
+        print(f"Token cache: {token_cache_stats()}")
+        return index
+
 
-        texts = [r[0] for r in rows]
+def build_shards(shard_size=DEFAULT_SHARD_SIZE, workers=None, preprocessing=None, hash_features=None, only=None):
+    """Rebuild the corpus index as hashed shards of `shard_size` consecutive document ids.
+
+    Shard k holds the documents with ids in [k * shard_size, (k + 1) *
+    shard_size), so a shard is built from its own rows only and new
+    documents land in the last shards. With `only`, just that shard is
+    rebuilt, with the settings of the existing shards; otherwise every
+    shard is, along with the enabled sentence, MinHash and fingerprint
+    indexes, one shard's documents at a time.
+    """
+    layout = read_layout()
+    if only is not None and layout is not None:
+        if layout["shard_size"] != shard_size:
+            print(f"Error: the existing shards hold {layout['shard_size']} document ids each, not {shard_size}.")
+            sys.exit(1)
+        preprocessing = preprocessing or layout["preprocessing"]
+        hash_features = hash_features or layout["hash_features"]
+    preprocessing = preprocessing or DEFAULT_PREPROCESSING
+    hash_features = hash_features or DEFAULT_HASH_FEATURES
+    if only is not None and layout is not None and (preprocessing, hash_features) != (
+            layout["preprocessing"], layout["hash_features"]):
+        print("Error: a single shard must be built with the settings of the other shards.")
+        sys.exit(1)
+
+    with INDEX_LOCK:
+        full = only is None
+        sentence_index = minhash_config = None
+        fingerprints = False
+        if full:
+            if load_corpus_index(SENTENCE_INDEX_DIR) is not None:
+                remove_corpus_index(SENTENCE_INDEX_DIR)
+                sentence_index = CorpusIndex(SENTENCE_INDEX_DIR, preprocessing, hash_features)
+            minhash_config = get_minhash_config(DATABASE_FILE)
+            if minhash_config is not None:
+                reset_minhash_index(minhash_config["bands"], minhash_config["rows"], DATABASE_FILE)
+            fingerprints = fingerprints_enabled(DATABASE_FILE)
+            if fingerprints:
+                reset_fingerprint_index(DATABASE_FILE)
+
+        cache_keys = set()
+        total = 0
         try:
-            vectorizer = TfidfVectorizer(tokenizer=preprocess_text)
-            vectorizer.fit(texts)
-            joblib.dump(vectorizer, VECTORIZER_PATH)
-            print(f"Vectorizer built with {len(texts)} document(s).")
-            return vectorizer
-        except ValueError as e:
-            # Handles "empty vocabulary" error
-            print(f"Cannot build vectorizer: {e}")
-            if os.path.exists(VECTORIZER_PATH):
-                os.remove(VECTORIZER_PATH)
+            conn=sqlite3.connect(DATABASE_FILE)
+            cursor = conn.cursor()
+            # One read transaction, so every shard comes from the snapshot the version belongs to.
+            cursor.execute("BEGIN")
+            cursor.execute("SELECT value FROM corpus_meta WHERE key = 'version'")
+            version = cursor.fetchone()[0]
+            if full:
+                cursor.execute("SELECT DISTINCT id / ? FROM documents ORDER BY 1", (shard_size,))
+                shard_nos = [r[0] for r in cursor.fetchall()]
+            else:
+                shard_nos = [only]
+            for shard_no in shard_nos:
+                start, stop = shard_range(shard_no, shard_size)
+                cursor.execute(
+                    "SELECT id, filename, text_content FROM documents WHERE id >= ? AND id < ? ORDER BY id",
+                    (start, stop)
+                )
+                rows = [(doc_id, filename, decode_text(text)) for doc_id, filename, text in cursor.fetchall()]
+                doc_ids = [r[0] for r in rows]
+                texts = [r[2] for r in rows]
+                token_lists = tokenize_documents(texts, DATABASE_FILE, workers, preprocessing)
+                cache_keys.update(token_cache_key(t, preprocessing) for t in texts)
+                build_corpus_index(doc_ids, [r[1] for r in rows], token_lists, version, shard_dir(shard_no),
+                                   preprocessing=preprocessing, hash_features=hash_features)
+                if sentence_index is not None:
+                    sentence_index.append(*sentence_rows(rows, workers, preprocessing))
+                if minhash_config is not None:
+                    index_documents(doc_ids, token_lists, DATABASE_FILE)
+                if fingerprints:
+                    index_fingerprints(doc_ids, texts, DATABASE_FILE)
+                total += len(rows)
+                print(f"Shard {shard_no} built with {len(rows)} document(s).")
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            raise
+
+        if not full:
+            # The other shards may be at another version; the next update brings them all in line.
+            layout = layout or {"shard_size": shard_size, "preprocessing": preprocessing,
+                                "hash_features": hash_features, "shards": []}
+            layout["shards"] = sorted(set(layout["shards"]) | {only})
+            layout["version"] = None
+            save_layout(layout)
+            return None
+
+        prune_token_cache(cache_keys, DATABASE_FILE)
+        if sentence_index is not None:
+            sentence_index.version = version
+            sentence_index.compact()
+        kept = {shard_dir(shard_no) for shard_no in shard_nos}
+        for name in os.listdir(SHARDS_DIR) if os.path.isdir(SHARDS_DIR) else []:
+            path = os.path.join(SHARDS_DIR, name)
+            if os.path.isdir(path) and path not in kept:
+                remove_corpus_index(path)
+                os.rmdir(path)
+        save_layout({"shard_size": shard_size, "preprocessing": preprocessing, "hash_features": hash_features,
+                     "shards": shard_nos, "version": version})
+        # The engine loads the shards in preference to the single index, which is now stale,
+        # as are LSA embeddings fitted on it: they are not built for shards.
+        remove_corpus_index()
+        remove_lsa_index()
+        remove_lsa_index(SENTENCE_LSA_DIR)
+        print(f"Sharded corpus index built with {total} document(s) in {len(shard_nos)} shard(s) of "
+              f"{shard_size} document ids ({preprocessing} preprocessing).")
+        print(f"Token cache: {token_cache_stats()}")
+        return None
+
+
+def update_shards(workers=None):
+    """Bring every shard of the sharded index in line with the database incrementally.
+
+    Like `update_index`, per shard: only shards whose id range gained or
+    lost documents are touched, and new id ranges get new shards.
+    """
+    layout = read_layout()
+    shard_size = layout["shard_size"]
+    try:
+        conn=sqlite3.connect(DATABASE_FILE)
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        cursor.execute("SELECT value FROM corpus_meta WHERE key = 'version'")
+        version = cursor.fetchone()[0]
+        if version == layout["version"]:
+            conn.close()
             return None
+        cursor.execute("SELECT id FROM documents")
+        db_ids = {}
+        for (doc_id,) in cursor.fetchall():
+            db_ids.setdefault(doc_id // shard_size, set()).add(doc_id)
 
+        sentence_index = load_corpus_index(SENTENCE_INDEX_DIR)
+        added = removed = 0
+        for shard_no in sorted(set(layout["shards"]) | set(db_ids)):
+            index = load_corpus_index(shard_dir(shard_no))
+            if index is None:
+                index = CorpusIndex(shard_dir(shard_no), layout["preprocessing"], layout["hash_features"])
+            indexed_ids = set(index.doc_ids)
+            current_ids = db_ids.get(shard_no, set())
+            added_ids = sorted(current_ids - indexed_ids)
+            removed_ids = indexed_ids - current_ids
+            if not added_ids and not removed_ids and index.version is not None:
+                continue
+            rows = []
+            # Stay under SQLite's bound-parameter limit.
+            for start in range(0, len(added_ids), 500):
+                batch = added_ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(
+                    f"SELECT id, filename, text_content FROM documents WHERE id IN ({placeholders}) ORDER BY id",
+                    batch
+                )
+                rows.extend(
+                    (doc_id, filename, decode_text(text)) for doc_id, filename, text in cursor.fetchall()
+                )
+            token_lists = tokenize_documents([r[2] for r in rows], DATABASE_FILE, workers, index.preprocessing)
+            index.update([r[0] for r in rows], [r[1] for r in rows], token_lists, removed_ids, version)
+            if index.needs_compaction():
+                index.compact()
+            index_documents([r[0] for r in rows], token_lists, DATABASE_FILE)
+            index_fingerprints([r[0] for r in rows], [r[2] for r in rows], DATABASE_FILE)
+            if sentence_index is not None:
+                doc_ids, filenames, sentence_tokens, spans = sentence_rows(rows, workers,
+                                                                           sentence_index.preprocessing)
+                sentence_index.update(doc_ids, filenames, sentence_tokens, removed_ids, version, spans)
+            added += len(rows)
+            removed += len(removed_ids)
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        raise
+
+    if sentence_index is not None and sentence_index.version != version:
+        sentence_index.update([], [], [], (), version)
+    if sentence_index is not None and sentence_index.needs_compaction():
+        compact_in_background(SENTENCE_INDEX_DIR)
+    if removed:
+        prune_token_cache_to_corpus(layout["preprocessing"], DATABASE_FILE)
+    layout["shards"] = sorted(set(layout["shards"]) | set(db_ids))
+    layout["version"] = version
+    save_layout(layout)
+    print(f"Sharded corpus index updated: {added} added, {removed} removed.")
+    print(f"Token cache: {token_cache_stats()}")
+    return None
+
+
+def remove_shards():
+    """Delete the sharded index, if any, so the single corpus index is used again."""
+    layout = read_layout()
+    if layout is None:
+        return
+    remove_layout()
+    for shard_no in layout["shards"]:
+        remove_corpus_index(shard_dir(shard_no))
+        if os.path.isdir(shard_dir(shard_no)):
+            os.rmdir(shard_dir(shard_no))
+
+
+def sentence_rows(rows, workers=None, preprocessing=DEFAULT_PREPROCESSING):
+    """Split (id, filename, text) rows into one preprocessed row per sentence, with its character span."""
+    doc_ids, filenames, sentences, spans = [], [], [], []
+    for doc_id, filename, text in rows:
+        doc_sentences, doc_spans = split_into_sentence_spans(text)
+        doc_ids.extend([doc_id] * len(doc_sentences))
+        filenames.extend([filename] * len(doc_sentences))
+        sentences.extend(doc_sentences)
+        spans.extend(doc_spans)
+    return doc_ids, filenames, preprocess_documents(sentences, workers, mode=preprocessing), spans
+
+
+def build_sentence_index(rows, version, workers=None, preprocessing=DEFAULT_PREPROCESSING, hash_features=None):
+    doc_ids, filenames, token_lists, spans = sentence_rows(rows, workers, preprocessing)
+    build_corpus_index(doc_ids, filenames, token_lists, version, SENTENCE_INDEX_DIR, spans, preprocessing,
+                       hash_features)
+    print(f"Sentence index built with {len(token_lists)} sentence(s) from {len(rows)} document(s).")
+
+
+def update_index(workers=None):
+    """Bring the corpus index in line with the database incrementally.
+
+    Only documents added since the index was last updated are read and
+    vectorized; removed documents are tombstoned. Falls back to a full
+    rebuild when there is no index yet. Database errors are reported and
+    raised rather than exiting, since the app calls this on its threads.
+    """
+    with INDEX_LOCK:
+        if read_layout() is not None:
+            return update_shards(workers)
+        index = load_corpus_index()
+        if index is None:
+            return rebuild_vectorizer(workers)
+        previous_version = index.version
+        try:
+            conn=sqlite3.connect(DATABASE_FILE)
+            cursor = conn.cursor()
+            cursor.execute("BEGIN")
+            cursor.execute("SELECT value FROM corpus_meta WHERE key = 'version'")
+            version = cursor.fetchone()[0]
+            if version == index.version:
+                conn.close()
+                return index
+            cursor.execute("SELECT id FROM documents")
+            db_ids = {r[0] for r in cursor.fetchall()}
+            indexed_ids = set(index.doc_ids)
+            added_ids = sorted(db_ids - indexed_ids)
+            rows = []
+            # Stay under SQLite's bound-parameter limit.
+            for start in range(0, len(added_ids), 500):
+                batch = added_ids[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(
+                    f"SELECT id, filename, text_content FROM documents WHERE id IN ({placeholders}) ORDER BY id",
+                    batch
+                )
+                rows.extend(
+                    (doc_id, filename, decode_text(text)) for doc_id, filename, text in cursor.fetchall()
+                )
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            raise
+
+        token_lists = tokenize_documents([r[2] for r in rows], DATABASE_FILE, workers, index.preprocessing)
+        index.update(
+            [r[0] for r in rows],
+            [r[1] for r in rows],
+            token_lists,
+            indexed_ids - db_ids,
+            version
+        )
+        if indexed_ids - db_ids:
+            prune_token_cache_to_corpus(index.preprocessing, DATABASE_FILE)
+        # Signatures and fingerprints of deleted documents are removed by triggers on `documents`.
+        index_documents([r[0] for r in rows], token_lists, DATABASE_FILE)
+        index_fingerprints([r[0] for r in rows], [r[2] for r in rows], DATABASE_FILE)
+        # LSA embeddings fold the new documents in, as long as they were up to date.
+        lsa_index = load_lsa_index()
+        if lsa_index is not None and lsa_index.version == previous_version:
+            lsa_index.update([r[0] for r in rows], [r[1] for r in rows], token_lists, indexed_ids - db_ids, version)
+        sentence_index = load_corpus_index(SENTENCE_INDEX_DIR)
+        if sentence_index is not None:
+            doc_ids, filenames, sentence_tokens, spans = sentence_rows(rows, workers, sentence_index.preprocessing)
+            sentence_index.update(doc_ids, filenames, sentence_tokens, indexed_ids - db_ids, version, spans)
+            # Like the main index (see app.py), compacted off the caller's thread; it waits for INDEX_LOCK.
+            if sentence_index.needs_compaction():
+                compact_in_background(SENTENCE_INDEX_DIR)
+            sentence_lsa_index = load_lsa_index(SENTENCE_LSA_DIR)
+            if sentence_lsa_index is not None and sentence_lsa_index.version == previous_version:
+                sentence_lsa_index.update(doc_ids, filenames, sentence_tokens, indexed_ids - db_ids, version, spans)
+        print(f"Corpus index updated: {len(rows)} added, {len(indexed_ids - db_ids)} removed.")
+        print(f"Token cache: {token_cache_stats()}")
+        return index
+
+
+def build_minhash_index(bands=DEFAULT_BANDS, rows=DEFAULT_ROWS, workers=None):
+    """Enable MinHash/LSH candidate search and compute signatures for the whole corpus.
+
+    More bands (or fewer rows per band) raise recall at the cost of larger
+    candidate sets.
+    """
+    try:
+        conn=sqlite3.connect(DATABASE_FILE)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, text_content FROM documents ORDER BY id")
+        records = [(doc_id, decode_text(text)) for doc_id, text in cursor.fetchall()]
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        sys.exit(1)
+
+    reset_minhash_index(bands, rows, DATABASE_FILE)
+    # Signatures are compared with query tokens, so they follow the corpus index's preprocessing.
+    preprocessing = index_settings().get("preprocessing") or DEFAULT_PREPROCESSING
+    token_lists = tokenize_documents([r[1] for r in records], DATABASE_FILE, workers, preprocessing)
+    index_documents([r[0] for r in records], token_lists, DATABASE_FILE)
+    print(f"MinHash index built for {len(records)} document(s) with {bands} bands of {rows} rows.")
+
+
+def build_fingerprint_index():
+    """Enable copied-passage detection and fingerprint every document in the corpus."""
+    try:
+        conn=sqlite3.connect(DATABASE_FILE)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, text_content FROM documents ORDER BY id")
+        records = [(doc_id, decode_text(text)) for doc_id, text in cursor.fetchall()]
+        conn.close()
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        sys.exit(1)
+
+    reset_fingerprint_index(DATABASE_FILE)
+    index_fingerprints([r[0] for r in records], [r[1] for r in records], DATABASE_FILE)
+    print(f"Fingerprint index built for {len(records)} document(s).")
+
+
+def enable_sentence_index(workers=None):
+    """Build the corpus-wide sentence index used for highlighting in corpus mode."""
+    try:
+        conn=sqlite3.connect(DATABASE_FILE)
+        cursor = conn.cursor()
+        cursor.execute("BEGIN")
+        cursor.execute("SELECT value FROM corpus_meta WHERE key = 'version'")
+        version = cursor.fetchone()[0]
+        cursor.execute("SELECT id, filename, text_content FROM documents ORDER BY id")
+        rows = [(doc_id, filename, decode_text(text)) for doc_id, filename, text in cursor.fetchall()]
+        conn.close()
     except sqlite3.Error as e:
         print(f"Database error: {e}")
         sys.exit(1)
 
+    # The sentence index follows the corpus index's settings.
+    meta = index_settings()
+    with INDEX_LOCK:
+        build_sentence_index(rows, version, workers, meta.get("preprocessing") or DEFAULT_PREPROCESSING,
+                             meta.get("hash_features"))
+
+
+def build_lsa_index(dimensions=DEFAULT_LSA_DIMENSIONS):
+    """Fit LSA embeddings on the corpus index, and on the sentence index if there is one.
+
+    Later incremental updates fold new documents into the fitted model; a
+    full rebuild refits it.
+    """
+    with INDEX_LOCK:
+        index = load_corpus_index()
+        if index is None:
+            if read_layout() is not None:
+                remove_lsa_index()
+                remove_lsa_index(SENTENCE_LSA_DIR)
+                print("LSA embeddings need a single corpus index; they are not built for a sharded one.")
+            else:
+                print("No corpus index to fit LSA embeddings on.")
+            return None
+        lsa_index = fit_lsa_index(index, dimensions)
+        if lsa_index is None:
+            print("Corpus is too small for LSA embeddings.")
+            return None
+        print(f"LSA embeddings fitted with {lsa_index.dimensions} dimensions for {len(lsa_index)} document(s).")
+        sentence_index = load_corpus_index(SENTENCE_INDEX_DIR)
+        remove_lsa_index(SENTENCE_LSA_DIR)
+        if sentence_index is not None:
+            sentence_lsa_index = fit_lsa_index(sentence_index, dimensions, SENTENCE_LSA_DIR)
+            if sentence_lsa_index is not None:
+                print(f"Sentence LSA embeddings fitted for {len(sentence_lsa_index)} sentence(s).")
+        return lsa_index
+
+
+def walk_documents(directory):
+    """Yield (path, name relative to `directory`) for every supported file under it, in a stable order."""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(SUPPORTED_EXTENSIONS):
+                path = os.path.abspath(os.path.join(root, name))
+                yield path, os.path.relpath(path, directory).replace(os.sep, "/")
+
+
+def pending_import_batches(directory, batch_files=IMPORT_BATCH_FILES, batch_bytes=IMPORT_BATCH_BYTES):
+    """Group the files not yet imported unchanged into batches of (path, name, size, mtime)."""
+    conn=sqlite3.connect(DATABASE_FILE)
+    done = {
+        path: (size, mtime)
+        for path, size, mtime in conn.execute(
+            "SELECT path, size, mtime FROM import_progress WHERE status != 'failed'"
+        )
+    }
+    conn.close()
+
+    batch, total_bytes = [], 0
+    for path, name in walk_documents(directory):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if done.get(path) == (stat.st_size, stat.st_mtime):
+            continue
+        batch.append((path, name, stat.st_size, stat.st_mtime))
+        total_bytes += stat.st_size
+        if len(batch) >= batch_files or total_bytes >= batch_bytes:
+            yield batch
+            batch, total_bytes = [], 0
+    if batch:
+        yield batch
+
+
+def import_directory(directory, workers=None, preprocessing=DEFAULT_PREPROCESSING,
+                     batch_files=IMPORT_BATCH_FILES, batch_bytes=IMPORT_BATCH_BYTES):
+    """Add every .txt, .docx and .pdf file under `directory` to the corpus, batch by batch.
+
+    Each batch is read, extracted, stored and tokenized into the token
+    cache before the next is read, and its files are then recorded in
+    `import_progress`. A rerun skips files already recorded unless they
+    have changed, and retries the ones that failed. A batch
+    interrupted after it was stored is simply found to be duplicates on
+    the rerun. The corpus index is not touched: build it once afterwards.
+    """
+    totals = Counter()
+    for batch in pending_import_batches(directory, batch_files, batch_bytes):
+        readable, files, errors = [], [], {}
+        for i, (path, name, _, _) in enumerate(batch):
+            try:
+                with open(path, "rb") as f:
+                    files.append((name, f.read()))
+                readable.append(i)
+            except OSError as e:
+                errors[i] = str(e)
+        texts = [None] * len(batch)
+        for i, text in zip(readable, extract_texts(files, workers)):
+            texts[i] = text
+        del files
+
+        to_store = [i for i, text in enumerate(texts) if text and text.strip()]
+        results = dict(zip(to_store, insert_documents_into_db(
+            ((batch[i][1], texts[i]) for i in to_store), DATABASE_FILE
+        )))
+        # Tokenize the new documents now, so the final index build finds them in the token cache.
+        tokenize_documents([texts[i] for i in to_store if results[i][0] is not None], DATABASE_FILE, workers,
+                           preprocessing)
+
+        progress = []
+        for i, (path, name, size, mtime) in enumerate(batch):
+            if i in results:
+                stored, duplicate_of = results[i]
+                status, filename, detail = ("stored", stored, None) if stored else ("duplicate", duplicate_of, None)
+            elif i in errors:
+                status, filename, detail = "failed", None, errors[i]
+            elif texts[i] is not None:
+                status, filename, detail = "empty", None, None
+            else:
+                status, filename, detail = "failed", None, "no text could be extracted"
+            totals[status] += 1
+            progress.append((path, size, mtime, status, filename, detail))
+        try:
+            conn=sqlite3.connect(DATABASE_FILE)
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO import_progress (path, size, mtime, status, filename, detail) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    progress
+                )
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Database error: {e}")
+            sys.exit(1)
+        print(f"Imported {sum(totals.values())} file(s): {totals['stored']} stored, "
+              f"{totals['duplicate']} duplicate(s), {totals['empty']} empty, {totals['failed']} failed.")
+    if not totals:
+        print(f"No new files to import from '{directory}'.")
+    return totals
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Create the corpus database and build the corpus index.")
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=None,
+        help="Number of preprocessing processes (default: one per CPU; 1 disables multiprocessing)."
+    )
+    parser.add_argument(
+        "--import-dir",
+        metavar="DIR",
+        help="First add every .txt, .docx and .pdf file under DIR to the corpus, in batches; an interrupted "
+             "import resumes where it stopped. With --hash-features the index is then built without "
+             "loading the whole corpus at once."
+    )
+    parser.add_argument(
+        "--preprocessing",
+        choices=PREPROCESSING_MODES,
+        default=None,
+        help="Tokenizer and lemmatizer for the index: 'nltk', or the regex and lemma-table "
+             "'fast' approximation (default: the mode of the existing index, else nltk)."
+    )
+    parser.add_argument(
+        "--hash-features",
+        type=int,
+        nargs="?",
+        const=DEFAULT_HASH_FEATURES,
+        default=None,
+        metavar="N",
+        help="Build a hashed index with N columns (default N: %(const)s), streaming the corpus in batches "
+             "instead of fitting a vocabulary on all of it; 0 goes back to a vocabulary "
+             "(default: the setting of the existing index)."
+    )
+    parser.add_argument(
+        "--minhash",
+        action="store_true",
+        help="Also build the MinHash/LSH candidate index used by the 'MinHash LSH' search mode."
+    )
+    parser.add_argument(
+        "--bands",
+        type=int,
+        default=DEFAULT_BANDS,
+        help=f"Number of LSH bands (default: {DEFAULT_BANDS})."
+    )
+    parser.add_argument(
+        "--rows",
+        type=int,
+        default=DEFAULT_ROWS,
+        help=f"Signature rows per LSH band (default: {DEFAULT_ROWS})."
+    )
+    parser.add_argument(
+        "--fingerprints",
+        action="store_true",
+        help="Also build the winnowed fingerprint index used to find copied passages."
+    )
+    parser.add_argument(
+        "--sentences",
+        action="store_true",
+        help="Also build the corpus-wide sentence index used to highlight matches in corpus mode."
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        nargs="?",
+        const=DEFAULT_SHARD_SIZE,
+        default=None,
+        metavar="N",
+        help="Split the index into hashed shards of N consecutive document ids (default N: %(const)s), "
+             "searched in parallel worker processes; 0 goes back to a single index "
+             "(default: the setting of the existing index)."
+    )
+    parser.add_argument(
+        "--shard",
+        type=int,
+        default=None,
+        metavar="K",
+        help="Rebuild only shard K of the sharded index instead of the whole index."
+    )
+    parser.add_argument(
+        "--lsa",
+        type=int,
+        nargs="?",
+        const=DEFAULT_LSA_DIMENSIONS,
+        default=None,
+        metavar="D",
+        help="Also fit D-dimensional LSA embeddings (default D: %(const)s) for the 'LSA embeddings' search "
+             "mode, and for the sentence index if there is one; 0 removes them "
+             "(default: refit existing embeddings with their dimension)."
+    )
+    args = parser.parse_args()
+    if args.shard is not None and not (args.shard_size or (read_layout() or {}).get("shard_size")):
+        parser.error("--shard needs --shard-size or an existing sharded index.")
     create_database_and_table()
-    rebuild_vectorizer()
+    if args.import_dir:
+        preprocessing = args.preprocessing or index_settings().get("preprocessing") or DEFAULT_PREPROCESSING
+        import_directory(args.import_dir, args.workers, preprocessing)
+    try:
+        if args.shard is not None:
+            build_shards(args.shard_size or read_layout()["shard_size"], args.workers, args.preprocessing,
+                         args.hash_features, only=args.shard)
+        else:
+            rebuild_vectorizer(args.workers, args.preprocessing, args.hash_features, args.shard_size)
+    except sqlite3.Error:
+        # Already reported; the index builders raise so the app's updates can fail a job instead.
+        sys.exit(1)
+    if args.minhash:
+        build_minhash_index(args.bands, args.rows, args.workers)
+    if args.fingerprints:
+        build_fingerprint_index()
+    if args.sentences:
+        enable_sentence_index(args.workers)
+    lsa_dimensions = args.lsa if args.lsa is not None else (read_lsa_meta() or {}).get("dimensions")
+    if lsa_dimensions:
+        build_lsa_index(lsa_dimensions)
+    elif args.lsa == 0:
+        remove_lsa_index()
+        remove_lsa_index(SENTENCE_LSA_DIR)
 
 
 
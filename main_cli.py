@@ -1,32 +1,34 @@
 import argparse
+import contextlib
+import cProfile
+import csv
+import json
+import logging
 import os
 import sys
 
 
+# scikit-learn, SciPy, NLTK and the document parsers are imported where they
+# are first needed, so --help and argument errors return immediately.
 try:
-    from src.utils import read_txt_file, read_docx_file, read_pdf_file
-    from src.vectorizer import vectorize_corpus
-    from src.similarity import  calculate_similarity
+    from src.utils import extract_text, extract_texts, SUPPORTED_EXTENSIONS
+    from src.preprocessing import DEFAULT_PREPROCESSING, PREPROCESSING_MODES
+    from src.lsa_defaults import DEFAULT_LSA_DIMENSIONS
+    from src.profiling import profiling
 except ImportError as e:
     print("Import error:", e, file=sys.stderr)
     sys.exit(1)
+
+
 def read_file_content(file_path:str)->str|None:
     try:
         _, extension = os.path.splitext(file_path.lower())
-
-        if extension == ".txt":
-            with open(file_path, "rb") as f:
-                return read_txt_file(f.read())
-
-        elif extension == ".docx":
-            return read_docx_file(file_path)
-
-        elif extension == ".pdf":
-            with open(file_path, "rb") as f:
-                return read_pdf_file(f)
-        else:
+        if extension not in SUPPORTED_EXTENSIONS:
             print(f"Error: Unsupported file type '{extension}'. Please use .txt, .docx, or .pdf.", file=sys.stderr)
             return None
+
+        with open(file_path, "rb") as f:
+            return extract_text(f.read(), extension)
     except FileNotFoundError:
         print(f"Error: The file at '{file_path}' was not found.", file=sys.stderr)
         return None
@@ -34,22 +36,233 @@ def read_file_content(file_path:str)->str|None:
         print(f"An error occurred while reading '{file_path}': {e}", file=sys.stderr)
         return None
 
+
+def list_directory_files(directory: str) -> list[str]:
+    return sorted(
+        os.path.join(directory, name)
+        for name in os.listdir(directory)
+        if name.lower().endswith(SUPPORTED_EXTENSIONS) and os.path.isfile(os.path.join(directory, name))
+    )
+
+
+def read_files_concurrently(paths: list[str], workers: int | None = None) -> dict[str, str]:
+    """Extract `paths` in a process pool (cached files are reused), dropping files that can't be read."""
+    files = []
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                files.append((path, f.read()))
+        except OSError as e:
+            print(f"An error occurred while reading '{path}': {e}", file=sys.stderr)
+    texts = extract_texts(files, workers)
+    return {path: text for (path, _), text in zip(files, texts) if text is not None}
+
+
+def score_against_reference(vectors, names, reference_index, min_score, top_k):
+    """Yield (reference, other, score) for one reference row against all others, best first."""
+    scores = (vectors @ vectors[reference_index].T).toarray().ravel() * 100
+    scores[reference_index] = -1
+    order = (-scores).argsort(kind="stable")
+    emitted = 0
+    for i in order:
+        if scores[i] < min_score or (top_k is not None and emitted >= top_k):
+            break
+        emitted += 1
+        yield names[reference_index], names[i], round(float(scores[i]), 2)
+
+
+def score_all_pairs(vectors, names, min_score, top_k, block_size=256):
+    """Yield (file, file, score) for every pair at or above `min_score`, best first.
+
+    Scores are computed `block_size` rows at a time, and each block only
+    keeps the pairs above the threshold: each file's `top_k` best matches,
+    or without `top_k` its pairs with later files, so every pair is held
+    once. Kept pairs are collected as compact (row, column, float32 score)
+    arrays, so neither dense score rows nor Python objects per pair pile up.
+    """
+    import numpy as np
+
+    vectors = vectors.tocsr()
+    # Transposed to CSR once: a CSC operand would be converted back to CSR for every block.
+    vectors_t = vectors.T.tocsr()
+    threshold = min_score / 100
+    kept_rows, kept_cols, kept_scores = [], [], []
+    for start in range(0, vectors.shape[0], block_size):
+        block = (vectors[start:start + block_size] @ vectors_t).tocoo()
+        rows, cols, scores = block.row + start, block.col, block.data.astype(np.float32)
+        keep = (scores >= threshold) & (scores != 0) & ((cols > rows) if top_k is None else (cols != rows))
+        rows, cols, scores = rows[keep], cols[keep], scores[keep]
+        if top_k is not None:
+            order = np.lexsort((-scores, rows))
+            rows, cols, scores = rows[order], cols[order], scores[order]
+            rank = np.arange(rows.size) - np.searchsorted(rows, rows)
+            keep = rank < top_k
+            rows, cols, scores = np.minimum(rows, cols)[keep], np.maximum(rows, cols)[keep], scores[keep]
+        kept_rows.append(rows.astype(np.int32))
+        kept_cols.append(cols.astype(np.int32))
+        kept_scores.append(scores)
+    if not kept_scores:
+        return
+    rows, cols, scores = np.concatenate(kept_rows), np.concatenate(kept_cols), np.concatenate(kept_scores)
+    if top_k is not None:
+        # A pair among both files' best matches was kept from each side.
+        _, first = np.unique(rows.astype(np.int64) * len(names) + cols, return_index=True)
+        rows, cols, scores = rows[first], cols[first], scores[first]
+    for k in np.lexsort((cols, rows, -scores)):
+        yield names[rows[k]], names[cols[k]], round(float(scores[k]) * 100, 2)
+
+
+def write_results(results, output_format: str):
+    if output_format == "jsonl":
+        for file1, file2, score in results:
+            print(json.dumps({"file1": file1, "file2": file2, "similarity": score}))
+    else:
+        writer = csv.writer(sys.stdout)
+        writer.writerow(["file1", "file2", "similarity"])
+        for row in results:
+            writer.writerow(row)
+    sys.stdout.flush()
+
+
+def run_directory_mode(args):
+    try:
+        paths = list_directory_files(args.directory)
+    except OSError as e:
+        print(f"Error: Could not list directory '{args.directory}': {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.file1:
+        reference = os.path.abspath(args.file1)
+        paths = [reference] + [p for p in paths if os.path.abspath(p) != reference]
+
+    texts = read_files_concurrently(paths, args.workers)
+    if args.file1 and paths[0] not in texts:
+        print("\nCould not read the reference file. Please check the path and file format.", file=sys.stderr)
+        sys.exit(1)
+    if len(texts) < 2:
+        print("Error: Need at least two readable files to compare.", file=sys.stderr)
+        sys.exit(1)
+    print(f"Read {len(texts)} file(s).", file=sys.stderr)
+
+    from src.vectorizer import vectorize_corpus
+
+    names = [os.path.basename(p) for p in texts]
+    try:
+        # Keep progress messages off stdout, which carries the results.
+        with contextlib.redirect_stdout(sys.stderr):
+            vectors = vectorize_corpus(list(texts.values()), args.workers, args.preprocessing)
+    except Exception as e:
+        print(f"An error occurred during vectorization: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.lsa:
+        from scipy.sparse import csr_matrix
+        from src.lsa import lsa_embeddings
+
+        # Dense, but the scoring below only needs a matrix of L2-normalised rows.
+        vectors = csr_matrix(lsa_embeddings(vectors, args.lsa))
+
+    if args.file1:
+        results = score_against_reference(vectors, names, 0, args.min_score, args.top_k)
+    else:
+        results = score_all_pairs(vectors, names, args.min_score, args.top_k)
+    write_results(results, args.format)
+
+
 def main():
     """The main function to run the CLI application."""
     parser = argparse.ArgumentParser(description="Compare two text files to check for plagiarism.")
     parser.add_argument(
         "file1",
+        nargs="?",
         help="The path to the first file for comparison."
     )
     parser.add_argument(
         "file2",
+        nargs="?",
         help="The path to the second file for comparison."
     )
     parser.add_argument(
         "-d", "--directory",
-        help="The path to a directory. If provided, 'file1' will be compared against all files in this directory instead of 'file2'."
+        help="The path to a directory. If provided, 'file1' will be compared against all files in this directory "
+             "instead of 'file2'; without 'file1', every pair of files in the directory is compared."
+    )
+    parser.add_argument(
+        "--format",
+        choices=("csv", "jsonl"),
+        default="csv",
+        help="Output format for directory mode (default: csv)."
+    )
+    parser.add_argument(
+        "--top-k",
+        type=int,
+        default=None,
+        help="In directory mode, report at most this many matches (per file when comparing all pairs)."
+    )
+    parser.add_argument(
+        "--min-score",
+        type=float,
+        default=0.0,
+        help="In directory mode, only report similarities of at least this percentage."
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=None,
+        help="Number of preprocessing processes (default: one per CPU; 1 disables multiprocessing)."
+    )
+    parser.add_argument(
+        "--preprocessing",
+        choices=PREPROCESSING_MODES,
+        default=DEFAULT_PREPROCESSING,
+        help="Tokenizer and lemmatizer: 'nltk', or the faster regex and lemma-table approximation 'fast' "
+             "(default: %(default)s)."
+    )
+    parser.add_argument(
+        "--lsa",
+        type=int,
+        nargs="?",
+        const=DEFAULT_LSA_DIMENSIONS,
+        default=None,
+        metavar="D",
+        help="In directory mode, compare files on D-dimensional LSA embeddings fitted on the directory "
+             "(default D: %(const)s), which tolerate light paraphrasing, instead of TF-IDF vectors."
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print a breakdown of the time spent in each stage to stderr."
+    )
+    parser.add_argument(
+        "--cprofile",
+        metavar="FILE",
+        help="Write a cProfile dump of the run to FILE (inspect it with pstats or snakeviz)."
     )
     args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    profiler = cProfile.Profile() if args.cprofile else None
+    with (profiling() if args.profile else contextlib.nullcontext()) as profile:
+        if profiler:
+            profiler.enable()
+        try:
+            run(args, parser)
+        finally:
+            if profiler:
+                profiler.disable()
+                profiler.dump_stats(args.cprofile)
+                print(f"cProfile stats written to {args.cprofile}", file=sys.stderr)
+            if profile:
+                print("\nStage breakdown:\n" + profile.format(), file=sys.stderr)
+
+
+def run(args, parser):
+    if args.directory:
+        run_directory_mode(args)
+        return
+    if not args.file1 or not args.file2:
+        parser.error("two files are required unless --directory is given")
+    if args.lsa:
+        parser.error("--lsa needs --directory: LSA directions are fitted on the files being compared")
+
     text1 = read_file_content(args.file1)
     text2 = read_file_content(args.file2)
     if text1 is None or text2 is None:
@@ -58,11 +271,13 @@ def main():
         sys.exit(1)
 
     print("Successfully read both files.")
+    from src.vectorizer import vectorize_corpus
+    from src.similarity import calculate_similarity
 
     print("Vectorizing documents...")
     try:
         corpus=[text1,text2]
-        vectors=vectorize_corpus(corpus)
+        vectors=vectorize_corpus(corpus, args.workers, args.preprocessing)
         print("Successfully vectorized documents.")
     except Exception as e:
         print(f"An error occurred during vectorization: {e}", file=sys.stderr)
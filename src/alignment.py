@@ -0,0 +1,128 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .fingerprint import kgram_hashes, normalize_for_fingerprints
+from .profiling import count, timed
+
+# Passages are seeded by runs of SEED_WORDS words shared by both documents.
+SEED_WORDS = 5
+# Seeds repeated more often than this in the source (boilerplate, common phrases) are ignored.
+MAX_SEED_OCCURRENCES = 16
+# Seeds on the same alignment extend one passage across up to this many differing words.
+MAX_GAP_WORDS = 3
+# Passages this close in both documents are merged, absorbing inserted or deleted words.
+MERGE_GAP_WORDS = 10
+# Shorter passages are dropped as coincidental.
+MIN_PASSAGE_WORDS = 8
+# Characters of each source passage kept for the report.
+MAX_EXCERPT_CHARS = 500
+
+# Random per-position weights hash a word's characters in one vectorised pass.
+_CHAR_WEIGHTS = np.random.default_rng(0).integers(1, 2 ** 63, size=256, dtype=np.uint64)
+
+
+def word_hashes(text: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Split `text` into words and hash them, returning (hashes, start offsets, end offsets).
+
+    Words are runs of letters and digits, compared case-insensitively, so
+    punctuation and spacing differences don't break a match.
+    """
+    codes, offsets = normalize_for_fingerprints(text or "")
+    if codes.size == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return np.zeros(0, dtype=np.uint64), empty, empty
+    # A word ends wherever the kept characters stop being adjacent in `text`.
+    new_word = np.ones(codes.size, dtype=bool)
+    new_word[1:] = offsets[1:] != offsets[:-1] + 1
+    word_starts = np.flatnonzero(new_word)
+    word_ends = np.append(word_starts[1:], codes.size)
+    position = np.arange(codes.size) - np.repeat(word_starts, word_ends - word_starts)
+    with np.errstate(over="ignore"):
+        hashes = np.add.reduceat(codes * _CHAR_WEIGHTS[position % _CHAR_WEIGHTS.size], word_starts)
+    return hashes, offsets[word_starts], offsets[word_ends - 1] + 1
+
+
+def seed_pairs(suspect_seeds: np.ndarray, source_seeds: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the (suspect position, source position) of every seed the two documents share."""
+    order = np.argsort(source_seeds, kind="stable")
+    sorted_seeds = source_seeds[order]
+    left = np.searchsorted(sorted_seeds, suspect_seeds, side="left")
+    counts = np.searchsorted(sorted_seeds, suspect_seeds, side="right") - left
+    counts[counts > MAX_SEED_OCCURRENCES] = 0
+    suspect_positions = np.repeat(np.arange(suspect_seeds.size), counts)
+    within = np.arange(suspect_positions.size) - np.repeat(np.cumsum(counts) - counts, counts)
+    return suspect_positions, order[np.repeat(left, counts) + within]
+
+
+def align_words(suspect_seeds: np.ndarray, source_seeds: np.ndarray) -> List[Tuple[int, int, int, int]]:
+    """Align two documents given their seed hashes, as (suspect start, end, source start, end) word ranges."""
+    i, j = seed_pairs(suspect_seeds, source_seeds)
+    if i.size == 0:
+        return []
+    # Chain seeds on the same diagonal (the same shift between the documents) into runs.
+    diagonal = j - i
+    order = np.lexsort((i, diagonal))
+    i, diagonal = i[order], diagonal[order]
+    new_run = np.ones(i.size, dtype=bool)
+    new_run[1:] = (diagonal[1:] != diagonal[:-1]) | (i[1:] - i[:-1] > SEED_WORDS + MAX_GAP_WORDS)
+    run_starts = np.flatnonzero(new_run)
+    starts = i[run_starts]
+    ends = np.maximum.reduceat(i, run_starts) + SEED_WORDS
+    runs = np.column_stack((starts, ends, starts + diagonal[run_starts], ends + diagonal[run_starts]))
+    runs = runs[np.lexsort((runs[:, 2], runs[:, 0]))]
+
+    # Runs on nearby diagonals are one passage with words inserted or deleted.
+    passages = []
+    open_passages = []
+    for s_start, s_end, d_start, d_end in runs.tolist():
+        open_passages = [p for p in open_passages if passages[p][1] + MERGE_GAP_WORDS >= s_start]
+        for p in open_passages:
+            passage = passages[p]
+            if passage[2] - MERGE_GAP_WORDS <= d_start <= passage[3] + MERGE_GAP_WORDS:
+                passage[1] = max(passage[1], s_end)
+                passage[2] = min(passage[2], d_start)
+                passage[3] = max(passage[3], d_end)
+                break
+        else:
+            open_passages.append(len(passages))
+            passages.append([s_start, s_end, d_start, d_end])
+    return [tuple(p) for p in passages if p[1] - p[0] >= MIN_PASSAGE_WORDS]
+
+
+@timed("alignment")
+def align_passages(suspect_text: str, sources: List[Tuple[str, str]]) -> List[Dict]:
+    """Find the passages of `suspect_text` that appear, possibly reworded, in each (filename, text) source.
+
+    Each result has the source's filename, the share of the suspect's words
+    covered, and its passages as [suspect start, suspect end, source start,
+    source end] character offsets with an excerpt of the source passage.
+    Sources without passages are left out; the rest are best first.
+    """
+    suspect_words, suspect_starts, suspect_ends = word_hashes(suspect_text)
+    suspect_seeds = kgram_hashes(suspect_words, SEED_WORDS)
+    results = []
+    for filename, source_text in sources:
+        source_words, source_starts, source_ends = word_hashes(source_text)
+        ranges = align_words(suspect_seeds, kgram_hashes(source_words, SEED_WORDS))
+        count("aligned_passages", len(ranges))
+        if not ranges:
+            continue
+        ranges = np.array(ranges)
+        covered = np.zeros(suspect_words.size + 1, dtype=np.int64)
+        np.add.at(covered, ranges[:, 0], 1)
+        np.add.at(covered, ranges[:, 1], -1)
+        passages = []
+        for s_start, s_end, d_start, d_end in ranges.tolist():
+            start, end = int(source_starts[d_start]), int(source_ends[d_end - 1])
+            excerpt = source_text[start:end]
+            if len(excerpt) > MAX_EXCERPT_CHARS:
+                excerpt = excerpt[:MAX_EXCERPT_CHARS] + "…"
+            passages.append([int(suspect_starts[s_start]), int(suspect_ends[s_end - 1]), start, end, excerpt])
+        results.append({
+            "filename": filename,
+            "coverage": float(np.count_nonzero(np.cumsum(covered)[:-1]) / suspect_words.size),
+            "passages": passages,
+        })
+    results.sort(key=lambda r: r["coverage"], reverse=True)
+    return results
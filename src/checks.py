@@ -0,0 +1,122 @@
+from typing import Dict, List
+
+from .alignment import align_passages
+from .engine import ScoringEngine, read_engine_identity
+from .fingerprint import fingerprints_enabled, find_copied_passages
+from .highlighter import split_into_sentences
+from .minhash import get_minhash_config, query_candidates
+from .result_cache import RESULT_CACHE
+from .storage import content_hash
+from .utils import get_document_by_filename
+
+SEARCH_EXHAUSTIVE = "Exhaustive TF-IDF"
+SEARCH_LSH = "MinHash LSH candidates"
+SEARCH_LSA = "LSA embeddings"
+
+TOP_K = 5
+SENTENCE_THRESHOLD = 0.8
+# Latent-space cosines run higher than TF-IDF ones, so sentence matches there need a stricter threshold.
+LSA_SENTENCE_THRESHOLD = 0.9
+MAX_COPIED_SOURCES = 5
+# Top matches whose passages are aligned with the suspect.
+MAX_ALIGNED_SOURCES = 10
+
+
+def search_settings(db_path="corpus.db") -> tuple:
+    """The MinHash and fingerprint settings, which live in the database rather than the saved indexes."""
+    return tuple(sorted((get_minhash_config(db_path) or {}).items())), fingerprints_enabled(db_path)
+
+
+def check_state(db_path="corpus.db") -> str:
+    """A digest of what a check's results depend on besides the text and the corpus version.
+
+    That is the saved indexes (see `read_engine_identity`) and the search
+    settings; rebuilding an index changes it even when the corpus has not.
+    """
+    return content_hash(repr((read_engine_identity(), search_settings(db_path))))
+
+
+def corpus_check(engine: ScoringEngine, suspect_text: str, suspect_filename: str,
+                 search_mode: str = SEARCH_EXHAUSTIVE, db_path="corpus.db") -> Dict:
+    """Check a document against the corpus and return everything the report shows, as plain JSON data.
+
+    The corpus scores, the passages aligned with the best matches and the
+    sentence matches are cached by the text's hash, the engine's identity
+    and the search settings, so checking the same text again, under any
+    filename, skips preprocessing and scoring. Raises ValueError when the
+    document is itself in the corpus or the corpus is empty.
+    """
+    if suspect_filename in engine.filenames:
+        raise ValueError("This document already exists in the corpus. "
+                         "A document cannot be compared against itself.")
+    if len(engine) == 0:
+        raise ValueError("Could not retrieve documents from the corpus index. "
+                         "Is the database empty? Please run ingest.py.")
+    if search_mode == SEARCH_LSA and not engine.has_lsa:
+        raise ValueError("The LSA embeddings are missing or out of date. Please run `ingest.py --lsa`.")
+
+    result = {"filename": suspect_filename, "corpus_size": len(engine), "version": engine.version,
+              "sentences": None, "sentence_matches": {}, "copied": None, "aligned": []}
+    # Results also depend on how the indexes were built, which can change without a new corpus version.
+    key = (content_hash(suspect_text), engine.version, engine.identity, search_settings(db_path))
+    result.update(RESULT_CACHE.get_or_compute(
+        key + ("top", search_mode), lambda: _top_matches(engine, suspect_text, search_mode, db_path)
+    ))
+    top_files = [filename for filename, _ in result["top_matches"][:MAX_ALIGNED_SOURCES]]
+    result.update(RESULT_CACHE.get_or_compute(
+        key + ("aligned", search_mode), lambda: _aligned_passages(suspect_text, top_files, db_path)
+    ))
+    if engine.has_sentence_index:
+        lsa = search_mode == SEARCH_LSA and engine.has_sentence_lsa
+        result.update(RESULT_CACHE.get_or_compute(
+            key + ("sentences", lsa), lambda: _sentence_matches(engine, suspect_text, db_path, lsa)
+        ))
+
+    if fingerprints_enabled(db_path):
+        result["copied"] = [
+            {
+                "filename": match["filename"],
+                "coverage": match["coverage"],
+                # The same suspect passage can match several places in the source.
+                "passages": [suspect_text[s:e] for s, e in dict.fromkeys((p[0], p[1]) for p in match["passages"])],
+            }
+            for match in find_copied_passages(suspect_text, db_path)[:MAX_COPIED_SOURCES]
+        ]
+    return result
+
+
+def _top_matches(engine: ScoringEngine, suspect_text: str, search_mode: str, db_path: str) -> Dict:
+    candidates = None
+    if search_mode == SEARCH_LSH:
+        tokens = engine.tokenize(suspect_text)
+        candidate_ids = query_candidates(tokens, db_path)
+        candidates = len(candidate_ids)
+        top_matches = engine.query_tokens(tokens, top_k=TOP_K, candidate_ids=candidate_ids)
+    elif search_mode == SEARCH_LSA:
+        top_matches = engine.query_lsa(suspect_text, top_k=TOP_K)
+    else:
+        top_matches = engine.query(suspect_text, top_k=TOP_K)
+    return {"candidates": candidates, "top_matches": [[filename, score] for filename, score in top_matches]}
+
+
+def _aligned_passages(suspect_text: str, filenames: List[str], db_path: str) -> Dict:
+    sources = []
+    for filename in filenames:
+        doc = get_document_by_filename(filename, db_path)
+        if doc:
+            sources.append((filename, doc[1]))
+    return {"aligned": align_passages(suspect_text, sources)}
+
+
+def _sentence_matches(engine: ScoringEngine, suspect_text: str, db_path: str, lsa: bool = False) -> Dict:
+    suspect_sentences = split_into_sentences(suspect_text)
+    source_texts = {}
+    matches = {}
+    threshold = LSA_SENTENCE_THRESHOLD if lsa else SENTENCE_THRESHOLD
+    for i, (_, filename, span, score) in engine.sentence_matches(suspect_sentences, threshold, lsa).items():
+        if filename not in source_texts:
+            doc = get_document_by_filename(filename, db_path)
+            source_texts[filename] = doc[1] if doc else ""
+        # JSON object keys are strings.
+        matches[str(i)] = [filename, score, source_texts[filename][span[0]:span[1]]]
+    return {"sentences": suspect_sentences, "sentence_matches": matches}
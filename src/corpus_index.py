@@ -0,0 +1,517 @@
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Iterable, List, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags, load_npz, vstack
+
+from .preprocessing import DEFAULT_PREPROCESSING, preprocess_text
+from .profiling import timed
+from .similarity import top_k_per_row
+
+logger = logging.getLogger(__name__)
+
+MODELS_DIR = "models"
+INDEX_DIR = os.path.join(MODELS_DIR, "corpus_index")
+SENTENCE_INDEX_DIR = os.path.join(MODELS_DIR, "sentence_index")
+META_FILE = "meta.json"
+# A sparse matrix is saved as one raw .npy file per CSR array, so it can be memory-mapped.
+CSR_FILES = (".data.npy", ".indices.npy", ".indptr.npy")
+
+# Compact once this share of indexed rows is tombstoned, or the segment count grows past the limit.
+COMPACT_DELETED_RATIO = 0.2
+COMPACT_MAX_SEGMENTS = 16
+
+# Columns of a hashed index; 2**20 keeps collisions rare for any realistic vocabulary.
+DEFAULT_HASH_FEATURES = 2 ** 20
+
+# Serialises writers (incremental updates and compaction) within one process.
+INDEX_LOCK = threading.RLock()
+
+
+def normalize(matrix: csr_matrix) -> csr_matrix:
+    """L2-normalise the rows of `matrix`, leaving empty rows as they are."""
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (diags(1 / norms) @ matrix).tocsr()
+
+
+def _save_csr(path: str, matrix: csr_matrix, dtype=None):
+    """Save `matrix` as CSR arrays, with 32-bit indices whenever they fit."""
+    index_dtype = np.int32 if max(matrix.nnz, matrix.shape[1]) < 2 ** 31 else np.int64
+    np.save(path + CSR_FILES[0], matrix.data.astype(dtype or matrix.data.dtype, copy=False))
+    np.save(path + CSR_FILES[1], matrix.indices.astype(index_dtype, copy=False))
+    np.save(path + CSR_FILES[2], matrix.indptr.astype(index_dtype, copy=False))
+
+
+def _map_csr(path: str, n_columns: int) -> csr_matrix:
+    """Open a matrix saved by `_save_csr` read-only and memory-mapped.
+
+    Pages are read on first use and shared through the page cache by every
+    process that maps the same files.
+    """
+    data, indices, indptr = (np.load(path + ext, mmap_mode="r") for ext in CSR_FILES)
+    return csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, n_columns), copy=False)
+
+
+def _pretokenized(tokens: List[str]) -> List[str]:
+    return tokens
+
+
+@lru_cache(maxsize=None)
+def _hashing_vectorizer(n_features: int):
+    from sklearn.feature_extraction.text import HashingVectorizer
+    return HashingVectorizer(n_features=n_features, analyzer=_pretokenized, alternate_sign=False, norm=None,
+                             dtype=np.int32)
+
+
+def hash_counts(token_lists: Iterable[List[str]], n_features: int) -> csr_matrix:
+    """Raw term counts of `token_lists` in `n_features` hashed columns; needs no vocabulary or fitting."""
+    counts = _hashing_vectorizer(n_features).transform(token_lists).tocsr()
+    counts.sort_indices()
+    return counts
+
+
+class _Segment:
+    def __init__(self, name: str, counts: csr_matrix, doc_ids: List[int], filenames: List[str],
+                 new_terms: List[str], spans: List[List[int]] | None = None):
+        self.name = name
+        self.counts = counts
+        self.doc_ids = doc_ids
+        self.filenames = filenames
+        self.new_terms = new_terms
+        self.spans = spans
+
+
+class CorpusIndex:
+    """An incrementally updatable TF-IDF index over the corpus.
+
+    Rows are stored as raw term counts in append-only segments, with a
+    running document-frequency vector. Deleted documents are tombstoned and
+    only physically removed by `compact`. IDF weights are derived from the
+    document frequencies when the index is queried, using the same formula
+    as scikit-learn's `TfidfVectorizer` (smooth IDF, L2-normalised rows).
+
+    A row is normally a whole document, but a document may own several rows
+    (e.g. one per sentence, with its character span in `spans`). The
+    preprocessing mode the rows were built with is saved with the index,
+    and text queries are preprocessed the same way.
+
+    With `hash_features`, terms are hashed into that many columns instead
+    of being numbered through a vocabulary. Rows can then be counted
+    independently of each other and of the index, so a corpus can be
+    streamed in batches, and the document frequencies are a fixed-size
+    vector whatever the corpus size.
+
+    Segments are memory-mapped. `compact` also saves the weighted matrix as
+    float32 data with 32-bit indices; until the next change, loading the
+    index maps that matrix instead of weighting the counts again, so every
+    process shares one copy in the page cache.
+    """
+
+    def __init__(self, index_dir: str = INDEX_DIR, preprocessing: str = DEFAULT_PREPROCESSING,
+                 hash_features: int | None = None):
+        self.index_dir = index_dir
+        self.preprocessing = preprocessing
+        self.hash_features = hash_features
+        self.version = None
+        self.terms: List[str] = []
+        self.vocabulary = {}
+        self.df = np.zeros(hash_features or 0, dtype=np.int64)
+        self.segments: List[_Segment] = []
+        self.deleted = set()
+        self.generation = 0
+        # IDF computed over several indexes (the shards of one corpus); replaces the index's own when set.
+        self.external_idf = None
+        # Name of the saved weighted matrix, while it still matches the rows.
+        self.mapped = None
+        self._locations = {}
+        self._live_rows = 0
+        self._weighted = None
+        self._rows = {}
+
+    def __len__(self):
+        return self._live_rows
+
+    @property
+    def doc_ids(self) -> List[int]:
+        return [d for d in self._locations if d not in self.deleted]
+
+    @property
+    def filenames(self) -> List[str]:
+        return [
+            seg.filenames[row]
+            for seg in self.segments
+            for row, doc_id in enumerate(seg.doc_ids)
+            if doc_id not in self.deleted
+        ]
+
+    @property
+    def n_columns(self) -> int:
+        return self.hash_features or len(self.terms)
+
+    def use_idf(self, idf: np.ndarray | None):
+        """Weight rows with `idf`, e.g. computed over all shards of a corpus, instead of the index's own."""
+        self.external_idf = idf
+        self._weighted = None
+
+    def idf(self) -> np.ndarray:
+        if self.external_idf is not None:
+            return self.external_idf
+        n_rows = len(self)
+        return np.log((1 + n_rows) / (1 + self.df)) + 1
+
+    def count_terms(self, token_lists: Iterable[List[str]], grow: bool = False) -> Tuple[csr_matrix, List[str]]:
+        if self.hash_features:
+            return hash_counts(token_lists, self.hash_features), []
+        indptr = [0]
+        indices = []
+        data = []
+        new_terms = []
+        for tokens in token_lists:
+            for term, count in Counter(tokens).items():
+                col = self.vocabulary.get(term)
+                if col is None:
+                    if not grow:
+                        continue
+                    col = len(self.terms)
+                    self.vocabulary[term] = col
+                    self.terms.append(term)
+                    new_terms.append(term)
+                indices.append(col)
+                data.append(count)
+            indptr.append(len(indices))
+        counts = csr_matrix(
+            (np.array(data, dtype=np.int32), np.array(indices, dtype=np.int32), np.array(indptr, dtype=np.int64)),
+            shape=(len(indptr) - 1, len(self.terms)),
+        )
+        counts.sort_indices()
+        return counts, new_terms
+
+    def update(self, doc_ids: List[int], filenames: List[str], token_lists: List[List[str]],
+               deleted_ids: Iterable[int], version: int, spans: List[List[int]] | None = None):
+        """Append new (already preprocessed) rows and tombstone deleted documents in one persisted step.
+
+        `doc_ids`, `filenames`, `token_lists` (and `spans`, if given) describe
+        one row each. The cost is proportional to the rows being added or
+        removed, not to the size of the corpus.
+        """
+        for doc_id in deleted_ids:
+            if doc_id not in self._locations or doc_id in self.deleted:
+                continue
+            self.mapped = None
+            for seg_no, row in self._locations[doc_id]:
+                counts = self.segments[seg_no].counts
+                cols = counts.indices[counts.indptr[row]:counts.indptr[row + 1]]
+                self.df[cols] -= 1
+            self._live_rows -= len(self._locations[doc_id])
+            self.deleted.add(doc_id)
+
+        self.append(doc_ids, filenames, token_lists, spans)
+        self.version = version
+        self.generation += 1
+        self._save_meta()
+
+    def append(self, doc_ids: List[int], filenames: List[str], token_lists: List[List[str]],
+               spans: List[List[int]] | None = None):
+        """Write new rows as a segment without publishing them; `update` or `compact` makes them visible."""
+        keep = [i for i, d in enumerate(doc_ids) if d not in self._locations]
+        if keep:
+            counts, new_terms = self.count_terms((token_lists[i] for i in keep), grow=True)
+            self.df = np.concatenate([self.df, np.zeros(len(new_terms), dtype=np.int64)])
+            self.df += np.bincount(counts.indices, minlength=self.n_columns)
+            self._add_segment(f"seg_{self.generation:06d}", counts,
+                              [doc_ids[i] for i in keep], [filenames[i] for i in keep], new_terms,
+                              [spans[i] for i in keep] if spans is not None else None)
+            _save_segment(self.index_dir, self.segments[-1])
+            self.generation += 1
+            self.mapped = None
+        self._weighted = None
+
+    def needs_compaction(self) -> bool:
+        total = len(self._locations)
+        if total and len(self.deleted) / total >= COMPACT_DELETED_RATIO:
+            return True
+        return len(self.segments) > COMPACT_MAX_SEGMENTS
+
+    def compact(self):
+        """Rewrite the index as a single segment without tombstones or dead terms, with its weighted matrix."""
+        old_names = [seg.name for seg in self.segments]
+        counts, doc_ids, filenames, spans = self._live_counts()
+        if self.hash_features:
+            # Hashed columns are fixed by the hash function; only a vocabulary has dead terms to drop.
+            terms, df = [], self.df
+        else:
+            keep = np.flatnonzero(self.df > 0)
+            counts = counts[:, keep].tocsr()
+            terms = [self.terms[i] for i in keep]
+            df = self.df[keep]
+
+        self.segments = []
+        self.deleted = set()
+        self._locations = {}
+        self._live_rows = 0
+        self._weighted = None
+        self.df = df
+        self.terms = terms
+        self.vocabulary = {t: i for i, t in enumerate(terms)}
+        self._add_segment(f"seg_{self.generation:06d}", counts, doc_ids, filenames, terms, spans)
+        _save_segment(self.index_dir, self.segments[-1])
+        self.mapped = None
+        if self.external_idf is None:
+            matrix, _, _, _ = self.weighted_matrix()
+            name = f"weighted_{self.generation:06d}"
+            _save_csr(os.path.join(self.index_dir, name), matrix, np.float32)
+            self.mapped = name
+        self.generation += 1
+        self._save_meta()
+        for name in old_names:
+            _remove_segment(self.index_dir, name)
+
+    def query(self, text: str, top_k: int = 5, candidate_ids: Iterable[int] | None = None) -> List[Tuple[str, float]]:
+        return self.query_tokens(preprocess_text(text, self.preprocessing), top_k, candidate_ids)
+
+    @timed("corpus_query")
+    def query_tokens(self, tokens: List[str], top_k: int = 5,
+                     candidate_ids: Iterable[int] | None = None) -> List[Tuple[str, float]]:
+        """Score preprocessed `tokens` against the corpus and return the `top_k` best matches.
+
+        With `candidate_ids`, only those documents are scored (e.g. the
+        candidates from an LSH lookup); the rest of the corpus is skipped.
+        """
+        if len(self) == 0:
+            return []
+        return [(filename, score) for _, filename, score in
+                self.top_rows(self.vectorize([tokens]), top_k, candidate_ids)]
+
+    def top_rows(self, suspect_vector: csr_matrix, top_k: int = 5,
+                 candidate_ids: Iterable[int] | None = None) -> List[Tuple[int, str, float]]:
+        """Score an already weighted and normalised query vector, returning the best rows as (doc_id, filename, score)."""
+        if len(self) == 0:
+            return []
+        matrix, doc_ids, filenames, _ = self.weighted_matrix()
+        rows = None
+        if candidate_ids is not None:
+            rows = sorted(r for d in candidate_ids for r in self._rows.get(d, ()))
+            if not rows:
+                return []
+            matrix = matrix[rows]
+        # Both sides are L2-normalised, so the dot product is the cosine.
+        scores = (matrix @ suspect_vector.T).toarray().ravel()
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top_rows = [rows[i] for i in top] if rows is not None else top
+        return [(doc_ids[row], filenames[row], float(scores[i])) for i, row in zip(top, top_rows)]
+
+    def best_matches(self, token_lists: List[List[str]], top_k: int = 1,
+                     threshold: float = 0.0) -> List[List[Tuple[int, str, List[int] | None, float]]]:
+        """For each query in `token_lists`, return its `top_k` best rows scoring at least `threshold`.
+
+        Matches are (doc_id, filename, span, score) tuples, best first. All
+        queries are scored in one blocked sparse pass.
+        """
+        if len(self) == 0 or not token_lists:
+            return [[] for _ in token_lists]
+        matrix, doc_ids, filenames, spans = self.weighted_matrix()
+        query_vectors = self.vectorize(token_lists)
+        matches = top_k_per_row(query_vectors, matrix, top_k=top_k, threshold=threshold)
+        return [
+            [(doc_ids[row], filenames[row], spans[row] if spans else None, score) for row, score in row_matches]
+            for row_matches in matches
+        ]
+
+    def vectorize(self, token_lists: List[List[str]]) -> csr_matrix:
+        """Turn preprocessed queries into L2-normalised TF-IDF vectors over the index vocabulary."""
+        query_counts, _ = self.count_terms(token_lists)
+        return normalize(query_counts @ diags(self.idf()))
+
+    def weighted_matrix(self) -> Tuple[csr_matrix, List[int], List[str], List[List[int]] | None]:
+        """Return the L2-normalised TF-IDF matrix of the live rows, with each row's doc id, filename and span.
+
+        It is cached until the next update, so repeated queries pay for it
+        once. Weights are float32: scores keep about seven significant digits,
+        which is plenty to rank matches, in half the memory.
+        """
+        if self._weighted is None:
+            counts, doc_ids, filenames, spans = self._live_counts(with_counts=not self._use_mapped())
+            if self._use_mapped():
+                matrix = _map_csr(os.path.join(self.index_dir, self.mapped), self.n_columns)
+            else:
+                matrix = normalize(counts.astype(np.float64) @ diags(self.idf())).astype(np.float32)
+            self._weighted = (matrix, doc_ids, filenames, spans)
+            self._rows = {}
+            for i, d in enumerate(doc_ids):
+                self._rows.setdefault(d, []).append(i)
+        return self._weighted
+
+    def _use_mapped(self) -> bool:
+        # The saved matrix was weighted with the index's own IDF.
+        return self.mapped is not None and self.external_idf is None
+
+    def _live_counts(self, with_counts: bool = True) -> Tuple[csr_matrix | None, List[int], List[str],
+                                                             List[List[int]] | None]:
+        n_terms = self.n_columns
+        blocks = []
+        doc_ids = []
+        filenames = []
+        spans = []
+        has_spans = any(seg.spans is not None for seg in self.segments)
+        for seg in self.segments:
+            live = [row for row, d in enumerate(seg.doc_ids) if d not in self.deleted]
+            if not live:
+                continue
+            if with_counts:
+                counts = seg.counts
+                counts = csr_matrix((counts.data, counts.indices, counts.indptr), shape=(counts.shape[0], n_terms))
+                blocks.append(counts[live] if len(live) < counts.shape[0] else counts)
+            doc_ids.extend(seg.doc_ids[row] for row in live)
+            filenames.extend(seg.filenames[row] for row in live)
+            if has_spans:
+                spans.extend(seg.spans[row] for row in live)
+        if not with_counts:
+            return None, doc_ids, filenames, spans if has_spans else None
+        if not blocks:
+            return csr_matrix((0, n_terms), dtype=np.int32), [], [], None
+        return vstack(blocks).tocsr(), doc_ids, filenames, spans if has_spans else None
+
+    def _add_segment(self, name, counts, doc_ids, filenames, new_terms, spans=None):
+        seg_no = len(self.segments)
+        self.segments.append(_Segment(name, counts, doc_ids, filenames, new_terms, spans))
+        for row, doc_id in enumerate(doc_ids):
+            self._locations.setdefault(doc_id, []).append((seg_no, row))
+        self._live_rows += len(doc_ids)
+
+    def _save_meta(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        df_name = f"df_{self.generation:06d}.npy"
+        np.save(os.path.join(self.index_dir, df_name), self.df)
+        meta = {
+            "version": self.version,
+            "generation": self.generation,
+            "segments": [seg.name for seg in self.segments],
+            "deleted": sorted(self.deleted),
+            "df": df_name,
+            "preprocessing": self.preprocessing,
+            "hash_features": self.hash_features,
+            "mapped": self.mapped,
+        }
+        # The metadata file is swapped in last: it is what makes a change visible.
+        meta_path = os.path.join(self.index_dir, META_FILE)
+        tmp_path = meta_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+        for name in os.listdir(self.index_dir):
+            if name.startswith("df_") and name != df_name or \
+                    name.startswith("weighted_") and name.split(".")[0] != self.mapped:
+                _remove_file(os.path.join(self.index_dir, name))
+
+
+def _save_segment(index_dir: str, segment: _Segment):
+    os.makedirs(index_dir, exist_ok=True)
+    _save_csr(os.path.join(index_dir, segment.name), segment.counts)
+    with open(os.path.join(index_dir, segment.name + ".json"), "w", encoding="utf-8") as f:
+        info = {"doc_ids": segment.doc_ids, "filenames": segment.filenames, "new_terms": segment.new_terms,
+                "columns": segment.counts.shape[1]}
+        if segment.spans is not None:
+            info["spans"] = segment.spans
+        json.dump(info, f)
+
+
+def _remove_segment(index_dir: str, name: str):
+    for ext in (".npz", ".json") + CSR_FILES:
+        path = os.path.join(index_dir, name + ext)
+        if os.path.exists(path):
+            _remove_file(path)
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except PermissionError:
+        # Windows refuses to delete a file another process still has mapped; it is removed on a later save.
+        pass
+
+
+def _load_segment_counts(index_dir: str, name: str, n_columns: int) -> csr_matrix:
+    path = os.path.join(index_dir, name)
+    if os.path.exists(path + ".npz"):
+        # Indexes saved before segments were memory-mapped.
+        return load_npz(path + ".npz").tocsr()
+    return _map_csr(path, n_columns)
+
+
+def build_corpus_index(doc_ids: List[int], filenames: List[str], token_lists: List[List[str]], version: int,
+                       index_dir: str = INDEX_DIR, spans: List[List[int]] | None = None,
+                       preprocessing: str = DEFAULT_PREPROCESSING, hash_features: int | None = None) -> CorpusIndex:
+    remove_corpus_index(index_dir)
+    index = CorpusIndex(index_dir, preprocessing, hash_features)
+    index.append(doc_ids, filenames, token_lists, spans)
+    index.version = version
+    # Compacting publishes the index and saves its weighted matrix for memory mapping.
+    index.compact()
+    return index
+
+
+def remove_corpus_index(index_dir: str = INDEX_DIR):
+    if not os.path.isdir(index_dir):
+        return
+    for name in os.listdir(index_dir):
+        _remove_file(os.path.join(index_dir, name))
+
+
+def read_index_meta(index_dir: str = INDEX_DIR) -> dict | None:
+    """Return a saved index's metadata without loading the index."""
+    try:
+        with open(os.path.join(index_dir, META_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def read_index_version(index_dir: str = INDEX_DIR) -> int | None:
+    """Return the corpus version a saved index was built for, without loading the index."""
+    meta = read_index_meta(index_dir)
+    return meta.get("version") if meta else None
+
+
+def load_corpus_index(index_dir: str = INDEX_DIR) -> CorpusIndex | None:
+    meta_path = os.path.join(index_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+
+    index = CorpusIndex(index_dir, meta.get("preprocessing", "nltk"), meta.get("hash_features"))
+    for name in meta["segments"]:
+        with open(os.path.join(index_dir, name + ".json"), encoding="utf-8") as f:
+            info = json.load(f)
+        index.terms.extend(info["new_terms"])
+        counts = _load_segment_counts(index_dir, name, info.get("columns", len(index.terms)))
+        index._add_segment(name, counts, info["doc_ids"], info["filenames"], info["new_terms"], info.get("spans"))
+    index.vocabulary = {t: i for i, t in enumerate(index.terms)}
+    index.df = np.load(os.path.join(index_dir, meta["df"]))
+    index.deleted = set(meta["deleted"])
+    index._live_rows -= sum(len(index._locations[d]) for d in index.deleted if d in index._locations)
+    index.version = meta["version"]
+    index.generation = meta["generation"]
+    index.mapped = meta.get("mapped")
+    return index
+
+
+def compact_in_background(index_dir: str = INDEX_DIR) -> threading.Thread:
+    def run():
+        with INDEX_LOCK:
+            index = load_corpus_index(index_dir)
+            if index is not None and index.needs_compaction():
+                index.compact()
+                logger.info("Compacted %s (%d row(s)).", index_dir, len(index))
+
+    thread = threading.Thread(target=run, name="corpus-index-compaction", daemon=True)
+    thread.start()
+    return thread
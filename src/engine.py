@@ -0,0 +1,188 @@
+import os
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+from .corpus_index import CorpusIndex, INDEX_DIR, INDEX_LOCK, META_FILE, SENTENCE_INDEX_DIR, load_corpus_index, \
+    read_index_version
+from .highlighter import find_corpus_sentence_matches
+from .lsa import LSA_DIR, SENTENCE_LSA_DIR, LsaIndex, load_lsa_index
+from .preprocessing import preprocess_text
+from .sharding import LAYOUT_FILE, SHARDS_DIR, ShardedIndex, read_layout, shard_dir
+
+# Engines kept by `shared_engine`, oldest first.
+MAX_SHARED_ENGINES = 2
+_shared_engines: Dict[tuple, "ScoringEngine"] = {}
+_shared_engines_lock = threading.Lock()
+
+
+class ScoringEngine:
+    """A read-only snapshot of the fitted corpus model for one corpus version.
+
+    Everything a query needs is computed when the engine is built, and
+    queries only read from it, so one engine can be shared by every session
+    and thread in the process. Index updates happen on separately loaded
+    indexes; picking them up means building a new engine.
+    """
+
+    def __init__(self, index: CorpusIndex | ShardedIndex, sentence_index: CorpusIndex | None = None,
+                 lsa_index: LsaIndex | None = None, sentence_lsa_index: LsaIndex | None = None,
+                 identity: tuple = ()):
+        # Derived indexes left behind by the corpus are not used.
+        if sentence_index is not None and sentence_index.version != index.version:
+            sentence_index = None
+        if lsa_index is not None and lsa_index.version != index.version:
+            lsa_index = None
+        if sentence_lsa_index is not None and sentence_lsa_index.version != index.version:
+            sentence_lsa_index = None
+        self._index = index
+        self._sentence_index = sentence_index
+        self._lsa_index = lsa_index
+        self._sentence_lsa_index = sentence_lsa_index
+        self._filenames = tuple(index.filenames)
+        # The `read_engine_identity` of the saved indexes this engine was loaded from.
+        self.identity = identity
+        # Fill the lazily built matrices now, so concurrent queries never race to build them.
+        # A sharded index keeps its matrices in its worker processes.
+        for part in (index, sentence_index):
+            if isinstance(part, CorpusIndex) and len(part):
+                matrix, _, _, _ = part.weighted_matrix()
+                matrix.data.flags.writeable = False
+                part.df.flags.writeable = False
+
+    @classmethod
+    def load(cls, index_dir: str = INDEX_DIR, sentence_index_dir: str = SENTENCE_INDEX_DIR,
+             shards_dir: str = SHARDS_DIR, lsa_dir: str = LSA_DIR,
+             sentence_lsa_dir: str = SENTENCE_LSA_DIR) -> "ScoringEngine | None":
+        """Load the sharded index if there is one, else the corpus index.
+
+        Holds INDEX_LOCK, so a compaction running in this process cannot
+        delete the files being read.
+        """
+        with INDEX_LOCK:
+            identity = read_engine_identity(index_dir, sentence_index_dir, shards_dir, lsa_dir, sentence_lsa_dir)
+            if read_layout(shards_dir) is not None:
+                index = ShardedIndex(shards_dir)
+            else:
+                index = load_corpus_index(index_dir)
+            if index is None:
+                return None
+            return cls(index, load_corpus_index(sentence_index_dir), load_lsa_index(lsa_dir),
+                       load_lsa_index(sentence_lsa_dir), identity)
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def version(self) -> int | None:
+        return self._index.version
+
+    @property
+    def filenames(self) -> Tuple[str, ...]:
+        return self._filenames
+
+    @property
+    def preprocessing(self) -> str:
+        return self._index.preprocessing
+
+    @property
+    def hash_features(self) -> int | None:
+        return self._index.hash_features
+
+    @property
+    def has_sentence_index(self) -> bool:
+        return self._sentence_index is not None
+
+    @property
+    def has_lsa(self) -> bool:
+        return self._lsa_index is not None
+
+    @property
+    def has_sentence_lsa(self) -> bool:
+        return self._sentence_lsa_index is not None and self._sentence_index is not None
+
+    def tokenize(self, text: str) -> List[str]:
+        """Preprocess `text` the way the corpus index was built."""
+        return preprocess_text(text, self._index.preprocessing)
+
+    def query(self, text: str, top_k: int = 5, candidate_ids: Iterable[int] | None = None) -> List[Tuple[str, float]]:
+        return self._index.query(text, top_k, candidate_ids)
+
+    def query_tokens(self, tokens: List[str], top_k: int = 5,
+                     candidate_ids: Iterable[int] | None = None) -> List[Tuple[str, float]]:
+        return self._index.query_tokens(tokens, top_k, candidate_ids)
+
+    def query_lsa(self, text: str, top_k: int = 5,
+                  candidate_ids: Iterable[int] | None = None) -> List[Tuple[str, float]]:
+        """Like `query`, scored on the LSA embeddings; `has_lsa` must be true."""
+        return self._lsa_index.query(text, top_k, candidate_ids)
+
+    def sentence_matches(self, suspect_sentences: List[str], threshold: float = 0.8,
+                         lsa: bool = False) -> Dict[int, tuple]:
+        """Best corpus match per suspect sentence (see `find_corpus_sentence_matches`); empty without a sentence index.
+
+        With `lsa`, sentences are matched on the sentence LSA embeddings when they exist.
+        """
+        sentence_index = self._sentence_index
+        if lsa and self._sentence_lsa_index is not None:
+            sentence_index = self._sentence_lsa_index
+        if sentence_index is None:
+            return {}
+        return find_corpus_sentence_matches(sentence_index, suspect_sentences, threshold)
+
+
+def read_engine_version(index_dir: str = INDEX_DIR, shards_dir: str = SHARDS_DIR) -> int | None:
+    """Corpus version of the saved index `ScoringEngine.load` would use; None when it has none."""
+    layout = read_layout(shards_dir)
+    if layout is not None:
+        return layout["version"]
+    return read_index_version(index_dir)
+
+
+def saved_index_exists(index_dir: str = INDEX_DIR, shards_dir: str = SHARDS_DIR) -> bool:
+    return read_layout(shards_dir) is not None or read_index_version(index_dir) is not None
+
+
+def read_engine_identity(index_dir: str = INDEX_DIR, sentence_index_dir: str = SENTENCE_INDEX_DIR,
+                         shards_dir: str = SHARDS_DIR, lsa_dir: str = LSA_DIR,
+                         sentence_lsa_dir: str = SENTENCE_LSA_DIR) -> tuple:
+    """A key for the saved indexes `ScoringEngine.load` would read, without loading them.
+
+    Every index rewrites its metadata file on each save, so the key changes
+    whenever any of them is updated, rebuilt, compacted, added or removed,
+    even when the corpus version stays the same.
+    """
+    layout = read_layout(shards_dir)
+    paths = [os.path.join(shards_dir, LAYOUT_FILE)]
+    if layout is not None:
+        paths.extend(os.path.join(shard_dir(n, shards_dir), META_FILE) for n in layout["shards"])
+    else:
+        paths.append(os.path.join(index_dir, META_FILE))
+    paths.extend(os.path.join(d, META_FILE) for d in (sentence_index_dir, lsa_dir, sentence_lsa_dir))
+    identity = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            identity.append((path, stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            identity.append((path, None, None))
+    return tuple(identity)
+
+
+def shared_engine() -> "ScoringEngine | None":
+    """Return the engine for the saved indexes, loading it only when they have changed.
+
+    Engines are kept per `read_engine_identity` in this module, not in a
+    web framework's cache, so any thread of the process can call this and
+    they all share one engine per state of the indexes.
+    """
+    with _shared_engines_lock:
+        identity = read_engine_identity()
+        engine = _shared_engines.get(identity)
+        if engine is None:
+            engine = ScoringEngine.load()
+            if engine is None:
+                return None
+            _shared_engines[identity] = engine
+            while len(_shared_engines) > MAX_SHARED_ENGINES:
+                del _shared_engines[next(iter(_shared_engines))]
+        return engine
@@ -0,0 +1,216 @@
+import sqlite3
+from typing import Dict, List, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Any shared run of at least KGRAM_SIZE + WINDOW_SIZE - 1 normalised
+# characters is guaranteed to produce a common fingerprint.
+KGRAM_SIZE = 25
+WINDOW_SIZE = 4
+_BASE = np.uint64(257)
+
+# Matches closer than this many characters are merged into one passage.
+PASSAGE_GAP = 2 * KGRAM_SIZE
+
+create_fingerprint_sql = '''
+CREATE TABLE IF NOT EXISTS fingerprints (
+    fp_hash INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL,
+    start_offset INTEGER NOT NULL,
+    end_offset INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fingerprints_hash ON fingerprints (fp_hash);
+CREATE INDEX IF NOT EXISTS fingerprints_doc ON fingerprints (doc_id);
+CREATE TRIGGER IF NOT EXISTS documents_delete_fingerprints AFTER DELETE ON documents
+BEGIN
+    DELETE FROM fingerprints WHERE doc_id = OLD.id;
+END;
+'''
+
+_ASCII_ALNUM = np.array([chr(c).isalnum() for c in range(128)])
+
+
+def normalize_for_fingerprints(text: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Lowercase `text` and drop everything but letters and digits.
+
+    Returns the remaining code points and, for each, its offset in `text`,
+    so fingerprints can be mapped back to the original characters.
+    """
+    codes = np.frombuffer(text.encode("utf-32-le", errors="surrogatepass"), dtype=np.uint32)
+    keep = np.zeros(codes.size, dtype=bool)
+    ascii_mask = codes < 128
+    keep[ascii_mask] = _ASCII_ALNUM[codes[ascii_mask]]
+    lowered = codes.astype(np.uint64)
+    upper = (codes >= 65) & (codes <= 90)
+    lowered[upper] += 32
+
+    other = ~ascii_mask
+    if other.any():
+        # Only the distinct non-ASCII characters need a trip through Python.
+        unique = np.unique(codes[other])
+        alnum = np.array([chr(c).isalnum() for c in unique])
+        lower = np.array([ord(chr(c).lower()[0]) for c in unique], dtype=np.uint64)
+        positions = np.searchsorted(unique, codes[other])
+        keep[other] = alnum[positions]
+        lowered[other] = lower[positions]
+
+    offsets = np.flatnonzero(keep)
+    return lowered[offsets], offsets
+
+
+def kgram_hashes(codes: np.ndarray, k: int = KGRAM_SIZE) -> np.ndarray:
+    n = codes.size - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    hashes = np.zeros(n, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for offset in range(k):
+            hashes = hashes * _BASE + codes[offset:offset + n]
+    # SQLite integers are signed 64-bit.
+    return hashes >> np.uint64(1)
+
+
+def winnow(hashes: np.ndarray, window: int = WINDOW_SIZE) -> np.ndarray:
+    """Return the positions selected by winnowing: the rightmost minimum of every window."""
+    if hashes.size == 0:
+        return np.zeros(0, dtype=np.int64)
+    if hashes.size <= window:
+        return np.array([hashes.size - 1 - np.argmin(hashes[::-1])])
+    windows = sliding_window_view(hashes, window)
+    rightmost_min = window - 1 - np.argmin(windows[:, ::-1], axis=1)
+    return np.unique(rightmost_min + np.arange(windows.shape[0]))
+
+
+def fingerprint_text(text: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return the winnowed fingerprints of `text` as (hashes, start offsets, end offsets)."""
+    codes, offsets = normalize_for_fingerprints(text or "")
+    hashes = kgram_hashes(codes)
+    selected = winnow(hashes)
+    starts = offsets[selected]
+    ends = offsets[selected + KGRAM_SIZE - 1] + 1
+    return hashes[selected], starts, ends
+
+
+def fingerprints_enabled(db_path="corpus.db") -> bool:
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'fingerprints'"
+        ).fetchone()
+        return row is not None
+    finally:
+        conn.close()
+
+
+def reset_fingerprint_index(db_path="corpus.db"):
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(create_fingerprint_sql)
+        conn.execute("DELETE FROM fingerprints")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def index_documents(doc_ids: List[int], texts: List[str], db_path="corpus.db"):
+    if not fingerprints_enabled(db_path):
+        return
+    conn = sqlite3.connect(db_path)
+    try:
+        for doc_id, text in zip(doc_ids, texts):
+            hashes, starts, ends = fingerprint_text(text)
+            conn.execute("DELETE FROM fingerprints WHERE doc_id = ?", (doc_id,))
+            conn.executemany(
+                "INSERT INTO fingerprints (fp_hash, doc_id, start_offset, end_offset) VALUES (?, ?, ?, ?)",
+                zip(hashes.tolist(), [doc_id] * len(hashes), starts.tolist(), ends.tolist())
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _merge_passages(pairs: List[Tuple[int, int, int, int]]) -> List[Tuple[int, int, int, int]]:
+    """Merge overlapping or nearby (suspect start, suspect end, source start, source end) matches.
+
+    A match extends a passage only when it is close to it in both documents,
+    so text repeated within the source doesn't fuse unrelated passages.
+    """
+    passages = []
+    open_passages = []
+    for s_start, s_end, d_start, d_end in sorted(pairs):
+        still_open = []
+        for i in open_passages:
+            if passages[i][1] + PASSAGE_GAP >= s_start:
+                still_open.append(i)
+        open_passages = still_open
+        for i in open_passages:
+            ps_start, ps_end, pd_start, pd_end = passages[i]
+            if pd_start <= d_start <= pd_end + PASSAGE_GAP:
+                passages[i] = (ps_start, max(ps_end, s_end), pd_start, max(pd_end, d_end))
+                break
+        else:
+            open_passages.append(len(passages))
+            passages.append((s_start, s_end, d_start, d_end))
+    return passages
+
+
+def _covered_length(intervals: List[Tuple[int, int]]) -> int:
+    covered = 0
+    current_start = current_end = None
+    for start, end in sorted(intervals):
+        if current_end is None or start > current_end:
+            if current_end is not None:
+                covered += current_end - current_start
+            current_start, current_end = start, end
+        else:
+            current_end = max(current_end, end)
+    if current_end is not None:
+        covered += current_end - current_start
+    return covered
+
+
+def find_copied_passages(text: str, db_path="corpus.db") -> List[Dict]:
+    """Find corpus documents sharing fingerprints with `text`.
+
+    Each result has the document's id and filename, the number of shared
+    fingerprints, the fraction of `text` covered by shared passages, and the
+    passages themselves as character offsets in `text` and in the source
+    document. Lookups go through the fingerprint index, so the cost grows
+    with the size of `text`, not of the corpus.
+    """
+    hashes, starts, ends = fingerprint_text(text)
+    if hashes.size == 0:
+        return []
+
+    suspect_positions = {}
+    for h, s, e in zip(hashes.tolist(), starts.tolist(), ends.tolist()):
+        suspect_positions.setdefault(h, []).append((s, e))
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("CREATE TEMP TABLE query_fingerprints (fp_hash INTEGER PRIMARY KEY)")
+        conn.executemany("INSERT INTO query_fingerprints VALUES (?)", ((h,) for h in suspect_positions))
+        rows = conn.execute(
+            "SELECT f.fp_hash, f.doc_id, f.start_offset, f.end_offset, d.filename "
+            "FROM query_fingerprints q "
+            "JOIN fingerprints f ON f.fp_hash = q.fp_hash "
+            "JOIN documents d ON d.id = f.doc_id"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    by_doc = {}
+    for fp_hash, doc_id, d_start, d_end, filename in rows:
+        entry = by_doc.setdefault(doc_id, {"doc_id": doc_id, "filename": filename, "shared": 0, "pairs": []})
+        entry["shared"] += 1
+        entry["pairs"].extend((s, e, d_start, d_end) for s, e in suspect_positions[fp_hash])
+
+    results = []
+    for entry in by_doc.values():
+        pairs = entry.pop("pairs")
+        entry["passages"] = _merge_passages(pairs)
+        entry["coverage"] = _covered_length([(s, e) for s, e, _, _ in pairs]) / max(len(text), 1)
+        results.append(entry)
+    results.sort(key=lambda r: r["coverage"], reverse=True)
+    return results
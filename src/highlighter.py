@@ -1,23 +1,44 @@
-import nltk
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy.sparse import csr_matrix, issparse
 import html
+from src.similarity import sparse_similarity
 from src.vectorizer import vectorize_corpus
+from src.parallel import preprocess_documents
+from src.profiling import count, timed
 
 
+@timed("split_sentences")
 def split_into_sentences(text):
     if not text:
         return []
+    import nltk
     sentences=nltk.sent_tokenize(text)
+    count("sentences", len(sentences))
     return sentences
 
 
-def vectorize_sentences(source_sentences, suspect_sentences):
+def split_into_sentence_spans(text):
+    """Split `text` into sentences and return them with their (start, end) character offsets."""
+    sentences = split_into_sentences(text)
+    spans = []
+    position = 0
+    for sentence in sentences:
+        start = text.find(sentence, position)
+        if start == -1:
+            start = position
+        end = start + len(sentence)
+        spans.append([start, end])
+        position = end
+    return sentences, spans
+
+
+@timed("vectorize_sentences")
+def vectorize_sentences(source_sentences, suspect_sentences, workers=None):
     if not source_sentences and not suspect_sentences:
         return (None, None)
 
     all_sentences = source_sentences + suspect_sentences
-    vectorized_corpus = vectorize_corpus(all_sentences)
+    vectorized_corpus = vectorize_corpus(all_sentences, workers)
     num_source_sentences = len(source_sentences)
     source_vectors = vectorized_corpus[:num_source_sentences]
     suspect_vectors = vectorized_corpus[num_source_sentences:]
@@ -25,30 +46,123 @@ def vectorize_sentences(source_sentences, suspect_sentences):
     return source_vectors, suspect_vectors
 
 
-def calculate_sentence_similarity_matrix(source_vectors, suspect_vectors):
+@timed("sentence_similarity")
+def calculate_sentence_similarity_matrix(source_vectors, suspect_vectors, threshold=0.0, top_k=None,
+                                         block_size=256):
+    """Return the suspect x source sentence similarity matrix as a sparse matrix.
+
+    Only similarities of at least `threshold` (and, with `top_k`, only the
+    best `top_k` per suspect sentence) are stored, and suspect sentences are
+    scored `block_size` at a time, so two long documents never need a dense
+    matrix. The sentence vectors come from `vectorize_sentences` and are
+    already L2-normalised.
+    """
     if source_vectors is None or suspect_vectors is None:
-        return np.array([])
+        return csr_matrix((0, 0))
     if source_vectors.shape[0] == 0 or suspect_vectors.shape[0] == 0:
-        return np.array([])
-    similarity_matrix = cosine_similarity(suspect_vectors, source_vectors)
+        return csr_matrix((suspect_vectors.shape[0], source_vectors.shape[0]))
+    return sparse_similarity(suspect_vectors, source_vectors, threshold, top_k, block_size)
 
-    return similarity_matrix
 
 def identify_matching_sentences(similarity_matrix, threshold=0.8):
     if similarity_matrix.size == 0:
         return set()
+    if issparse(similarity_matrix):
+        matches = similarity_matrix.tocoo()
+        return set(matches.row[matches.data >= threshold].tolist())
     matching_pairs = np.argwhere(similarity_matrix >= threshold)
     plagiarized_suspect_indices = [match[0] for match in matching_pairs]
     return set(plagiarized_suspect_indices)
 
 
-def generate_html_report(suspect_sentences, plagiarized_indices):
+def best_sentence_matches(similarity_matrix, threshold=0.8):
+    """Map each suspect sentence index to its best (source sentence index, score) at or above `threshold`."""
+    matrix = csr_matrix(similarity_matrix)
+    best = {}
+    for i in range(matrix.shape[0]):
+        scores = matrix.data[matrix.indptr[i]:matrix.indptr[i + 1]]
+        if scores.size == 0:
+            continue
+        j = int(np.argmax(scores))
+        if scores[j] >= threshold:
+            best[i] = (int(matrix.indices[matrix.indptr[i] + j]), float(scores[j]))
+    return best
+
+
+@timed("corpus_sentence_match")
+def find_corpus_sentence_matches(sentence_index, suspect_sentences, threshold=0.8):
+    """Match each suspect sentence against the persistent corpus sentence index.
+
+    Returns a dict mapping suspect sentence index to its best corpus match
+    as (doc_id, filename, [start, end] in that document, score).
+    """
+    token_lists = preprocess_documents(suspect_sentences, mode=sentence_index.preprocessing)
+    matches = sentence_index.best_matches(token_lists, top_k=1, threshold=threshold)
+    return {i: best[0] for i, best in enumerate(matches) if best}
+
+
+@timed("report")
+def generate_html_report(suspect_sentences, plagiarized_indices, sources=None):
+    """Render the suspect sentences as HTML, highlighting the plagiarized ones.
+
+    `sources` optionally maps a sentence index to a description of what it
+    matched, shown as the highlight's tooltip.
+    """
     highlighted_html_parts = []
     for i, sentence in enumerate(suspect_sentences):
         safe_sentence = html.escape(sentence)
         if i in plagiarized_indices:
-            highlighted_sentence = f'<mark class="highlight">{safe_sentence}</mark>'
+            if sources and i in sources:
+                safe_source = html.escape(sources[i], quote=True)
+                highlighted_sentence = f'<mark class="highlight" title="{safe_source}">{safe_sentence}</mark>'
+            else:
+                highlighted_sentence = f'<mark class="highlight">{safe_sentence}</mark>'
             highlighted_html_parts.append(highlighted_sentence)
         else:
             highlighted_html_parts.append(safe_sentence)
-    return " ".join(highlighted_html_parts)
\ No newline at end of file
+    return " ".join(highlighted_html_parts)
+
+@timed("report")
+def generate_passage_report(suspect_text, aligned):
+    """Render `suspect_text` as HTML with every aligned passage highlighted and linked to its source.
+
+    `aligned` is the output of `align_passages`, best source first; where
+    passages from several sources overlap, the best source's is shown. The
+    sources' passages are listed below the text, each with the anchor its
+    highlights link to.
+    """
+    # Label every character with the passage shown over it, filling the best source last so it wins.
+    owner = np.full(len(suspect_text), -1, dtype=np.int64)
+    labels = []
+    for source_no in reversed(range(len(aligned))):
+        for passage_no, passage in enumerate(aligned[source_no]["passages"]):
+            owner[passage[0]:passage[1]] = len(labels)
+            labels.append((source_no, passage_no))
+
+    def escape(text):
+        # No raw newlines, so Markdown leaves the whole report as one HTML block.
+        return html.escape(text).replace("\n", "<br>")
+
+    parts = []
+    bounds = np.concatenate(([0], np.flatnonzero(np.diff(owner)) + 1, [len(suspect_text)]))
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        if start == end:
+            continue
+        label = owner[start]
+        if label < 0:
+            parts.append(escape(suspect_text[start:end]))
+            continue
+        source_no, passage_no = labels[label]
+        title = html.escape(f"{aligned[source_no]['filename']}, passage {passage_no + 1}", quote=True)
+        parts.append(f'<a href="#aligned-{source_no}-{passage_no}" title="{title}">'
+                     f'<mark class="highlight">{escape(suspect_text[start:end])}</mark></a>')
+
+    sources = []
+    for source_no, match in enumerate(aligned):
+        items = "".join(
+            f'<li id="aligned-{source_no}-{passage_no}">Characters {start}–{end}: <q>{escape(excerpt)}</q></li>'
+            for passage_no, (_, _, start, end, excerpt) in enumerate(match["passages"])
+        )
+        sources.append(f"<p><b>{html.escape(match['filename'])}</b> "
+                       f"({match['coverage'] * 100:.1f}% of the document)</p><ol>{items}</ol>")
+    return f'<div>{"".join(parts)}</div><hr><div>{"".join(sources)}</div>'
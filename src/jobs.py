@@ -0,0 +1,181 @@
+import json
+import logging
+import threading
+from typing import Callable, Dict
+
+from .storage import connection, decode_text, encode_text
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Jobs run at once per process; the rest wait in the table, so a burst of
+# submissions queues up instead of competing for the CPU.
+JOB_WORKERS = 2
+# Submissions are refused while this many jobs are waiting.
+MAX_QUEUED_JOBS = 200
+# Idle workers look for jobs submitted by other processes this often.
+IDLE_POLL_SECONDS = 2.0
+# Finished jobs are deleted after this long.
+JOB_RETENTION_DAYS = 7
+
+create_jobs_sql = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_key TEXT NOT NULL,
+    params TEXT NOT NULL,
+    text_content BLOB NOT NULL,
+    status TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    submitted_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (job_key);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+'''
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Run submitted jobs on a fixed number of worker threads, with their state kept in SQLite.
+
+    A job is a text plus JSON parameters, passed to `runner`, whose JSON
+    result is stored with the job. Submitting the key of a job that is not
+    failed returns that job instead of queuing the work again. Job state
+    outlives the process: jobs left running by a previous run are queued
+    again when the queue starts.
+    """
+
+    def __init__(self, runner: Callable[[Dict, str], Dict], db_path="corpus.db", workers: int = JOB_WORKERS,
+                 max_queued: int = MAX_QUEUED_JOBS):
+        self.runner = runner
+        self.db_path = db_path
+        self.max_queued = max_queued
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        with connection(db_path) as conn:
+            conn.executescript(create_jobs_sql)
+            with conn:
+                conn.execute(f"UPDATE jobs SET status = '{QUEUED}', started_at = NULL WHERE status = '{RUNNING}'")
+                conn.execute(
+                    f"DELETE FROM jobs WHERE status IN ('{DONE}', '{FAILED}') "
+                    f"AND finished_at < datetime('now', '-{JOB_RETENTION_DAYS} days')"
+                )
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job_key: str, text: str, params: Dict) -> int:
+        """Queue a job and return its id, or the id of the live job with the same key."""
+        with connection(self.db_path) as conn:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    f"SELECT id FROM jobs WHERE job_key = ? AND status != '{FAILED}' ORDER BY id DESC LIMIT 1",
+                    (job_key,)
+                ).fetchone()
+                if row is not None:
+                    return row[0]
+                queued = conn.execute(f"SELECT COUNT(*) FROM jobs WHERE status = '{QUEUED}'").fetchone()[0]
+                if queued >= self.max_queued:
+                    raise QueueFull(f"{queued} checks are already waiting. Please try again in a few minutes.")
+                job_id = conn.execute(
+                    "INSERT INTO jobs (job_key, params, text_content, status) VALUES (?, ?, ?, ?)",
+                    (job_key, json.dumps(params), encode_text(text), QUEUED)
+                ).lastrowid
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id: int) -> Dict | None:
+        """Return a job's status, parameters, result or error, and its place in the queue."""
+        with connection(self.db_path) as conn:
+            row = conn.execute(
+                "SELECT id, status, params, result, error, submitted_at, started_at, finished_at "
+                "FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            job = dict(zip(("id", "status", "params", "result", "error", "submitted_at", "started_at",
+                            "finished_at"), row))
+            job["params"] = json.loads(job["params"])
+            job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+            job["ahead"] = None
+            if job["status"] == QUEUED:
+                job["ahead"] = conn.execute(
+                    f"SELECT COUNT(*) FROM jobs WHERE status = '{QUEUED}' AND id < ?", (job_id,)
+                ).fetchone()[0]
+            return job
+
+    def text(self, job_id: int) -> str | None:
+        """Return the text a job was submitted with."""
+        with connection(self.db_path) as conn:
+            row = conn.execute("SELECT text_content FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return decode_text(row[0]) if row is not None else None
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def _claim(self) -> tuple | None:
+        with connection(self.db_path) as conn:
+            with conn:
+                # The write lock makes claiming atomic across threads and processes.
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    f"SELECT id, params, text_content FROM jobs WHERE status = '{QUEUED}' ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    f"UPDATE jobs SET status = '{RUNNING}', started_at = CURRENT_TIMESTAMP WHERE id = ?", (row[0],)
+                )
+        job_id, params, text = row
+        return job_id, json.loads(params), decode_text(text)
+
+    def _finish(self, job_id: int, status: str, result: str | None = None, error: str | None = None):
+        with connection(self.db_path) as conn:
+            with conn:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+                    (status, result, error, job_id)
+                )
+
+    def _work(self):
+        while not self._stop.is_set():
+            try:
+                job = self._claim()
+            except Exception:
+                logger.exception("Could not claim a job")
+                job = None
+            if job is None:
+                self._wake.wait(IDLE_POLL_SECONDS)
+                self._wake.clear()
+                continue
+            job_id, params, text = job
+            try:
+                result = json.dumps(self.runner(params, text))
+            except BaseException as e:
+                # Anything the runner raises, SystemExit included, fails the job rather than the
+                # worker, which would leave the job running forever. Expected failures (e.g. a
+                # document checked against itself) carry a message for the user.
+                if not isinstance(e, ValueError):
+                    logger.exception("Job %d failed", job_id)
+                status, result, error = FAILED, None, str(e) or type(e).__name__
+            else:
+                status, error = DONE, None
+            try:
+                self._finish(job_id, status, result=result, error=error)
+            except Exception:
+                # The job is queued again when the queue next starts.
+                logger.exception("Could not record the outcome of job %d", job_id)
@@ -0,0 +1,278 @@
+import json
+import os
+from collections import Counter
+from typing import Iterable, List, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags, spmatrix
+
+from .corpus_index import MODELS_DIR, CorpusIndex, hash_counts, normalize
+from .lsa_defaults import DEFAULT_LSA_DIMENSIONS
+from .preprocessing import DEFAULT_PREPROCESSING, preprocess_text
+from .profiling import timed
+
+LSA_DIR = os.path.join(MODELS_DIR, "lsa_index")
+SENTENCE_LSA_DIR = os.path.join(MODELS_DIR, "lsa_sentence_index")
+META_FILE = "meta.json"
+
+# Suspect rows scored against the embeddings at a time, bounding the dense score block.
+QUERY_BLOCK_SIZE = 64
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalise dense rows as float32, leaving zero rows as they are."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+
+def fit_svd(matrix: spmatrix, dimensions: int, seed: int = 0):
+    """Fit a truncated SVD of `matrix` with at most `dimensions` components; None if it is too small."""
+    from sklearn.decomposition import TruncatedSVD
+    n_components = min(dimensions, min(matrix.shape) - 1)
+    if n_components < 1:
+        return None
+    return TruncatedSVD(n_components=n_components, algorithm="randomized", random_state=seed).fit(matrix)
+
+
+def lsa_embeddings(vectors: spmatrix, dimensions: int = DEFAULT_LSA_DIMENSIONS, seed: int = 0) -> np.ndarray:
+    """Project TF-IDF `vectors` onto their own top `dimensions` latent directions, L2-normalised.
+
+    Used to compare a set of documents among themselves; with too few
+    documents to fit any direction, the vectors are returned densified.
+    """
+    svd = fit_svd(vectors, dimensions, seed)
+    if svd is None:
+        return normalize_rows(vectors.toarray())
+    return normalize_rows(svd.transform(vectors))
+
+
+class LsaIndex:
+    """Dense latent semantic (LSA) embeddings of the rows of a corpus index.
+
+    A truncated SVD of the index's TF-IDF matrix gives `dimensions` latent
+    directions, and each row is stored as its L2-normalised float32
+    projection onto them. Terms that occur in the same contexts share
+    directions, so lightly paraphrased text still scores high, and scoring
+    a query is one dense matrix-vector product whatever the vocabulary.
+
+    The model covers the terms (or hashed columns) in use at fitting time,
+    with their IDF, and keeps its own copy of them, so later renumbering of
+    the index's columns does not affect it. Documents added later are folded
+    in with the fitted directions; only a refit picks up new terms.
+    """
+
+    def __init__(self, lsa_dir: str, preprocessing: str = DEFAULT_PREPROCESSING, hash_features: int | None = None,
+                 terms: List[str] | None = None, columns: np.ndarray | None = None, idf: np.ndarray | None = None,
+                 components: np.ndarray | None = None):
+        self.lsa_dir = lsa_dir
+        self.preprocessing = preprocessing
+        self.hash_features = hash_features
+        # The model's terms, or with `hash_features` the hashed columns it uses.
+        self.terms = terms or []
+        self.vocabulary = {t: i for i, t in enumerate(self.terms)}
+        self.columns = columns
+        self.idf = idf
+        self.components = components
+        self.version = None
+        self.generation = 0
+        self.embeddings = np.zeros((0, self.dimensions), dtype=np.float32)
+        self.doc_ids: List[int] = []
+        self.filenames: List[str] = []
+        self.spans: List[List[int]] | None = None
+        self._rows = {}
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    @property
+    def dimensions(self) -> int:
+        return self.components.shape[0] if self.components is not None else 0
+
+    def count_terms(self, token_lists: Iterable[List[str]]) -> csr_matrix:
+        if self.hash_features:
+            return hash_counts(token_lists, self.hash_features)[:, self.columns]
+        indptr, indices, data = [0], [], []
+        for tokens in token_lists:
+            for term, count in Counter(tokens).items():
+                col = self.vocabulary.get(term)
+                if col is not None:
+                    indices.append(col)
+                    data.append(count)
+            indptr.append(len(indices))
+        return csr_matrix((np.array(data, dtype=np.int32), np.array(indices, dtype=np.int32), indptr),
+                          shape=(len(indptr) - 1, len(self.terms)))
+
+    def embed(self, token_lists: List[List[str]]) -> np.ndarray:
+        """Embed preprocessed texts: TF-IDF with the fitted IDF, projected and L2-normalised."""
+        vectors = normalize(self.count_terms(token_lists).astype(np.float64) @ diags(self.idf))
+        return normalize_rows(np.asarray(vectors @ self.components.T))
+
+    def query(self, text: str, top_k: int = 5, candidate_ids: Iterable[int] | None = None) -> List[Tuple[str, float]]:
+        return self.query_tokens(preprocess_text(text, self.preprocessing), top_k, candidate_ids)
+
+    @timed("lsa_query")
+    def query_tokens(self, tokens: List[str], top_k: int = 5,
+                     candidate_ids: Iterable[int] | None = None) -> List[Tuple[str, float]]:
+        if len(self) == 0:
+            return []
+        embeddings = self.embeddings
+        rows = None
+        if candidate_ids is not None:
+            rows = sorted(r for d in candidate_ids for r in self._rows.get(d, ()))
+            if not rows:
+                return []
+            embeddings = embeddings[rows]
+        # Both sides are L2-normalised, so the dot product is the cosine.
+        scores = embeddings @ self.embed([tokens])[0]
+        top_k = min(top_k, len(scores))
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        top_rows = [rows[i] for i in top] if rows is not None else top
+        return [(self.filenames[row], float(scores[i])) for i, row in zip(top, top_rows)]
+
+    def best_matches(self, token_lists: List[List[str]], top_k: int = 1,
+                     threshold: float = 0.0) -> List[List[Tuple[int, str, List[int] | None, float]]]:
+        """Like `CorpusIndex.best_matches`, scored in the latent space."""
+        if len(self) == 0 or not token_lists:
+            return [[] for _ in token_lists]
+        queries = self.embed(token_lists)
+        top_k = min(top_k, len(self))
+        matches = []
+        for start in range(0, len(queries), QUERY_BLOCK_SIZE):
+            scores = queries[start:start + QUERY_BLOCK_SIZE] @ self.embeddings.T
+            top = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+            for row_scores, row_top in zip(scores, top):
+                row_top = row_top[np.argsort(-row_scores[row_top], kind="stable")]
+                matches.append([
+                    (self.doc_ids[row], self.filenames[row], self.spans[row] if self.spans else None,
+                     float(row_scores[row]))
+                    for row in row_top if row_scores[row] >= threshold
+                ])
+        return matches
+
+    def update(self, doc_ids: List[int], filenames: List[str], token_lists: List[List[str]],
+               deleted_ids: Iterable[int], version: int, spans: List[List[int]] | None = None):
+        """Fold new rows in with the fitted directions and drop deleted documents, then save."""
+        deleted = set(deleted_ids)
+        keep = [i for i, d in enumerate(self.doc_ids) if d not in deleted]
+        blocks = [self.embeddings[keep] if len(keep) < len(self) else self.embeddings]
+        if token_lists:
+            blocks.append(self.embed(token_lists))
+        self._set_rows(
+            np.vstack(blocks),
+            [self.doc_ids[i] for i in keep] + list(doc_ids),
+            [self.filenames[i] for i in keep] + list(filenames),
+            [self.spans[i] for i in keep] + list(spans) if self.spans is not None and spans is not None else None,
+        )
+        self.version = version
+        self.save()
+
+    def save_model(self):
+        """Save the fitted part of the model, which only a refit changes."""
+        os.makedirs(self.lsa_dir, exist_ok=True)
+        np.save(os.path.join(self.lsa_dir, "components.npy"), self.components)
+        np.save(os.path.join(self.lsa_dir, "idf.npy"), self.idf)
+        if self.columns is not None:
+            np.save(os.path.join(self.lsa_dir, "columns.npy"), self.columns)
+        with open(os.path.join(self.lsa_dir, "terms.json"), "w", encoding="utf-8") as f:
+            json.dump(self.terms, f)
+
+    def save(self):
+        """Save the embeddings and rows; `save_model` must have been called once."""
+        os.makedirs(self.lsa_dir, exist_ok=True)
+        name = f"embeddings_{self.generation:06d}.npy"
+        np.save(os.path.join(self.lsa_dir, name), self.embeddings)
+        meta = {
+            "version": self.version,
+            "generation": self.generation,
+            "dimensions": self.dimensions,
+            "embeddings": name,
+            "preprocessing": self.preprocessing,
+            "hash_features": self.hash_features,
+            "doc_ids": self.doc_ids,
+            "filenames": self.filenames,
+            "spans": self.spans,
+        }
+        # The metadata file is swapped in last: it is what makes a change visible.
+        meta_path = os.path.join(self.lsa_dir, META_FILE)
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        for old in os.listdir(self.lsa_dir):
+            if old.startswith("embeddings_") and old != name:
+                try:
+                    os.remove(os.path.join(self.lsa_dir, old))
+                except PermissionError:
+                    # Still mapped by another process on Windows; removed on a later save.
+                    pass
+        self.generation += 1
+
+    def _set_rows(self, embeddings: np.ndarray, doc_ids: List[int], filenames: List[str],
+                  spans: List[List[int]] | None):
+        self.embeddings = embeddings
+        self.doc_ids = doc_ids
+        self.filenames = filenames
+        self.spans = spans
+        self._rows = {}
+        for i, d in enumerate(doc_ids):
+            self._rows.setdefault(d, []).append(i)
+
+
+@timed("fit_lsa")
+def fit_lsa_index(index: CorpusIndex, dimensions: int = DEFAULT_LSA_DIMENSIONS, lsa_dir: str = LSA_DIR,
+                  seed: int = 0) -> LsaIndex | None:
+    """Fit LSA embeddings on the TF-IDF rows of `index` and save them; None when the index is too small."""
+    remove_lsa_index(lsa_dir)
+    matrix, doc_ids, filenames, spans = index.weighted_matrix()
+    # Unused columns add nothing to the SVD; dropping them keeps the components small, above all when hashed.
+    used = np.flatnonzero(index.df > 0)
+    matrix = matrix[:, used]
+    svd = fit_svd(matrix, dimensions, seed)
+    if svd is None:
+        return None
+    if index.hash_features:
+        terms, columns = [], used.astype(np.int32)
+    else:
+        terms, columns = [index.terms[i] for i in used], None
+    lsa_index = LsaIndex(lsa_dir, index.preprocessing, index.hash_features, terms, columns,
+                         index.idf()[used].astype(np.float32), svd.components_.astype(np.float32))
+    lsa_index._set_rows(normalize_rows(svd.transform(matrix)), doc_ids, filenames, spans)
+    lsa_index.version = index.version
+    lsa_index.save_model()
+    lsa_index.save()
+    return lsa_index
+
+
+def read_lsa_meta(lsa_dir: str = LSA_DIR) -> dict | None:
+    try:
+        with open(os.path.join(lsa_dir, META_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def load_lsa_index(lsa_dir: str = LSA_DIR) -> LsaIndex | None:
+    meta = read_lsa_meta(lsa_dir)
+    if meta is None:
+        return None
+    with open(os.path.join(lsa_dir, "terms.json"), encoding="utf-8") as f:
+        terms = json.load(f)
+    columns_path = os.path.join(lsa_dir, "columns.npy")
+    lsa_index = LsaIndex(lsa_dir, meta["preprocessing"], meta["hash_features"], terms,
+                         np.load(columns_path) if os.path.exists(columns_path) else None,
+                         np.load(os.path.join(lsa_dir, "idf.npy")),
+                         np.load(os.path.join(lsa_dir, "components.npy")))
+    # Memory-mapped like the corpus index, so processes share one copy.
+    embeddings = np.load(os.path.join(lsa_dir, meta["embeddings"]), mmap_mode="r")
+    lsa_index._set_rows(embeddings, meta["doc_ids"], meta["filenames"], meta["spans"])
+    lsa_index.version = meta["version"]
+    lsa_index.generation = meta["generation"] + 1
+    return lsa_index
+
+
+def remove_lsa_index(lsa_dir: str = LSA_DIR):
+    if not os.path.isdir(lsa_dir):
+        return
+    for name in os.listdir(lsa_dir):
+        os.remove(os.path.join(lsa_dir, name))
@@ -0,0 +1,3 @@
+# Kept apart from lsa.py, which needs NumPy and SciPy, so main_cli.py can
+# use it for its argument defaults without importing them.
+DEFAULT_LSA_DIMENSIONS = 256
@@ -0,0 +1,168 @@
+import hashlib
+import sqlite3
+import zlib
+from typing import Iterable, List, Set
+
+import numpy as np
+
+DEFAULT_BANDS = 32
+DEFAULT_ROWS = 4
+SHINGLE_SIZE = 3
+SEED = 1
+
+# Hash permutations are (a * x + b) mod p over 32-bit shingle hashes, which
+# stays inside uint64 without overflowing.
+_PRIME = (1 << 31) - 1
+_BLOCK = 4096
+
+create_minhash_sql = '''
+CREATE TABLE IF NOT EXISTS minhash_config (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS minhash_signatures (
+    doc_id INTEGER PRIMARY KEY,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lsh_buckets (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lsh_buckets_lookup ON lsh_buckets (band, bucket);
+CREATE INDEX IF NOT EXISTS lsh_buckets_doc ON lsh_buckets (doc_id);
+CREATE TRIGGER IF NOT EXISTS documents_delete_minhash AFTER DELETE ON documents
+BEGIN
+    DELETE FROM minhash_signatures WHERE doc_id = OLD.id;
+    DELETE FROM lsh_buckets WHERE doc_id = OLD.id;
+END;
+'''
+
+
+def _permutations(num_perm: int):
+    rng = np.random.default_rng(SEED)
+    a = rng.integers(1, _PRIME, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, _PRIME, size=num_perm, dtype=np.uint64)
+    return a, b
+
+
+def shingle_hashes(tokens: List[str], shingle_size: int = SHINGLE_SIZE) -> np.ndarray:
+    """Return the distinct 32-bit hashes of the word `shingle_size`-grams in `tokens`."""
+    if not tokens:
+        return np.zeros(0, dtype=np.uint64)
+    token_hashes = {}
+    hashed = np.array(
+        [token_hashes.setdefault(t, zlib.crc32(t.encode("utf-8"))) for t in tokens],
+        dtype=np.uint64,
+    )
+    size = min(shingle_size, len(hashed))
+    n = len(hashed) - size + 1
+    shingles = np.zeros(n, dtype=np.uint64)
+    for offset in range(size):
+        shingles = (shingles * np.uint64(1000003) + hashed[offset:offset + n]) & np.uint64(0xFFFFFFFF)
+    return np.unique(shingles)
+
+
+def minhash_signature(tokens: List[str], num_perm: int, shingle_size: int = SHINGLE_SIZE) -> np.ndarray | None:
+    shingles = shingle_hashes(tokens, shingle_size)
+    if shingles.size == 0:
+        return None
+    a, b = _permutations(num_perm)
+    signature = np.full(num_perm, _PRIME, dtype=np.uint64)
+    # Work through the shingles in blocks so long documents don't need a num_perm x n matrix.
+    for start in range(0, shingles.size, _BLOCK):
+        block = shingles[start:start + _BLOCK]
+        hashed = (np.outer(a, block) + b[:, None]) % np.uint64(_PRIME)
+        np.minimum(signature, hashed.min(axis=1), out=signature)
+    return signature.astype(np.uint32)
+
+
+def band_keys(signature: np.ndarray, bands: int, rows: int) -> List[int]:
+    keys = []
+    for band in range(bands):
+        chunk = signature[band * rows:(band + 1) * rows].tobytes()
+        digest = hashlib.blake2b(chunk, digest_size=8).digest()
+        keys.append(int.from_bytes(digest, "little", signed=True))
+    return keys
+
+
+def get_minhash_config(db_path="corpus.db") -> dict | None:
+    """Return the stored bands/rows, or None when MinHash indexing is not enabled."""
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT key, value FROM minhash_config").fetchall()
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+    config = dict(rows)
+    if "bands" not in config or "rows" not in config:
+        return None
+    return config
+
+
+def reset_minhash_index(bands: int = DEFAULT_BANDS, rows: int = DEFAULT_ROWS, db_path="corpus.db"):
+    """Enable MinHash indexing with the given banding, dropping any existing signatures."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executescript(create_minhash_sql)
+        conn.execute("DELETE FROM minhash_signatures")
+        conn.execute("DELETE FROM lsh_buckets")
+        conn.executemany(
+            "INSERT OR REPLACE INTO minhash_config (key, value) VALUES (?, ?)",
+            [("bands", bands), ("rows", rows), ("shingle_size", SHINGLE_SIZE)]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def index_documents(doc_ids: List[int], token_lists: Iterable[List[str]], db_path="corpus.db"):
+    config = get_minhash_config(db_path)
+    if config is None:
+        return
+    bands, rows = config["bands"], config["rows"]
+    signature_rows = []
+    bucket_rows = []
+    for doc_id, tokens in zip(doc_ids, token_lists):
+        signature = minhash_signature(tokens, bands * rows, config.get("shingle_size", SHINGLE_SIZE))
+        if signature is None:
+            continue
+        signature_rows.append((doc_id, signature.tobytes()))
+        bucket_rows.extend((band, key, doc_id) for band, key in enumerate(band_keys(signature, bands, rows)))
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.executemany("DELETE FROM lsh_buckets WHERE doc_id = ?", ((doc_id,) for doc_id, _ in signature_rows))
+        conn.executemany(
+            "INSERT OR REPLACE INTO minhash_signatures (doc_id, signature) VALUES (?, ?)",
+            signature_rows
+        )
+        conn.executemany("INSERT INTO lsh_buckets (band, bucket, doc_id) VALUES (?, ?, ?)", bucket_rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def query_candidates(tokens: List[str], db_path="corpus.db") -> Set[int]:
+    """Return ids of documents sharing at least one LSH band with `tokens`."""
+    config = get_minhash_config(db_path)
+    if config is None:
+        return set()
+    bands, rows = config["bands"], config["rows"]
+    signature = minhash_signature(tokens, bands * rows, config.get("shingle_size", SHINGLE_SIZE))
+    if signature is None:
+        return set()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        candidates = set()
+        for band, key in enumerate(band_keys(signature, bands, rows)):
+            rows_found = conn.execute(
+                "SELECT doc_id FROM lsh_buckets WHERE band = ? AND bucket = ?",
+                (band, key)
+            ).fetchall()
+            candidates.update(r[0] for r in rows_found)
+        return candidates
+    finally:
+        conn.close()
@@ -0,0 +1,66 @@
+import functools
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Iterable, List
+
+from .preprocessing import DEFAULT_PREPROCESSING, prepare_preprocessing, preprocess_text
+from .profiling import count, span
+
+logger = logging.getLogger(__name__)
+
+# Worker count used when callers don't pass one; 0 or unset means one per CPU.
+WORKERS_ENV_VAR = "PLAGIARISM_WORKERS"
+
+# Below this many documents, starting a pool costs more than it saves.
+MIN_PARALLEL_DOCUMENTS = 64
+
+
+def resolve_workers(workers: int | None = None) -> int:
+    if workers is None:
+        try:
+            workers = int(os.environ.get(WORKERS_ENV_VAR, "0"))
+        except ValueError:
+            workers = 0
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def preprocess_documents(texts: Iterable[str], workers: int | None = None,
+                         chunk_size: int | None = None, mode: str = DEFAULT_PREPROCESSING) -> List[List[str]]:
+    """Run `preprocess_text` in the given mode over `texts` in a process pool, preserving order.
+
+    Falls back to the current process for small inputs, for `workers=1`, or
+    when a pool cannot be started.
+    """
+    texts = list(texts)
+    with span("preprocess"):
+        token_lists = _preprocess_documents(texts, workers, chunk_size, mode)
+    count("documents_preprocessed", len(texts))
+    count("tokens", sum(len(tokens) for tokens in token_lists))
+    return token_lists
+
+
+def _preprocess_documents(texts: List[str], workers: int | None, chunk_size: int | None,
+                          mode: str) -> List[List[str]]:
+    preprocess = functools.partial(preprocess_text, mode=mode)
+    workers = min(resolve_workers(workers), len(texts))
+    if workers <= 1 or len(texts) < MIN_PARALLEL_DOCUMENTS:
+        return [preprocess(t) for t in texts]
+
+    # Built here first, or every worker would build the same data at once.
+    prepare_preprocessing(mode)
+    if chunk_size is None:
+        # A few chunks per worker keeps the load balanced when document lengths vary.
+        chunk_size = max(1, len(texts) // (workers * 4))
+    try:
+        # Spawned workers don't inherit the web server's threads or locks.
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            return list(pool.map(preprocess, texts, chunksize=chunk_size))
+    except (OSError, BrokenProcessPool) as e:
+        logger.warning("Parallel preprocessing unavailable (%s); continuing in a single process.", e)
+        return [preprocess(t) for t in texts]
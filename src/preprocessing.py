@@ -1,24 +1,57 @@
+import json
+import logging
+import os
+import re
 import string
-from typing import List
-import nltk
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from nltk.tokenize import word_tokenize
-
-# Ensure required resources exist
-for resource in ("punkt", "stopwords", "wordnet"):
-    try:
-        nltk.data.find(resource)
-    except LookupError:
-        nltk.download(resource)
+from functools import lru_cache
+from typing import Dict, List
+
+from .profiling import timed
+
+logger = logging.getLogger(__name__)
+
+# Word frequencies are Zipfian, so a modest cache absorbs nearly every lookup.
+LEMMA_CACHE_SIZE = 50_000
+
+# "nltk" runs NLTK's Treebank tokenizer and WordNet lemmatizer; "fast" approximates
+# them with a compiled regex and a lemma table precomputed from WordNet. An index
+# records the mode it was built with, so its queries are preprocessed the same way.
+PREPROCESSING_MODES = ("nltk", "fast")
+DEFAULT_PREPROCESSING = "nltk"
+LEMMA_TABLE_PATH = os.path.join("cache", "lemma_table.json")
+
+# Words, keeping hyphenated and dotted compounds ("well-known", "U.S") and
+# contractions together, as the Treebank tokenizer does.
+_TOKEN_PATTERN = re.compile(r"\w+(?:[-'.]\w+)*")
+# WordNet's noun detachment rules (inflected suffix, base suffix), as applied by morphy.
+_NOUN_SUFFIXES = (("s", ""), ("ses", "s"), ("xes", "x"), ("zes", "z"), ("ches", "ch"), ("shes", "sh"),
+                  ("men", "man"), ("ies", "y"))
+
+
+# NLTK and its data are loaded on first use rather than at import, and never
+# downloaded implicitly: run download_nltk.py once to install the data.
+@lru_cache(maxsize=None)
+def get_stop_words() -> frozenset:
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words("english"))
+
+
+@lru_cache(maxsize=None)
+def get_lemmatizer():
+    from nltk.stem import WordNetLemmatizer
+    return WordNetLemmatizer()
+
+
+@lru_cache(maxsize=None)
+def get_word_tokenizer():
+    from nltk.tokenize import word_tokenize
+    return word_tokenize
 
-STOP_WORDS = set(stopwords.words("english"))
-LEMMATIZER = WordNetLemmatizer()
 
 def tokenize_text(text: str) -> List[str]:
     if not isinstance(text, str):
         return []
-    return word_tokenize(text)
+    return get_word_tokenizer()(text)
 
 
 def normalize_case(tokens: List[str]) -> List[str]:
@@ -30,14 +63,119 @@ def remove_punctuation(tokens: List[str]) -> List[str]:
 
 
 def filter_stopwords(tokens: List[str]) -> List[str]:
-    return [t for t in tokens if t not in STOP_WORDS]
+    stop_words = get_stop_words()
+    return [t for t in tokens if t not in stop_words]
+
+
+@lru_cache(maxsize=LEMMA_CACHE_SIZE)
+def lemmatize_token(token: str) -> str:
+    return get_lemmatizer().lemmatize(token)
 
 
 def lemmatize_tokens(tokens: List[str]) -> List[str]:
-    return [LEMMATIZER.lemmatize(t) for t in tokens]
+    return [lemmatize_token(t) for t in tokens]
+
+
+def fast_tokenize(text: str) -> List[str]:
+    """Split `text` into words like `word_tokenize`, keeping only the word before a contraction."""
+    if not isinstance(text, str):
+        return []
+    tokens = []
+    for token in _TOKEN_PATTERN.findall(text):
+        apostrophe = token.find("'")
+        if apostrophe > 0:
+            # The Treebank tokenizer splits "don't" into "do" + "n't" and "it's" into "it" + "'s".
+            if token[apostrophe - 1:apostrophe + 2].lower() == "n't":
+                apostrophe -= 1
+            token = token[:apostrophe]
+        tokens.append(token)
+    return tokens
+
+
+def _noun_exceptions(wordnet) -> List[str]:
+    """The irregular noun forms listed in WordNet's noun.exc, e.g. "geese"; none if it can't be read."""
+    try:
+        with wordnet.open("noun.exc") as f:
+            return [line.split()[0] for line in f.read().splitlines() if line.strip()]
+    except (OSError, LookupError) as e:
+        logger.warning("Could not read WordNet's irregular noun forms (%s); the lemma table leaves them out.", e)
+        return []
+
+
+def build_lemma_table() -> Dict[str, str]:
+    """Map every noun form WordNet's lemmatizer would change to the lemma it returns.
+
+    The candidates are WordNet's noun lemmas, each lemma inflected by
+    reversing morphy's detachment rules, and WordNet's irregular forms;
+    the lemmatizer itself decides each entry, so lookups agree with it.
+    """
+    from nltk.corpus import wordnet
+
+    candidates = set()
+    for name in wordnet.all_lemma_names(pos=wordnet.NOUN):
+        if not name.isalpha():
+            continue
+        candidates.add(name)
+        for inflected, base in _NOUN_SUFFIXES:
+            if name.endswith(base):
+                candidates.add(name[:len(name) - len(base)] + inflected)
+    candidates.update(form for form in _noun_exceptions(wordnet) if form.isalpha())
+
+    lemmatizer = get_lemmatizer()
+    table = {}
+    for form in candidates:
+        lemma = lemmatizer.lemmatize(form)
+        if lemma != form:
+            table[form] = lemma
+    return table
+
+
+def prepare_preprocessing(mode: str = DEFAULT_PREPROCESSING):
+    """Build the data `mode` loads on first use, so worker processes started afterwards only read it."""
+    if mode == "fast":
+        get_lemma_table()
+
+
+@lru_cache(maxsize=None)
+def get_lemma_table() -> Dict[str, str]:
+    """Load the lemma table, building and saving it from WordNet on first use."""
+    import nltk
+
+    try:
+        with open(LEMMA_TABLE_PATH, encoding="utf-8") as f:
+            saved = json.load(f)
+        if saved.get("nltk") == nltk.__version__:
+            return saved["table"]
+    except (OSError, ValueError, KeyError):
+        pass
+    table = build_lemma_table()
+    os.makedirs(os.path.dirname(LEMMA_TABLE_PATH), exist_ok=True)
+    tmp_path = f"{LEMMA_TABLE_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"nltk": nltk.__version__, "table": table}, f)
+    os.replace(tmp_path, LEMMA_TABLE_PATH)
+    return table
+
+
+def fast_preprocess_text(text: str) -> List[str]:
+    stop_words = get_stop_words()
+    lemmas = get_lemma_table()
+    tokens = []
+    for token in fast_tokenize(text):
+        if not token.isalpha():
+            continue
+        token = token.lower()
+        if token not in stop_words:
+            tokens.append(lemmas.get(token, token))
+    return tokens
 
 
-def preprocess_text(text: str) -> List[str]:
+@timed("preprocess_text")
+def preprocess_text(text: str, mode: str = DEFAULT_PREPROCESSING) -> List[str]:
+    if mode == "fast":
+        return fast_preprocess_text(text)
+    if mode != "nltk":
+        raise ValueError(f"Unknown preprocessing mode: {mode}")
     tokens = tokenize_text(text)
     tokens = normalize_case(tokens)
     tokens = remove_punctuation(tokens)
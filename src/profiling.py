@@ -0,0 +1,99 @@
+import contextvars
+import functools
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List
+
+_PROFILE = contextvars.ContextVar("profile", default=None)
+# Names of the enclosing spans, so nested stages are reported as "outer/inner".
+_SPAN_PATH = contextvars.ContextVar("span_path", default=())
+
+
+class Profile:
+    """Wall time per named span and totals per counter, collected while `profiling()` is active."""
+
+    def __init__(self):
+        self.spans: Dict[str, List[float]] = {}
+        self.counters: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def enter_span(self, name: str):
+        with self._lock:
+            self.spans.setdefault(name, [0, 0.0])
+
+    def add_span(self, name: str, seconds: float):
+        with self._lock:
+            calls_and_seconds = self.spans.setdefault(name, [0, 0.0])
+            calls_and_seconds[0] += 1
+            calls_and_seconds[1] += seconds
+
+    def count(self, name: str, n: int = 1):
+        with self._lock:
+            self.counters[name] += n
+
+    def rows(self) -> List[Dict]:
+        """One row per span, in the order the spans were first entered."""
+        return [
+            {"stage": name, "calls": calls, "seconds": round(seconds, 4),
+             "mean_ms": round(seconds / calls * 1000, 3) if calls else 0.0}
+            for name, (calls, seconds) in self.spans.items()
+        ]
+
+    def format(self) -> str:
+        width = max((len(name) for name in self.spans), default=5)
+        lines = [f"{'stage':<{width}}  {'calls':>6}  {'seconds':>9}  {'mean ms':>9}"]
+        for row in self.rows():
+            lines.append(f"{row['stage']:<{width}}  {row['calls']:>6}  {row['seconds']:>9.4f}  {row['mean_ms']:>9.3f}")
+        for name, total in self.counters.items():
+            lines.append(f"{name}: {total}")
+        return "\n".join(lines)
+
+
+@contextmanager
+def profiling():
+    """Collect spans and counters from the code run inside the block into a fresh `Profile`."""
+    profile = Profile()
+    token = _PROFILE.set(profile)
+    path_token = _SPAN_PATH.set(())
+    try:
+        yield profile
+    finally:
+        _SPAN_PATH.reset(path_token)
+        _PROFILE.reset(token)
+
+
+@contextmanager
+def span(name: str):
+    """Time the enclosed block as stage `name`; free when no profile is being collected."""
+    profile = _PROFILE.get()
+    if profile is None:
+        yield
+        return
+    path = _SPAN_PATH.get() + (name,)
+    profile.enter_span("/".join(path))
+    token = _SPAN_PATH.set(path)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span("/".join(path), time.perf_counter() - start)
+        _SPAN_PATH.reset(token)
+
+
+def timed(name: str):
+    """Decorator form of `span`."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name: str, n: int = 1):
+    profile = _PROFILE.get()
+    if profile is not None:
+        profile.count(name, n)
@@ -0,0 +1,77 @@
+import json
+import threading
+from collections import OrderedDict
+from typing import Callable, Hashable
+
+from .profiling import count
+
+# Bounds on the results kept per process; whichever is reached first evicts the least recently used.
+RESULT_CACHE_ENTRIES = 1024
+RESULT_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class ResultCache:
+    """A thread-safe LRU cache of JSON-serialisable results, bounded by entry count and size.
+
+    Keys should include everything a result depends on, in particular the
+    corpus version: entries for older versions are never hit again and
+    age out. Cached values are shared, so callers must not modify them.
+    """
+
+    def __init__(self, max_entries: int = RESULT_CACHE_ENTRIES, max_bytes: int = RESULT_CACHE_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value):
+        # The JSON length stands in for the memory a result holds.
+        size = len(json.dumps(value))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def get_or_compute(self, key: Hashable, compute: Callable):
+        """Return the cached result for `key`, computing and caching it on a miss."""
+        value = self.get(key)
+        if value is not None:
+            count("result_cache_hits")
+            return value
+        count("result_cache_misses")
+        value = compute()
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+RESULT_CACHE = ResultCache()
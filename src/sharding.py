@@ -0,0 +1,180 @@
+import heapq
+import json
+import multiprocessing
+import os
+import threading
+import weakref
+from typing import Iterable, List, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags
+
+from .corpus_index import MODELS_DIR, hash_counts, load_corpus_index, normalize
+from .parallel import resolve_workers
+from .preprocessing import preprocess_text
+from .profiling import timed
+
+SHARDS_DIR = os.path.join(MODELS_DIR, "shards")
+LAYOUT_FILE = "shards.json"
+DEFAULT_SHARD_SIZE = 50_000
+
+
+def shard_dir(shard_no: int, shards_dir: str = SHARDS_DIR) -> str:
+    return os.path.join(shards_dir, f"shard_{shard_no:04d}")
+
+
+def shard_range(shard_no: int, shard_size: int) -> Tuple[int, int]:
+    """The document ids [start, stop) held by shard `shard_no`."""
+    return shard_no * shard_size, (shard_no + 1) * shard_size
+
+
+def read_layout(shards_dir: str = SHARDS_DIR) -> dict | None:
+    """Return the sharded index's layout: shard size, shard numbers, index settings and corpus version."""
+    try:
+        with open(os.path.join(shards_dir, LAYOUT_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_layout(layout: dict, shards_dir: str = SHARDS_DIR):
+    os.makedirs(shards_dir, exist_ok=True)
+    path = os.path.join(shards_dir, LAYOUT_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(layout, f)
+    os.replace(path + ".tmp", path)
+
+
+def remove_layout(shards_dir: str = SHARDS_DIR):
+    path = os.path.join(shards_dir, LAYOUT_FILE)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def serve_shards(conn, shard_dirs: List[str], n_features: int):
+    """Answer coordinator messages about the shards in `shard_dirs` until told to stop.
+
+    Messages are tuples: ("stats",) returns (rows, document frequencies,
+    filenames); ("idf", idf) sets the corpus-wide IDF; ("query", vector,
+    top_k, candidate_ids) returns the best (doc_id, filename, score) rows.
+    Only plain data crosses the connection, so a shard server on another
+    machine could answer the same messages.
+    """
+    indexes = [index for index in map(load_corpus_index, shard_dirs) if index is not None]
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        kind = message[0]
+        try:
+            if kind == "stats":
+                df = sum((index.df for index in indexes), np.zeros(n_features, dtype=np.int64))
+                reply = (sum(len(index) for index in indexes), df,
+                         [filename for index in indexes for filename in index.filenames])
+            elif kind == "idf":
+                for index in indexes:
+                    index.use_idf(message[1])
+                    index.weighted_matrix()
+                reply = None
+            elif kind == "query":
+                _, vector, top_k, candidate_ids = message
+                rows = (row for index in indexes for row in index.top_rows(vector, top_k, candidate_ids))
+                reply = heapq.nlargest(top_k, rows, key=lambda row: row[2])
+            elif kind == "stop":
+                conn.send(("ok", None))
+                return
+            else:
+                raise ValueError(f"Unknown message: {kind}")
+        except Exception as e:
+            conn.send(("error", repr(e)))
+        else:
+            conn.send(("ok", reply))
+
+
+def _stop_workers(workers):
+    for conn, process in workers:
+        try:
+            conn.send(("stop",))
+            conn.recv()
+        except (OSError, EOFError):
+            pass
+        conn.close()
+        process.join(timeout=5)
+
+
+class ShardedIndex:
+    """Search the shards of a sharded corpus index in worker processes and merge their top-k.
+
+    Shards are hashed indexes (see `CorpusIndex`) over document id ranges,
+    so they share one column space: their document frequencies add up to
+    the corpus-wide ones, and every worker weights its rows with the same
+    corpus-wide IDF. Scores are therefore those of one unsharded index.
+    Each worker process loads some of the shards; a query is sent to all
+    workers at once and their top-k lists are merged.
+    """
+
+    def __init__(self, shards_dir: str = SHARDS_DIR, workers: int | None = None):
+        layout = read_layout(shards_dir)
+        self.version = layout["version"]
+        self.preprocessing = layout["preprocessing"]
+        self.hash_features = layout["hash_features"]
+        self._lock = threading.Lock()
+        self._workers = []
+        dirs = [shard_dir(n, shards_dir) for n in layout["shards"]]
+        n_workers = max(1, min(resolve_workers(workers), len(dirs)))
+        context = multiprocessing.get_context("spawn")
+        for i in range(n_workers):
+            conn, child_conn = context.Pipe()
+            process = context.Process(target=serve_shards, args=(child_conn, dirs[i::n_workers], self.hash_features),
+                                      name=f"shard-worker-{i}", daemon=True)
+            process.start()
+            child_conn.close()
+            self._workers.append((conn, process))
+        # Worker processes stop when the index is closed or garbage collected.
+        self._finalizer = weakref.finalize(self, _stop_workers, list(self._workers))
+
+        stats = self._broadcast(("stats",))
+        self._rows = sum(rows for rows, _, _ in stats)
+        df = sum(df for _, df, _ in stats)
+        self._filenames = [filename for _, _, filenames in stats for filename in filenames]
+        self._idf = np.log((1 + self._rows) / (1 + df)) + 1
+        self._broadcast(("idf", self._idf))
+
+    def __len__(self):
+        return self._rows
+
+    @property
+    def filenames(self) -> List[str]:
+        return self._filenames
+
+    def close(self):
+        self._finalizer()
+
+    def _broadcast(self, message: tuple) -> list:
+        # Send to every worker before waiting on any, so the shards are searched in parallel.
+        with self._lock:
+            for conn, _ in self._workers:
+                conn.send(message)
+            replies = [conn.recv() for conn, _ in self._workers]
+        for status, reply in replies:
+            if status == "error":
+                raise RuntimeError(f"Shard worker failed: {reply}")
+        return [reply for _, reply in replies]
+
+    def vectorize(self, token_lists: List[List[str]]) -> csr_matrix:
+        return normalize(hash_counts(token_lists, self.hash_features) @ diags(self._idf))
+
+    def query(self, text: str, top_k: int = 5, candidate_ids: Iterable[int] | None = None) -> List[Tuple[str, float]]:
+        return self.query_tokens(preprocess_text(text, self.preprocessing), top_k, candidate_ids)
+
+    @timed("sharded_query")
+    def query_tokens(self, tokens: List[str], top_k: int = 5,
+                     candidate_ids: Iterable[int] | None = None) -> List[Tuple[str, float]]:
+        if self._rows == 0:
+            return []
+        if candidate_ids is not None:
+            candidate_ids = list(candidate_ids)
+        replies = self._broadcast(("query", self.vectorize([tokens]), top_k, candidate_ids))
+        best = heapq.nlargest(top_k, (row for reply in replies for row in reply), key=lambda row: row[2])
+        return [(filename, score) for _, filename, score in best]
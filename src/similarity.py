@@ -1,9 +1,59 @@
-from sklearn.metrics.pairwise import cosine_similarity
-from scipy.sparse import spmatrix
+from scipy.sparse import csr_matrix, spmatrix, vstack
 import numpy as np
 
+from .profiling import count, timed
+
+@timed("similarity")
 def calculate_similarity(vector1: spmatrix, vector2: spmatrix) -> float:
+    from sklearn.metrics.pairwise import cosine_similarity
     similarity_matrix = cosine_similarity(vector1, vector2)
     similarity_score = similarity_matrix[0, 0]
     percentage_score = round(similarity_score * 100, 2)
-    return percentage_score
\ No newline at end of file
+    return percentage_score
+
+@timed("similarity")
+def sparse_similarity(query_vectors: spmatrix, index_vectors: spmatrix, threshold: float = 0.0,
+                      top_k: int | None = None, block_size: int = 256) -> csr_matrix:
+    """Cosine similarity of every query row against every index row, kept sparse.
+
+    Both matrices must be L2-normalised so that their dot product is the
+    cosine similarity. Query rows are processed in blocks of `block_size`,
+    and within each block only scores of at least `threshold` (and, with
+    `top_k`, only the best `top_k` per query row) are kept. Memory is thus
+    bounded by one block rather than by the full dense similarity matrix.
+    """
+    count("similarity_rows", query_vectors.shape[0])
+    # Transposed to CSR once: a CSC operand would be converted back to CSR for every block.
+    index_t = index_vectors.T.tocsr()
+    blocks = []
+    for start in range(0, query_vectors.shape[0], block_size):
+        block = (query_vectors[start:start + block_size] @ index_t).tocsr()
+        block.data[block.data < threshold] = 0
+        block.eliminate_zeros()
+        if top_k is not None:
+            for i in range(block.shape[0]):
+                lo, hi = block.indptr[i], block.indptr[i + 1]
+                if hi - lo > top_k:
+                    row = block.data[lo:hi]
+                    row[np.argpartition(-row, top_k - 1)[top_k:]] = 0
+            block.eliminate_zeros()
+        blocks.append(block)
+    if not blocks:
+        return csr_matrix((query_vectors.shape[0], index_vectors.shape[0]))
+    return vstack(blocks).tocsr()
+
+
+def top_k_per_row(query_vectors: spmatrix, index_vectors: spmatrix, top_k: int = 1,
+                  threshold: float = 0.0, block_size: int = 256):
+    """Return, for each query row, its `top_k` most similar index rows scoring at least `threshold`.
+
+    Returns one list of (index row, score) pairs per query row, best first.
+    """
+    matrix = sparse_similarity(query_vectors, index_vectors, threshold, top_k, block_size)
+    results = []
+    for i in range(matrix.shape[0]):
+        scores = matrix.data[matrix.indptr[i]:matrix.indptr[i + 1]]
+        cols = matrix.indices[matrix.indptr[i]:matrix.indptr[i + 1]]
+        order = np.argsort(-scores, kind="stable")
+        results.append([(int(cols[j]), float(scores[j])) for j in order])
+    return results
@@ -0,0 +1,203 @@
+import hashlib
+import os
+import queue
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Iterable, List, Tuple
+
+# Connections kept open per database; Streamlit serves each session on its own thread.
+POOL_SIZE = 4
+BUSY_TIMEOUT_MS = 30_000
+
+# Document bodies are stored zlib-compressed.
+COMPRESSION_LEVEL = 6
+MIGRATION_BATCH_SIZE = 500
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+class ConnectionPool:
+    """A fixed-size pool of SQLite connections to one database, in WAL mode.
+
+    WAL lets the app keep reading while an ingest is writing. Connections
+    are created lazily and may be used from any thread, one at a time.
+    """
+
+    def __init__(self, db_path: str, size: int = POOL_SIZE):
+        self.db_path = db_path
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                if conn.in_transaction:
+                    conn.rollback()
+            self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+
+def get_pool(db_path="corpus.db") -> ConnectionPool:
+    key = os.path.abspath(db_path)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = _POOLS[key] = ConnectionPool(db_path)
+        return pool
+
+
+@contextmanager
+def connection(db_path="corpus.db"):
+    with get_pool(db_path).connection() as conn:
+        yield conn
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8", errors="surrogatepass")).hexdigest()
+
+
+def encode_text(text: str) -> bytes:
+    return zlib.compress(text.encode("utf-8", errors="surrogatepass"), COMPRESSION_LEVEL)
+
+
+def decode_text(value: str | bytes) -> str:
+    """Return a stored `text_content` value as text; rows from before compression are plain text."""
+    if isinstance(value, str):
+        return value
+    return zlib.decompress(value).decode("utf-8", errors="surrogatepass")
+
+
+def migrate_documents(db_path="corpus.db"):
+    """Add the content hash column and index, and compress any uncompressed bodies."""
+    with connection(db_path) as conn:
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+        with conn:
+            if "content_hash" not in columns:
+                conn.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS documents_content_hash ON documents (content_hash)")
+        migrated = 0
+        while True:
+            rows = conn.execute(
+                "SELECT id, text_content FROM documents "
+                "WHERE content_hash IS NULL OR typeof(text_content) = 'text' LIMIT ?",
+                (MIGRATION_BATCH_SIZE,)
+            ).fetchall()
+            if not rows:
+                break
+            texts = [(doc_id, decode_text(value)) for doc_id, value in rows]
+            with conn:
+                conn.executemany(
+                    "UPDATE documents SET text_content = ?, content_hash = ? WHERE id = ?",
+                    ((encode_text(text), content_hash(text), doc_id) for doc_id, text in texts)
+                )
+            migrated += len(rows)
+        if migrated:
+            print(f"Compressed and hashed {migrated} stored document(s).")
+
+
+def list_documents(db_path="corpus.db") -> List[Tuple[int, str, str]]:
+    """Return (id, filename, upload_date) for every document, without loading any text."""
+    with connection(db_path) as conn:
+        return conn.execute("SELECT id, filename, upload_date FROM documents ORDER BY id").fetchall()
+
+
+def fetch_all_documents(db_path="corpus.db") -> List[Tuple[str, str]]:
+    with connection(db_path) as conn:
+        rows = conn.execute("SELECT filename, text_content FROM documents").fetchall()
+    return [(filename, decode_text(value)) for filename, value in rows]
+
+
+def fetch_document(filename: str, db_path="corpus.db"):
+    with connection(db_path) as conn:
+        row = conn.execute(
+            "SELECT id, filename, upload_date FROM documents WHERE filename = ?",
+            (filename,)
+        ).fetchone()
+        if row is None:
+            return None
+        doc_id, filename, upload_date = row
+        text = conn.execute("SELECT text_content FROM documents WHERE id = ?", (doc_id,)).fetchone()[0]
+        return filename, decode_text(text), upload_date
+
+
+def _free_filename(conn: sqlite3.Connection, filename: str, taken: set) -> str:
+    stem, extension = os.path.splitext(filename)
+    candidate, n = filename, 1
+    while candidate in taken or conn.execute(
+            "SELECT 1 FROM documents WHERE filename = ?", (candidate,)).fetchone():
+        n += 1
+        candidate = f"{stem} ({n}){extension}"
+    return candidate
+
+
+def insert_documents(documents: Iterable[Tuple[str, str]], db_path="corpus.db") -> List[Tuple[str | None, str | None]]:
+    """Insert (filename, text) pairs in a single transaction.
+
+    Text already in the corpus is not stored again, and a new text whose
+    filename is taken is stored under "name (2).ext" and so on. Returns,
+    for each pair, (stored filename, None) or (None, filename of the
+    existing copy).
+    """
+    results = []
+    rows = []
+    with connection(db_path) as conn:
+        with conn:
+            # Take the write lock before checking, so concurrent uploads can't race.
+            conn.execute("BEGIN IMMEDIATE")
+            hashes_in_batch = {}
+            taken = set()
+            for filename, text in documents:
+                digest = content_hash(text)
+                existing = hashes_in_batch.get(digest)
+                if existing is None:
+                    row = conn.execute(
+                        "SELECT filename FROM documents WHERE content_hash = ? LIMIT 1", (digest,)
+                    ).fetchone()
+                    existing = row[0] if row else None
+                if existing is not None:
+                    results.append((None, existing))
+                    continue
+                stored_name = _free_filename(conn, filename, taken)
+                taken.add(stored_name)
+                hashes_in_batch[digest] = stored_name
+                rows.append((stored_name, encode_text(text), digest))
+                results.append((stored_name, None))
+            conn.executemany(
+                "INSERT INTO documents (filename, text_content, content_hash) VALUES (?, ?, ?)",
+                rows
+            )
+    return results
+
+
+def delete_documents(filenames: Iterable[str], db_path="corpus.db"):
+    with connection(db_path) as conn:
+        with conn:
+            conn.executemany("DELETE FROM documents WHERE filename = ?", ((f,) for f in filenames))
+
+
+def read_corpus_version(db_path="corpus.db") -> int | None:
+    with connection(db_path) as conn:
+        row = conn.execute("SELECT value FROM corpus_meta WHERE key = 'version'").fetchone()
+        return row[0] if row else None
@@ -0,0 +1,106 @@
+import sqlite3
+import threading
+from typing import List
+
+from .parallel import preprocess_documents
+from .preprocessing import DEFAULT_PREPROCESSING, lemmatize_token
+from .storage import content_hash
+
+create_token_cache_sql = '''
+CREATE TABLE IF NOT EXISTS token_cache (
+    content_hash TEXT PRIMARY KEY,
+    tokens TEXT NOT NULL
+);
+'''
+
+_STATS = {"hits": 0, "misses": 0}
+_STATS_LOCK = threading.Lock()
+
+
+def token_cache_key(text: str, mode: str = DEFAULT_PREPROCESSING) -> str:
+    """Cache key for `text` preprocessed in `mode`; NLTK tokens keep the plain content hash."""
+    digest = content_hash(text)
+    return digest if mode == "nltk" else f"{mode}:{digest}"
+
+
+def tokenize_documents(texts: List[str], db_path="corpus.db", workers: int | None = None,
+                       mode: str = DEFAULT_PREPROCESSING) -> List[List[str]]:
+    """Preprocess `texts`, reusing tokens cached in the database by content hash and mode.
+
+    Only documents whose text has never been seen are tokenized; their tokens
+    are stored so later rebuilds and updates skip them.
+    """
+    hashes = [token_cache_key(t, mode) for t in texts]
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(create_token_cache_sql)
+        cached = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique_hashes), 500):
+            batch = unique_hashes[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT content_hash, tokens FROM token_cache WHERE content_hash IN ({placeholders})",
+                batch
+            ).fetchall()
+            cached.update((h, tokens.split()) for h, tokens in rows)
+
+        missing = {h: t for h, t in zip(hashes, texts) if h not in cached}
+        new_tokens = dict(zip(missing, preprocess_documents(missing.values(), workers, mode=mode)))
+        if new_tokens:
+            conn.executemany(
+                "INSERT OR REPLACE INTO token_cache (content_hash, tokens) VALUES (?, ?)",
+                ((h, " ".join(tokens)) for h, tokens in new_tokens.items())
+            )
+            conn.commit()
+        cached.update(new_tokens)
+    finally:
+        conn.close()
+
+    with _STATS_LOCK:
+        _STATS["misses"] += len(new_tokens)
+        _STATS["hits"] += len(texts) - len(new_tokens)
+    return [cached[h] for h in hashes]
+
+
+def prune_token_cache(keep_hashes, db_path="corpus.db"):
+    """Drop cached tokens whose key (see `token_cache_key`) is not in `keep_hashes`."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(create_token_cache_sql)
+        conn.execute("CREATE TEMP TABLE keep_hashes (content_hash TEXT PRIMARY KEY)")
+        conn.executemany("INSERT OR IGNORE INTO keep_hashes VALUES (?)", ((h,) for h in keep_hashes))
+        conn.execute("DELETE FROM token_cache WHERE content_hash NOT IN (SELECT content_hash FROM keep_hashes)")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def prune_token_cache_to_corpus(mode: str = DEFAULT_PREPROCESSING, db_path="corpus.db"):
+    """Like `prune_token_cache`, keeping the keys of the documents stored in the database, in `mode`.
+
+    Uses the stored content hashes, so no document text is read.
+    """
+    prefix = "" if mode == "nltk" else f"{mode}:"
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute(create_token_cache_sql)
+        conn.execute(
+            "DELETE FROM token_cache WHERE content_hash NOT IN "
+            "(SELECT ? || content_hash FROM documents WHERE content_hash IS NOT NULL)",
+            (prefix,)
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def token_cache_stats() -> dict:
+    lemma_info = lemmatize_token.cache_info()
+    with _STATS_LOCK:
+        stats = dict(_STATS)
+    stats["lemma_hits"] = lemma_info.hits
+    stats["lemma_misses"] = lemma_info.misses
+    stats["lemma_cache_size"] = lemma_info.currsize
+    stats["lemma_cache_maxsize"] = lemma_info.maxsize
+    return stats
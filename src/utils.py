@@ -1,11 +1,26 @@
+import hashlib
+import logging
+import multiprocessing
 import os
 import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
-import docx
-from PyPDF2 import PdfReader
 from io import BytesIO
 
-from nltk.corpus.reader import documents
+from . import storage
+from .parallel import resolve_workers
+from .profiling import count, timed
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".txt", ".docx", ".pdf")
+
+EXTRACTION_CACHE_DIR = os.path.join("cache", "extraction")
+# Bump when extraction output changes, so stale cached text is ignored.
+EXTRACTION_CACHE_VERSION = 1
+# Pages per parallel PDF task; PDFs shorter than two tasks are extracted serially.
+PDF_PAGES_PER_TASK = 16
 
 
 def read_txt_file(file_bytes: bytes) -> str | None:
@@ -17,6 +32,7 @@ def read_txt_file(file_bytes: bytes) -> str | None:
 
 def read_docx_file(file_stream) -> str | None:
     try:
+        import docx
         document = docx.Document(file_stream)
         return "\n".join(p.text.strip() for p in document.paragraphs)
     except Exception as e:
@@ -25,14 +41,42 @@ def read_docx_file(file_stream) -> str | None:
 
 
 
-def read_pdf_file(file_stream) -> str | None:
+def _extract_pdf_pages(pdf_bytes: bytes, start: int, stop: int) -> list[str]:
+    from PyPDF2 import PdfReader
+    reader = PdfReader(BytesIO(pdf_bytes))
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def read_pdf_file(file_stream, workers: int | None = 1) -> str | None:
+    """Extract the text of a PDF.
+
+    With more than one worker, long PDFs are split into page ranges that
+    are extracted in parallel processes.
+    """
     try:
+        from PyPDF2 import PdfReader
         reader = PdfReader(file_stream)
 
         if reader.is_encrypted:
             print("Error: PDF is encrypted.")
             return None
 
+        n_pages = len(reader.pages)
+        count("pdf_pages", n_pages)
+        workers = min(resolve_workers(workers), n_pages // PDF_PAGES_PER_TASK)
+        if workers > 1:
+            try:
+                file_stream.seek(0)
+                pdf_bytes = file_stream.read()
+                ranges = [(start, min(start + PDF_PAGES_PER_TASK, n_pages))
+                          for start in range(0, n_pages, PDF_PAGES_PER_TASK)]
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                    futures = [pool.submit(_extract_pdf_pages, pdf_bytes, start, stop) for start, stop in ranges]
+                    return "".join(text for future in futures for text in future.result())
+            except (OSError, BrokenProcessPool) as e:
+                logger.warning("Parallel PDF extraction unavailable (%s); continuing in a single process.", e)
+
         text = []
         for page in reader.pages:
             page_text = page.extract_text()
@@ -46,77 +90,144 @@ def read_pdf_file(file_stream) -> str | None:
         return None
 
 
+def extract_text_from_bytes(file_bytes: bytes, extension: str, workers: int | None = 1) -> str | None:
+    if extension == ".txt":
+        return read_txt_file(file_bytes)
+    elif extension == ".docx":
+        return read_docx_file(BytesIO(file_bytes))
+    elif extension == ".pdf":
+        return read_pdf_file(BytesIO(file_bytes), workers)
+    else:
+        raise ValueError(f"Unsupported file type: {extension}")
+
+
+def _extraction_cache_path(file_bytes: bytes, extension: str) -> str:
+    digest = hashlib.sha256(file_bytes).hexdigest()
+    return os.path.join(EXTRACTION_CACHE_DIR, digest[:2], f"{digest}{extension}.v{EXTRACTION_CACHE_VERSION}.txt")
 
 
+def _read_extraction_cache(path: str) -> str | None:
+    try:
+        with open(path, encoding="utf-8", errors="surrogatepass") as f:
+            return f.read()
+    except OSError:
+        return None
 
 
+def _write_extraction_cache(path: str, text: str):
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8", errors="surrogatepass") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning("Could not write extraction cache: %s", e)
+
+
+@timed("extract")
+def extract_text(file_bytes: bytes, extension: str, workers: int | None = None) -> str | None:
+    """Extract text from a file's bytes, reusing the on-disk cache keyed by content hash."""
+    extension = extension.lower()
+    cache_path = _extraction_cache_path(file_bytes, extension)
+    cached = _read_extraction_cache(cache_path)
+    if cached is not None:
+        return cached
+    text = extract_text_from_bytes(file_bytes, extension, workers)
+    count("documents_extracted")
+    if text is not None:
+        _write_extraction_cache(cache_path, text)
+    return text
+
+
+@timed("extract")
+def extract_texts(files: list[tuple[str, bytes]], workers: int | None = None) -> list[str | None]:
+    """Extract text from several (filename, bytes) pairs at once, preserving order.
+
+    Cached files are served from the extraction cache; the rest are
+    extracted in a process pool, one file per task.
+    """
+    results = [None] * len(files)
+    misses = []
+    for i, (name, file_bytes) in enumerate(files):
+        extension = os.path.splitext(name.lower())[1]
+        cache_path = _extraction_cache_path(file_bytes, extension)
+        cached = _read_extraction_cache(cache_path)
+        if cached is not None:
+            results[i] = cached
+        else:
+            misses.append((i, extension, cache_path))
+
+    workers = min(resolve_workers(workers), len(misses))
+    extracted = None
+    if workers > 1:
+        try:
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                extracted = list(pool.map(
+                    extract_text_from_bytes,
+                    [files[i][1] for i, _, _ in misses],
+                    [extension for _, extension, _ in misses],
+                ))
+        except (OSError, BrokenProcessPool) as e:
+            logger.warning("Parallel extraction unavailable (%s); continuing in a single process.", e)
+    if extracted is None:
+        # A lone file can still use page-parallel PDF extraction.
+        extracted = [extract_text_from_bytes(files[i][1], extension, None if len(misses) == 1 else 1)
+                     for i, extension, _ in misses]
+
+    count("documents_extracted", len(misses))
+    for (i, _, cache_path), text in zip(misses, extracted):
+        results[i] = text
+        if text is not None:
+            _write_extraction_cache(cache_path, text)
+    return results
 
 
 def read_uploaded_file(uploaded_file):
     _, extension = os.path.splitext(uploaded_file.name.lower())
-    file_bytes = uploaded_file.getvalue()
-    file_stream = BytesIO(file_bytes)
+    return extract_text(uploaded_file.getvalue(), extension)
 
-    if extension == ".txt":
-        return read_txt_file(file_bytes)
-    elif extension == ".docx":
-        return read_docx_file(file_stream)
-    elif extension == ".pdf":
-        return read_pdf_file(file_stream)
-    else:
-        raise ValueError(f"Unsupported file type: {extension}")
-conn=None
-def get_all_documents_from_db(db_path="corpus.db"):
+
+def read_uploaded_files(uploaded_files, workers: int | None = None) -> list[str | None]:
+    return extract_texts([(f.name, f.getvalue()) for f in uploaded_files], workers)
+def list_documents_in_db(db_path="corpus.db"):
+    """Return (id, filename, upload_date) rows for the corpus, without document bodies."""
     if not os.path.exists(db_path):
-        print(f"Database file not fount at {db_path}")
         return []
     try:
-        conn=sqlite3.connect(db_path)
-        cursor=conn.cursor()
-        select_query = "SELECT filename, text_content FROM documents"
-        cursor.execute(select_query)
-        documents=cursor.fetchall()
-        return documents
+        return storage.list_documents(db_path)
     except sqlite3.Error as e:
         print(f"Database error: {e}")
-        return []  # Return an empty list on error
-
-    finally:
-        if conn:
-            conn.close()
+        return []
 
 
 def insert_document_into_db(filename: str, text: str,db_path="corpus.db"):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    try:
-        cursor.execute(
-            "INSERT OR IGNORE INTO documents (filename, text_content) VALUES (?, ?)",
-            (filename, text)
-        )
-        conn.commit()
-    finally:
-        conn.close()
+    return storage.insert_documents([(filename, text)], db_path)[0]
+
+
+def insert_documents_into_db(documents, db_path="corpus.db"):
+    """Insert (filename, text) pairs in one transaction.
+
+    Returns (stored filename, None) for each stored document and
+    (None, existing filename) for each duplicate of a stored one.
+    """
+    return storage.insert_documents(documents, db_path)
 
 
 def get_document_by_filename(filename, db_path="corpus.db"):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT filename, text_content, upload_date FROM documents WHERE filename = ?",
-        (filename,)
-    )
-    row = cursor.fetchone()
-    conn.close()
-    return row
+    return storage.fetch_document(filename, db_path)
 
 
 def delete_document_by_filename(filename, db_path="corpus.db"):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute(
-        "DELETE FROM documents WHERE filename = ?",
-        (filename,)
-    )
-    conn.commit()
-    conn.close()
+    storage.delete_documents([filename], db_path)
+
+
+def get_corpus_version(db_path="corpus.db"):
+    if not os.path.exists(db_path):
+        return None
+    try:
+        return storage.read_corpus_version(db_path)
+    except sqlite3.Error as e:
+        print(f"Database error: {e}")
+        return None
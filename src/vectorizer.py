@@ -1,3 +1,4 @@
+import logging
 from typing import List, Iterable
 
 from scipy.sparse import spmatrix
@@ -5,53 +6,79 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 import joblib
 import numpy as np
 
-from .preprocessing import preprocess_text
+from .parallel import preprocess_documents
+from .preprocessing import DEFAULT_PREPROCESSING
+from .profiling import span
 
-VECTORIZER =TfidfVectorizer(analyzer=preprocess_text)
+logger = logging.getLogger(__name__)
 
-def fit_vectorizer(documents: List[str]) ->TfidfVectorizer:
-    print("Fitting the TF-IDF vectorizer on the document corpus...")
-    VECTORIZER.fit(documents)
-    print("Vectorizer fitting complete.")
-    return VECTORIZER
 
+def pretokenized(tokens: List[str]) -> List[str]:
+    # Documents reach the vectorizer already preprocessed by `preprocess_documents`.
+    return tokens
 
-def transform_documents(documents: Iterable[str]) -> spmatrix:
-    print(f"Transforming {len(list(documents))} document(s) into TF-IDF vectors...")
-    vectors = VECTORIZER.transform(documents)
 
-    print("Transformation complete.")
+def new_vectorizer() -> TfidfVectorizer:
+    # Every fit gets its own vectorizer: a shared one would be refit under
+    # concurrent sessions and score them against each other's vocabulary.
+    return TfidfVectorizer(analyzer=pretokenized)
+
+
+def fit_vectorizer(documents: List[str], workers: int | None = None,
+                   preprocessing: str = DEFAULT_PREPROCESSING) ->TfidfVectorizer:
+    logger.info("Fitting the TF-IDF vectorizer on %d document(s)...", len(documents))
+    token_lists = preprocess_documents(documents, workers, mode=preprocessing)
+    vectorizer = new_vectorizer()
+    with span("fit"):
+        vectorizer.fit(token_lists)
+    logger.info("Vectorizer fitting complete.")
+    return vectorizer
+
+
+def transform_documents(documents: Iterable[str], vectorizer: TfidfVectorizer, workers: int | None = None,
+                        preprocessing: str = DEFAULT_PREPROCESSING) -> spmatrix:
+    # `preprocessing` must be the mode the vectorizer was fitted with.
+    documents = list(documents)
+    logger.info("Transforming %d document(s) into TF-IDF vectors...", len(documents))
+    token_lists = preprocess_documents(documents, workers, mode=preprocessing)
+    with span("transform"):
+        vectors = vectorizer.transform(token_lists)
+    logger.info("Transformation complete.")
     return vectors
 
-def vectorize_corpus(corpus: List[str]) -> spmatrix:
-    print("Fitting vectorizer and transforming corpus in one step...")
-    vectors = VECTORIZER.fit_transform(corpus)
-    print("Corpus vectorization complete.")
+def vectorize_corpus(corpus: List[str], workers: int | None = None,
+                     preprocessing: str = DEFAULT_PREPROCESSING) -> spmatrix:
+    logger.info("Fitting vectorizer and transforming %d document(s) in one step...", len(corpus))
+    token_lists = preprocess_documents(corpus, workers, mode=preprocessing)
+    with span("fit_transform"):
+        vectors = new_vectorizer().fit_transform(token_lists)
+    logger.info("Corpus vectorization complete.")
     return vectors
 
 
 def save_vectorizer(vectorizer: TfidfVectorizer, file_path: str):
     try:
-        print(f"Saving vectorizer to {file_path}...")
+        logger.info("Saving vectorizer to %s...", file_path)
         joblib.dump(vectorizer, file_path)
-        print("Vectorizer saved successfully.")
+        logger.info("Vectorizer saved successfully.")
     except Exception as e:
-        print(f"An error occurred while saving the vectorizer: {e}")
+        logger.error("An error occurred while saving the vectorizer: %s", e)
 
 def load_vectorizer(file_path: str) -> TfidfVectorizer | None:
     try:
-        print(f"Loading vectorizer from {file_path}...")
+        logger.info("Loading vectorizer from %s...", file_path)
         vectorizers = joblib.load(file_path)
-        print("Vectorizer loaded successfully.")
+        logger.info("Vectorizer loaded successfully.")
         return vectorizers
     except FileNotFoundError:
-        print(f"Error: Vectorizer file not found at {file_path}")
+        logger.error("Vectorizer file not found at %s", file_path)
         return None
     except Exception as e:
-        print(f"An error occurred while loading the vectorizer: {e}")
+        logger.error("An error occurred while loading the vectorizer: %s", e)
         return None
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     print("--- Demonstrating Sparse Matrix Handling ---")
 
     # 1. Create a small sample corpus of documents.
@@ -68,10 +95,9 @@ if __name__ == "__main__":
     print("\n--- Simulating a new application session ---")
     loaded_vectorizer = load_vectorizer(vectorizer_path)
     if loaded_vectorizer:
-        VECTORIZER=loaded_vectorizer
         new_doc="Is Python a good programming language?"
         print(f"\\nTransforming a new, unseen document: '{new_doc}'")
-        new_vector = transform_documents([new_doc])
+        new_vector = transform_documents([new_doc], loaded_vectorizer)
         print("Transformation successful with the loaded vectorizer.")
         print(f"Shape of the new vector: {new_vector.shape}")
         print("Sparse vector content:")